@@ -0,0 +1,2 @@
+from .synthetic import generate_reads, left_normalise, SyntheticTruth, CUAAC_TEMPLATE
+from .suite import run_benchmark, compare_to_truth
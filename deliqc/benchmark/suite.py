@@ -0,0 +1,234 @@
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence
+import os
+import numpy as np
+
+from deliqc.sample.alignment import _simple_analyzer, _advanced_analyzer
+from deliqc.sample.errors import TooManyMismatchesBetweenPair, TooManyMismatchesToReference, WeirdReads
+from deliqc.sample.load import load_sample
+from deliqc.sample.reader import read_lines
+from deliqc.sample.worker import WorkerData, worker
+from .synthetic import CUAAC_TEMPLATE, SyntheticTruth, generate_reads, left_normalise
+
+READ_COUNTS = (1000, 10000)
+THREAD_COUNTS = (1, 4)
+# Largest share of the injected events of each kind that may be missed or reported at another position
+TOLERANCE = 0.1
+# Bases the reads of the truncated sample end before the end of the template
+TRUNCATION = 2
+# Result arrays compared between thread counts, which have to give the same results
+COMPARED_KEYS = ("mismatches", "indels", "mutationTarget", "insertionTarget")
+
+
+def _time(function: Callable, *args, **kwargs) -> float:
+    start = perf_counter()
+    function(*args, **kwargs)
+    return perf_counter() - start
+
+
+def _timing(component: str, reads: int, seconds: float, **kwargs) -> dict:
+    return dict(component=component, reads=reads, seconds=seconds, pairsPerSecond=reads / seconds if seconds > 0 else 0.0, **kwargs)
+
+
+def _analyse_pairs(analyzer: Callable, pairs: List[tuple], **kwargs):
+    for r1, r2 in pairs:
+        try:
+            analyzer(r1, r2, **kwargs)
+        except (TooManyMismatchesBetweenPair, TooManyMismatchesToReference, WeirdReads):
+            pass
+
+
+def _read_pairs(fn1: str, fn2: str, reads: int):
+    for _ in zip(read_lines(fn1, reads), read_lines(fn2, reads)):
+        pass
+
+
+def recovered_events(result: dict, template: str) -> Dict[str, np.ndarray]:
+    """
+    Converts the normalised rates of a result of load_sample back into event counts per position, with insertions
+    and deletions moved to their leftmost position within homopolymer runs like in SyntheticTruth.
+    :param result:
+    :param template:
+    :return:
+    """
+    aligned = result["alignedReads"]
+    L = len(template)
+
+    mismatches = np.rint(result["mismatches"][:, 0] * aligned).astype(np.int64)
+    deletions = np.rint(result["indels"][:, 1, 0] * aligned).astype(np.int64)
+    insertion_target = np.rint(result["insertionTarget"][:, :, 0] * aligned).astype(np.int64)
+
+    insertions = np.zeros(L, dtype=np.int64)
+    normalised_deletions = np.zeros(L, dtype=np.int64)
+    for position in range(L):
+        normalised_deletions[left_normalise(template, 2, position)] += deletions[position]
+
+        for base in np.flatnonzero(insertion_target[position]):
+            insertions[left_normalise(template, 1, position, int(base))] += insertion_target[position, base]
+
+    return {"mismatches": mismatches, "insertions": insertions, "deletions": normalised_deletions}
+
+
+def compare_to_truth(result: dict, truth: SyntheticTruth, tolerance: float = TOLERANCE) -> dict:
+    """
+    Compares the events found by load_sample with the ones injected into a synthetic sample.
+
+    For each event kind, error is the amount of events missed or reported at another position (the absolute
+    difference per position, summed up), relative to the injected ones. The result passes if the errors are within
+    tolerance and all alignable pairs were aligned.
+    :param result: Normalised result of load_sample
+    :param truth:
+    :param tolerance:
+    :return:
+    """
+    recovered = recovered_events(result, truth.template)
+    comparison = {
+        "alignedReads": result["alignedReads"],
+        "alignablePairs": truth.alignablePairs,
+        "offTargetPairs": (result["offTargetPairs"], truth.offTargetPairs),
+        "mismatchedPairs": (result["mismatchedPairs"], truth.mismatchedPairs),
+        "tooManyPointMutations": (result["tooManyPointMutations"], truth.tooManyPointMutations),
+        "events": {},
+    }
+
+    passed = abs(result["alignedReads"] - truth.alignablePairs) <= tolerance * truth.alignablePairs
+    for kind, counts in recovered.items():
+        injected = getattr(truth, kind)
+        error = int(np.abs(counts - injected).sum())
+        share = error / max(int(injected.sum()), 1)
+
+        comparison["events"][kind] = {
+            "injected": int(injected.sum()),
+            "recovered": int(counts.sum()),
+            "error": error,
+            "errorShare": share,
+            "maxRateError": float(np.abs(counts - injected).max() / max(truth.alignablePairs, 1)),
+        }
+        passed = passed and share <= tolerance
+
+    comparison["passed"] = bool(passed)
+
+    return comparison
+
+
+def _same_results(a: dict, b: dict) -> bool:
+    if any(a[key] != b[key] for key in ("reads", "alignedReads", "mismatchedPairs", "offTargetPairs", "tooManyPointMutations")):
+        return False
+
+    return all(np.array_equal(a[key], b[key], equal_nan=True) for key in COMPARED_KEYS)
+
+
+def run_benchmark(
+        directory: str,
+        read_counts: Sequence[int] = READ_COUNTS,
+        thread_counts: Sequence[int] = THREAD_COUNTS,
+        template: str = CUAAC_TEMPLATE,
+        tolerance: float = TOLERANCE,
+        max_point_mutations: int = 5,
+        seed: int = 0,
+        log: Callable[[str], None] = print,
+        **rates,
+) -> dict:
+    """
+    Generates a synthetic sample (gzip compressed and plain) for every read count in directory, and times reading
+    (read_lines), the analyzers (_simple_analyzer and _advanced_analyzer on every pair), worker and load_sample with
+    each thread count on it. The first three run in a single process.
+
+    The results of load_sample are compared to the injected events (see compare_to_truth), and the results of all
+    thread counts have to be the same. The accuracy is also checked on a sample of the smallest read count whose
+    reads end TRUNCATION bases before the end of the template.
+    :param directory: Where the synthetic samples are written to
+    :param read_counts:
+    :param thread_counts:
+    :param template: DNA template sequence, N marks codons
+    :param tolerance: See compare_to_truth
+    :param max_point_mutations:
+    :param seed: Random seed of the synthetic samples
+    :param log: Called with a line for every step
+    :param rates: Rates of the synthetic samples (see generate_reads)
+    :return: timings (component, reads, format or threads, seconds and pairsPerSecond) and accuracy (per read count
+        and read length)
+    """
+    timings = []
+    accuracy = []
+
+    for reads in read_counts:
+        files = {
+            "gz": (os.path.join(directory, f"synthetic_{reads}_1.fq.gz"), os.path.join(directory, f"synthetic_{reads}_2.fq.gz")),
+            "plain": (os.path.join(directory, f"synthetic_{reads}_1.fq"), os.path.join(directory, f"synthetic_{reads}_2.fq")),
+        }
+
+        log(f"Generating {reads} synthetic read pairs")
+        for fn1, fn2 in files.values():
+            truth = generate_reads(fn1, fn2, reads, template, max_point_mutations=max_point_mutations, seed=seed, **rates)
+
+        for file_format, (fn1, fn2) in files.items():
+            timings.append(_timing("read_lines", reads, _time(_read_pairs, fn1, fn2, reads), format=file_format))
+            log(f" - read_lines ({file_format}): {timings[-1]['pairsPerSecond']:.0f} pairs/s")
+
+        fn1, fn2 = files["gz"]
+        pairs = list(zip(read_lines(fn1, reads), read_lines(fn2, reads)))
+
+        data = WorkerData(
+            reference=template,
+            max_pair_mismatches=0,
+            prefer_mate=False,
+            max_point_mutations=max_point_mutations,
+            split_on_codon=0,
+            codons=[],
+        )
+        compiled = data.reference
+
+        seconds = _time(_analyse_pairs, _simple_analyzer, pairs, **data.kwargs, packed_reference=compiled.packedReference)
+        timings.append(_timing("_simple_analyzer", reads, seconds, threads=1))
+
+        seconds = _time(
+            _analyse_pairs, _advanced_analyzer, pairs, **data.kwargs,
+            profile=compiled.profile, backend=data.backend, adapter_seeds=compiled.adapterSeeds,
+        )
+        timings.append(_timing("_advanced_analyzer", reads, seconds, threads=1))
+
+        seconds = _time(lambda: [worker((i, pair, 1), data) for i, pair in enumerate(pairs)])
+        timings.append(_timing("worker", reads, seconds, threads=1))
+
+        for timing in timings[-3:]:
+            log(f" - {timing['component']}: {timing['pairsPerSecond']:.0f} pairs/s")
+
+        results = []
+        for threads in thread_counts:
+            start = perf_counter()
+            result = load_sample(template, fn1, fn2, max_reads=reads, threads=threads, max_point_mutations=max_point_mutations)
+            timings.append(_timing("load_sample", reads, perf_counter() - start, threads=threads))
+            results.append(result)
+            log(f" - load_sample ({threads} threads): {timings[-1]['pairsPerSecond']:.0f} pairs/s")
+
+        comparison = compare_to_truth(results[0], truth, tolerance)
+        comparison["reads"] = reads
+        comparison["readLength"] = None
+        comparison["consistent"] = all(_same_results(results[0], result) for result in results[1:])
+        accuracy.append(comparison)
+        _log_accuracy(log, comparison)
+
+    # Reads that end inside the template
+    reads = min(read_counts)
+    read_length = len(template) - TRUNCATION
+    fn1 = os.path.join(directory, f"synthetic_{reads}_truncated_1.fq.gz")
+    fn2 = os.path.join(directory, f"synthetic_{reads}_truncated_2.fq.gz")
+
+    log(f"Generating {reads} synthetic read pairs of {read_length} bases")
+    truth = generate_reads(fn1, fn2, reads, template, read_length=read_length, max_point_mutations=max_point_mutations, seed=seed, **rates)
+    result = load_sample(template, fn1, fn2, max_reads=reads, threads=max(thread_counts), max_point_mutations=max_point_mutations)
+
+    comparison = compare_to_truth(result, truth, tolerance)
+    comparison["reads"] = reads
+    comparison["readLength"] = read_length
+    comparison["consistent"] = True
+    accuracy.append(comparison)
+    _log_accuracy(log, comparison)
+
+    return {"timings": timings, "accuracy": accuracy}
+
+
+def _log_accuracy(log: Callable[[str], None], comparison: dict):
+    errors = ", ".join(f"{kind} {events['errorShare'] * 100:.1f}%" for kind, events in comparison["events"].items())
+    log(f" - Accuracy: {comparison['alignedReads']} of {comparison['alignablePairs']} pairs aligned, errors {errors}")
@@ -0,0 +1,226 @@
+from typing import Dict
+import gzip
+import numpy as np
+
+from deliqc import dna
+from deliqc.sample.prefilter import ADAPTERS
+
+# Template of the CuAAC example in the README
+CUAAC_TEMPLATE = "AGAGTATCCATCCGTAGTAAAAAATCCATTCACCGAACTTGGATCCGCACACAAAAGACAATTCACACACGTCCCATCCAGAATTCACAAGCTCC"
+
+# Indels are not injected this close to the ends of the template, where an alignment cannot place them
+INDEL_MARGIN = 4
+# Indels are not injected this close to the end of reads that end inside the template, as there are no adapter bases
+# behind them that could tell an indel from mismatches
+READ_END_MARGIN = 8
+
+
+def left_normalise(reference: str, kind: int, position: int, base: int = -1) -> int:
+    """
+    Moves an insertion (kind 1, before position) or deletion (kind 2) to the leftmost position it could be reported
+    at. Within a homopolymer run, an indel can be placed at any of its bases with the same outcome, and analyzers may
+    choose any of them.
+    :param reference:
+    :param kind: AlignedReadResult.INSERTION or AlignedReadResult.DELETION
+    :param position:
+    :param base: Base index of the inserted base
+    :return:
+    """
+    if kind == 1:
+        inserted = dna.bases[base]
+        while position > 0 and reference[position - 1] == inserted:
+            position -= 1
+    elif kind == 2:
+        while position > 0 and reference[position - 1] == reference[position] and reference[position] != "N":
+            position -= 1
+
+    return position
+
+
+class SyntheticTruth:
+    """
+    Events injected into a synthetic sample (see generate_reads), indexed by template position like the results of
+    load_sample. Event counters only cover the pairs that are expected to be aligned (alignablePairs): pairs that are
+    on target, whose mates agree and that have at most max_point_mutations point mutations.
+
+    - mismatches, mutationTarget: point mutations per position, and per position and base index
+    - insertions, insertionTarget: insertions before each position, and per position and inserted base index
+    - deletions: deleted bases per position
+    - offTargetPairs, mismatchedPairs, tooManyPointMutations: pairs injected as random sequences, with a sequencing
+      error in only one mate, or with too many point mutations
+
+    Insertions and deletions are counted at their leftmost position within homopolymer runs (see left_normalise).
+    """
+    def __init__(self, template: str, reads: int):
+        L = len(template)
+
+        self.template = template
+        self.reads = reads
+        self.alignablePairs = 0
+        self.offTargetPairs = 0
+        self.mismatchedPairs = 0
+        self.tooManyPointMutations = 0
+
+        self.mismatches = np.zeros(L, dtype=np.int64)
+        self.mutationTarget = np.zeros((L, 5), dtype=np.int64)
+        self.insertions = np.zeros(L, dtype=np.int64)
+        self.insertionTarget = np.zeros((L, 5), dtype=np.int64)
+        self.deletions = np.zeros(L, dtype=np.int64)
+
+    def rates(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the injected rate of each event kind per position, relative to the alignable pairs.
+        :return:
+        """
+        total = max(self.alignablePairs, 1)
+
+        return {
+            "mismatches": self.mismatches / total,
+            "insertions": self.insertions / total,
+            "deletions": self.deletions / total,
+        }
+
+
+def _mutate(template: str, rng: np.random.Generator, point_mutation_rate: float, insertion_rate: float, deletion_rate: float, indel_end: int):
+    """
+    Returns the amplicon of one library member with random events, and its events as (position, kind, base, index),
+    where index is the first base of the amplicon that shows the event.
+    """
+    L = len(template)
+    amplicon = []
+    events = []
+
+    draws = rng.random((L, 2))
+    for i, reference_base in enumerate(template):
+        if reference_base == "N":
+            # Library member: any codon, which does not count as mutation
+            amplicon.append(dna.bases[rng.integers(4)])
+            continue
+
+        indel_allowed = INDEL_MARGIN <= i < indel_end and template[i - 1] != "N"
+
+        if indel_allowed and draws[i, 1] < insertion_rate:
+            base = int(rng.integers(4))
+            events.append((i, 1, base, len(amplicon)))
+            amplicon.append(dna.bases[base])
+
+        u = draws[i, 0]
+        if u < point_mutation_rate:
+            base = (dna.baseToIndexDict[reference_base] + 1 + int(rng.integers(3))) % 4
+            events.append((i, 0, base, len(amplicon)))
+            amplicon.append(dna.bases[base])
+        elif indel_allowed and u < point_mutation_rate + deletion_rate:
+            # Seen at the base following the deletion
+            events.append((i, 2, -1, len(amplicon)))
+        else:
+            amplicon.append(reference_base)
+
+    return "".join(amplicon), events
+
+
+def _random_sequence(rng: np.random.Generator, length: int) -> str:
+    return "".join(dna.bases[b] for b in rng.integers(4, size=length))
+
+
+def _sequencing_error(read: str, position: int, rng: np.random.Generator) -> str:
+    base = dna.bases[(dna.baseToIndexDict[read[position]] + 1 + int(rng.integers(3))) % 4]
+    return read[:position] + base + read[position + 1:]
+
+
+def _read_through(insert: str, adapter: str, read_length: int, rng: np.random.Generator) -> str:
+    read = insert + adapter
+    return (read + _random_sequence(rng, max(0, read_length - len(read))))[:read_length]
+
+
+def generate_reads(
+        fn1: str,
+        fn2: str,
+        reads: int,
+        template: str = CUAAC_TEMPLATE,
+        read_length: int = 120,
+        point_mutation_rate: float = 0.005,
+        insertion_rate: float = 0.001,
+        deletion_rate: float = 0.001,
+        pair_mismatch_rate: float = 0.01,
+        off_target_rate: float = 0.01,
+        max_point_mutations: int = 5,
+        seed: int = None,
+) -> SyntheticTruth:
+    """
+    Writes a synthetic paired-end sample to fn1 and fn2 (gzip compressed if the filename ends with .gz) and returns
+    the events injected into it.
+
+    Every pair is one amplicon of the template: N positions get random codons, every other base is mutated with
+    point_mutation_rate or deleted with deletion_rate, and a random base is inserted before it with insertion_rate.
+    Mate 2 reads the amplicon and mate 1 its reverse complement, both reading through into the TruSeq adapters
+    if read_length is longer than the amplicon. Amplicons longer than read_length are truncated at it, so that both
+    mates end inside the template; events behind their end are not part of the truth, and no indels are injected
+    within READ_END_MARGIN bases of it. With pair_mismatch_rate, one base of one mate gets a sequencing error, and with
+    off_target_rate, both mates are random sequences.
+    :param fn1:
+    :param fn2:
+    :param reads: Amount of read pairs
+    :param template: DNA template sequence, N marks codons
+    :param read_length: Length of each mate
+    :param point_mutation_rate:
+    :param insertion_rate:
+    :param deletion_rate:
+    :param pair_mismatch_rate:
+    :param off_target_rate:
+    :param max_point_mutations: Pairs with more point mutations are not counted as alignable in the truth
+    :param seed: Random seed
+    :return:
+    """
+    indel_end = len(template) - INDEL_MARGIN
+    if read_length < len(template):
+        indel_end = min(indel_end, read_length - READ_END_MARGIN)
+
+    rng = np.random.default_rng(seed)
+    truth = SyntheticTruth(template, reads)
+    opener = gzip.open if fn1.endswith(".gz") else open
+    qualities = "F" * read_length
+
+    with opener(fn1, "wt") as fh1, opener(fn2, "wt") as fh2:
+        for i in range(reads):
+            header = f"@SYN:1:FC:1:{1101 + i % 4}:{i % 10000}:{i // 10000}"
+            amplicon, events = _mutate(template, rng, point_mutation_rate, insertion_rate, deletion_rate, indel_end)
+            amplicon = amplicon[:read_length]
+            events = [(position, kind, base) for position, kind, base, index in events if index < len(amplicon)]
+
+            if rng.random() < off_target_rate:
+                r1 = _random_sequence(rng, read_length)
+                r2 = _random_sequence(rng, read_length)
+                truth.offTargetPairs += 1
+            else:
+                r1 = _read_through(dna.reverse_complement(amplicon), ADAPTERS["TruSeq read 1"], read_length, rng)
+                r2 = _read_through(amplicon, ADAPTERS["TruSeq read 2"], read_length, rng)
+
+                point_mutations = sum(1 for _, kind, _ in events if kind == 0)
+
+                if rng.random() < pair_mismatch_rate:
+                    # Sequencing error within the insert of one mate
+                    position = int(rng.integers(len(amplicon)))
+                    if rng.random() < 0.5:
+                        r1 = _sequencing_error(r1, position, rng)
+                    else:
+                        r2 = _sequencing_error(r2, position, rng)
+                    truth.mismatchedPairs += 1
+                elif point_mutations > max_point_mutations:
+                    truth.tooManyPointMutations += 1
+                else:
+                    truth.alignablePairs += 1
+                    for position, kind, base in events:
+                        if kind == 0:
+                            truth.mismatches[position] += 1
+                            truth.mutationTarget[position, base] += 1
+                        elif kind == 1:
+                            position = left_normalise(template, kind, position, base)
+                            truth.insertions[position] += 1
+                            truth.insertionTarget[position, base] += 1
+                        else:
+                            truth.deletions[left_normalise(template, kind, position)] += 1
+
+            fh1.write(f"{header} 1:N:0:1\n{r1}\n+\n{qualities}\n")
+            fh2.write(f"{header} 2:N:0:1\n{r2}\n+\n{qualities}\n")
+
+    return truth
@@ -0,0 +1,76 @@
+import argh
+from colorama import init
+from deliqc.cli.helpers import critical
+from deliqc.benchmark import run_benchmark, CUAAC_TEMPLATE
+from deliqc import dna
+import json
+import tempfile
+
+
+@argh.arg("--reads", type=int, nargs="+")
+@argh.arg("--threads", type=int, nargs="+")
+@argh.arg("--template", type=str)
+@argh.arg("--directory", type=str)
+@argh.arg("--save-as", type=str)
+@argh.arg("--seed", type=int)
+@argh.arg("--tolerance", type=float)
+@argh.arg("--point-mutation-rate", type=float)
+@argh.arg("--insertion-rate", type=float)
+@argh.arg("--deletion-rate", type=float)
+@argh.arg("--pair-mismatch-rate", type=float)
+@argh.arg("--off-target-rate", type=float)
+def benchmark(
+        reads: "Amount of synthetic read pairs to benchmark with" = [1000, 10000],
+        threads: "Numbers of threads to run load_sample with" = [1, 4],
+        template: "DNA template sequence of the synthetic reads. Use N to mark codons." = CUAAC_TEMPLATE,
+        directory: "Directory to write the synthetic reads to. Defaults to a temporary directory." = None,
+        save_as: "Filename to save the timings and the accuracy as JSON" = None,
+        seed: "Random seed for the synthetic reads" = 0,
+        tolerance: "Largest share of the injected events of each kind that may be missed or misplaced" = 0.1,
+        point_mutation_rate: "Rate of point mutations per base" = 0.005,
+        insertion_rate: "Rate of insertions per base" = 0.001,
+        deletion_rate: "Rate of deletions per base" = 0.001,
+        pair_mismatch_rate: "Share of pairs with a sequencing error in one mate" = 0.01,
+        off_target_rate: "Share of pairs with random sequences" = 0.01,
+):
+    """ Times deliqc on synthetic reads and checks the results against the injected events """
+    init()
+
+    template = dna.sanitise(template)
+
+    if not dna.is_valid(template):
+        critical("DNA must only contain A, T, G, C or N.")
+
+    if any(n <= 0 for n in reads) or any(n <= 0 for n in threads):
+        critical("Amounts of reads and threads must be at least 1.")
+
+    with tempfile.TemporaryDirectory() as temporary:
+        results = run_benchmark(
+            directory if directory is not None else temporary,
+            read_counts=reads,
+            thread_counts=threads,
+            template=template,
+            tolerance=tolerance,
+            seed=seed,
+            point_mutation_rate=point_mutation_rate,
+            insertion_rate=insertion_rate,
+            deletion_rate=deletion_rate,
+            pair_mismatch_rate=pair_mismatch_rate,
+            off_target_rate=off_target_rate,
+        )
+
+    if save_as is not None:
+        with open(save_as, "w") as fh:
+            json.dump(results, fh, indent=2)
+
+        print(f"File saved ({save_as})")
+
+    for accuracy in results["accuracy"]:
+        sample = f"{accuracy['reads']} reads"
+        if accuracy["readLength"] is not None:
+            sample += f" of {accuracy['readLength']} bases"
+
+        if not accuracy["passed"]:
+            critical(f"Results of {sample} differ from the injected events by more than the tolerance.")
+        if not accuracy["consistent"]:
+            critical(f"Results of {sample} differ between thread counts.")
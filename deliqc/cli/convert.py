@@ -0,0 +1,22 @@
+import argh
+from colorama import init
+from deliqc.cli.helpers import critical
+from deliqc.sample.store import convert_pickle, is_result_file
+
+
+@argh.arg("--compress", default=False)
+def convert(
+        filename: "Pickle saved by an earlier version of deliqc run",
+        save_as: "Target filename of the result file",
+        compress: "Compress the arrays of the result file" = False,
+):
+    """ Converts a pickle saved by deliqc run into a result file """
+    init()
+
+    if is_result_file(filename):
+        critical(f"{filename} already is a result file.")
+
+    replicates = convert_pickle(filename, save_as, compress)
+
+    print(f"Converted {replicates} replicates.")
+    print(f"File saved ({save_as})")
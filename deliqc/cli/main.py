@@ -1,9 +1,12 @@
 import argh
-from deliqc.cli import about, run, helpers, plot
+from deliqc.cli import about, run, helpers, plot, merge, benchmark, convert
 
 commands = [
     about.about,
+    benchmark.benchmark,
+    convert.convert,
     run.run,
+    merge.merge,
     plot.plot,
 ]
 
@@ -0,0 +1,80 @@
+import argh
+from colorama import init
+from deliqc.cli.helpers import critical, warning
+from deliqc.cli.run import print_replicate, save_sample, summarise
+from deliqc.sample.load import merge_raw_results, normalise_result
+import pickle
+
+# Options of a shard (see load_samples) that may differ between the shards of a run
+UNCHECKED_OPTIONS = ("files", "shard", "eventLog")
+
+
+@argh.arg("shards", nargs="+")
+@argh.arg("--format", choices=["dqr", "pickle"])
+@argh.arg("--compress", default=False)
+def merge(
+        save_as: "Target filename to save the merged data for post-analysis",
+        shards: "Files saved by deliqc run --shard, one for each shard",
+        format: "Format of the saved results: a result file of raw counts (dqr) or the pickle of earlier versions" = "dqr",
+        compress: "Compress the arrays of the result file" = False,
+):
+    """ Merges the shards of a run into one sample """
+    init()
+
+    parts = []
+    for filename in shards:
+        with open(filename, "rb") as fh:
+            part = pickle.load(fh)
+
+        if "shard" not in part:
+            critical(f"{filename} was not saved by deliqc run --shard.")
+
+        if "options" not in part:
+            critical(f"{filename} was saved by an older version without its options. Run the shard again.")
+
+        parts.append(part)
+
+    first = parts[0]
+
+    # Everything that decides which records a shard covers and how they are counted has to be the same. Only the
+    # names of the files and the event log may differ.
+    different = sorted({
+        key for part in parts for key in first["options"].keys() | part["options"].keys()
+        if key not in UNCHECKED_OPTIONS and part["options"].get(key) != first["options"].get(key)
+    })
+    if len(different) > 0:
+        critical(f"Shards were not run with the same options ({', '.join(different)}).")
+
+    if any(len(part["files"]) != len(first["files"]) for part in parts):
+        critical("Shards were not run on the same amount of files.")
+
+    if any(part["files"] != first["files"] for part in parts):
+        warning("Shards were run on files with different names.")
+
+    # Every shard has to be there exactly once
+    count = first["shard"][1]
+    if any(part["shard"][1] != count for part in parts):
+        critical("Shards were not run with the same number of shards.")
+
+    found = [part["shard"][0] for part in parts]
+    missing = sorted(set(range(count)) - set(found))
+    duplicates = sorted({i for i in found if found.count(i) > 1})
+
+    if len(missing) > 0:
+        critical(f"Shards {', '.join(map(str, missing))} of {count} are missing.")
+
+    if len(duplicates) > 0:
+        critical(f"Shards {', '.join(map(str, duplicates))} were given more than once.")
+
+    print(f"Merging {count} shards of {len(first['files'])} samples.")
+
+    raw_results = []
+    results = []
+    for i, (f1, f2) in enumerate(first["files"]):
+        raw_results.append(merge_raw_results([part["replicates"][i] for part in parts]))
+        results.append(normalise_result(raw_results[-1], first["splitOnCodonSequences"]))
+        print_replicate(f1, f2, results[-1])
+
+    sample = summarise(first["title"], first["reference"], first["splitOnCodon"], first["splitOnCodonSequences"], results)
+
+    save_sample(save_as, sample, raw_results, format, compress)
@@ -1,10 +1,16 @@
 import pickle
 from deliqc.plotting import plot_point_mutation_rate
+from deliqc.sample.store import ResultFile, is_result_file
 
 def plot(
-        filename: "Pickle file generated by the run command.",
+        filename: "Result file or pickle generated by the run command.",
 ):
-    with open(filename, "rb") as fh:
-        sample = pickle.load(fh)
+    if is_result_file(filename):
+        # Only the mismatch counters are read from the result file
+        result = ResultFile(filename)
+        sample = {"title": result.title, "reference": result.reference, "mismatches": result.summary("mismatches")}
+    else:
+        with open(filename, "rb") as fh:
+            sample = pickle.load(fh)
 
-    plot_point_mutation_rate(sample)
\ No newline at end of file
+    plot_point_mutation_rate(sample)
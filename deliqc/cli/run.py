@@ -2,22 +2,50 @@ import argh
 from colorama import init, Fore, Style
 import os
 from deliqc.cli.helpers import critical, warning, expand_filepattern
-from deliqc.sample.load import load_sample
+from deliqc.sample.load import load_samples, average_results, normalise_result
+from deliqc.sample.store import save_result
+from deliqc.sample.metrics import RunMetrics
+from deliqc.sample.errors import IncompatibleCheckpoint
+from deliqc.sample.reader import read_batches
+from deliqc.sample.alignment import check_backend
+from deliqc.sample import kernels
 import glob
 from deliqc import dna
 from multiprocessing import cpu_count
 from timeit import default_timer as timer
 import numpy as np
 import pickle
+from typing import List
 
 
 @argh.arg("--threads", type=int, default=4)
 @argh.arg("--max-reads", type=int)
 @argh.arg("--max-pair-mismatches", type=int)
 @argh.arg("--max-point-mutations", type=int)
-@argh.arg("--split-on-codon", type=int)
-@argh.arg("--codons", type=list, nargs="+", default=[])
+@argh.arg("--split-on-codon", type=int, nargs="+")
+@argh.arg("--codons", type=str, nargs="+", default=[])
 @argh.arg("--title", type=str)
+@argh.arg("--sampling", choices=["head", "random", "tile"])
+@argh.arg("--seed", type=int)
+@argh.arg("--min-mean-quality", type=float)
+@argh.arg("--max-low-quality-bases", type=int)
+@argh.arg("--low-quality-threshold", type=int)
+@argh.arg("--trim-quality", type=int)
+@argh.arg("--max-unique-pairs", type=int)
+@argh.arg("--backend", choices=list(kernels.BACKENDS))
+@argh.arg("--combine-codons", default=False)
+@argh.arg("--member-sketch-width", type=int)
+@argh.arg("--max-members", type=int)
+@argh.arg("--adapters", type=str, nargs="+")
+@argh.arg("--shard", type=int)
+@argh.arg("--shards", type=int)
+@argh.arg("--checkpoint-interval", type=float)
+@argh.arg("--resume", default=False)
+@argh.arg("--progress-interval", type=float)
+@argh.arg("--stats", type=str)
+@argh.arg("--format", choices=["dqr", "pickle"])
+@argh.arg("--compress", default=False)
+@argh.arg("--event-log", type=str)
 def run(
         sequence: "DNA template sequence. Use N to mark codons.",
         r1: "Main read file to run deliqc on. Reads must be in same order as given in sequence. Use * for wildcards to select multiple files.",
@@ -27,9 +55,30 @@ def run(
         max_reads: "Maximum amount of reads" = 10_000,
         max_pair_mismatches: "Maximum amount of mismatches between pairs" = 0,
         max_point_mutations: "Maximum amount of point mutations before a read is skipped" = 5,
-        split_on_codon: "Codon to split the results on" = 0,
+        split_on_codon: "Codon to split the results on. Several codons split the results on every codon found at each of them." = 0,
         codons: "Codons to split the results on" = [],
         title: "A title to use within the file" = None,
+        sampling: "How to select --max-reads pairs: the first ones (head), uniformly (random) or stratified by tile (tile)" = "head",
+        seed: "Random seed for sampling" = None,
+        min_mean_quality: "Skip pairs with a mate whose mean Phred quality is below this value" = None,
+        max_low_quality_bases: "Skip pairs with a mate having more low quality bases than this" = None,
+        low_quality_threshold: "Phred quality below which a base counts as low quality" = 20,
+        trim_quality: "Trim reads at the first base below this Phred quality and skip pairs that become too short" = None,
+        max_unique_pairs: "Size of the table used to analyse identical read pairs only once. 0 disables this." = 100_000,
+        backend: "Implementation of the analyzer kernels. numba requires numba to be installed." = "numpy",
+        combine_codons: "Split on the combination of the codons given by --split-on-codon instead of each one" = False,
+        member_sketch_width: "Count library members approximately in a count-min sketch of this width. 0 counts exactly." = 0,
+        max_members: "Maximum amount of library members reported when counting approximately" = 100_000,
+        adapters: "Adapter sequences read through after inserts shorter than the reads. Defaults to common Illumina adapters." = None,
+        shard: "Only analyse this part (0 to --shards - 1) of the selected reads, and save raw counts for deliqc merge" = None,
+        shards: "Number of parts the selected reads are split into with --shard" = 1,
+        checkpoint_interval: "Seconds between checkpoints saved next to save-as (with the suffix .checkpoint). 0 disables checkpoints." = 300,
+        resume: "Continue from the checkpoint of an interrupted run with the same options" = False,
+        progress_interval: "Seconds between progress lines. 0 disables them." = 10,
+        stats: "Filename to save the throughput, queue depths and failures of the run as JSON" = None,
+        format: "Format of the saved results: a result file of raw counts (dqr) or the pickle of earlier versions" = "dqr",
+        compress: "Compress the arrays of the result file" = False,
+        event_log: "Filename to stream the events, codons and failure reason of every read pair to" = None,
 ):
     """ Main runner for extraction"""
     init()
@@ -47,6 +96,12 @@ def run(
     if not dna.is_valid(sanitised_sequence):
         critical("DNA must only contain A, T, G, C or N.")
 
+    if adapters is not None:
+        adapters = [dna.sanitise(adapter) for adapter in adapters]
+
+        if not all(dna.is_valid(adapter) for adapter in adapters):
+            critical("Adapters must only contain A, T, G, C or N.")
+
     # Check if r1 and r2 make sense
     try:
         r1 = expand_filepattern(r1)
@@ -58,89 +113,233 @@ def run(
     if len(r1) != len(r2):
         critical(f"r1 and r2 must have an equal amount of files.")
 
+    # argh always gives a list. A single position only splits on the given codons, like the default.
+    if isinstance(split_on_codon, list) and len(split_on_codon) == 1:
+        split_on_codon = split_on_codon[0]
+
+    # Codon positions are numbered from 0 in the order of the codons in the sequence. A single 0 does not split.
+    if isinstance(split_on_codon, list):
+        positions = split_on_codon
+    else:
+        positions = [split_on_codon] if split_on_codon != 0 else []
+
+    coordinates = dna.get_codon_coordinates(sanitised_sequence)
+    for position in positions:
+        if len(coordinates) == 0:
+            critical(f"Cannot split on codon {position}, the sequence has no codons marked with N.")
+        elif not 0 <= position < len(coordinates):
+            critical(f"Codon number {position} is beyond limits, the sequence has codons 0 to {len(coordinates) - 1}.")
+
     # Check other parameters
     if max_reads <= 0:
         critical(f"Maximum amount of reads must be at least 1.")
 
+    if shard is not None:
+        if not 0 <= shard < shards:
+            critical(f"Shard must be between 0 and {shards - 1}.")
+
+        # Every shard has to draw the same subsample
+        if sampling != "head" and seed is None:
+            critical(f"Sampling {sampling} needs a --seed when running shards.")
+
     if threads <= 0:
         warning("Number of threads was less than 1 and therefore forced to 1.")
         threads = 1
     elif threads > cpu_count():
         warning("Number of threads exceeds cpu count.")
 
+    if backend != "numpy":
+        if not kernels.available(backend):
+            warning(f"Backend {backend} is not available, falling back to numpy.")
+            backend = "numpy"
+        else:
+            # Make sure the backend gives the same results as the reference implementation before using it, on whole
+            # reads as the run gets them
+            batch = next(read_batches(r1[0], r2[0], 200), None)
+
+            if batch is not None:
+                differences = check_backend(
+                    backend, batch, sanitised_sequence,
+                    max_pair_mismatches=max_pair_mismatches,
+                    max_point_mutations=max_point_mutations,
+                    prefer_mate=False,
+                    split_on_codon=split_on_codon if isinstance(split_on_codon, int) else split_on_codon[0],
+                    codons=codons,
+                    adapters=adapters,
+                )
+
+                if differences > 0:
+                    warning(f"Backend {backend} differs from numpy for {differences} read pairs, falling back to numpy.")
+                    backend = "numpy"
+
+    # Counts are saved regularly, so that an interrupted run can be continued with --resume
+    checkpoint = f"{save_as}.checkpoint" if checkpoint_interval > 0 else None
+
+    if resume:
+        if checkpoint is None:
+            critical("--resume needs checkpoints, --checkpoint-interval must be above 0.")
+        elif not os.path.exists(checkpoint):
+            warning(f"No checkpoint {checkpoint} found, starting from the beginning.")
+        else:
+            print(f"Continuing from checkpoint {checkpoint}.")
+
     start = timer()
+    metrics = RunMetrics(progress_interval if progress_interval > 0 else None)
 
-    # Iterate over the samples
+    # All samples are analysed at the same time on one pool of threads workers, and share the reader threads
     print(f"Found {len(r1)} samples.")
-    results = []
     for f1, f2 in zip(r1, r2):
         print(f" - Starting to extract {max_reads} from {f1} and {f2}")
-        result = load_sample(
+
+    options = {}
+    try:
+        results = load_samples(
             sanitised_sequence,
-            f1, f2,
+            list(zip(r1, r2)),
             max_reads=max_reads,
             max_pair_mismatches=max_pair_mismatches,
             max_point_mutations=max_point_mutations,
             split_on_codon=split_on_codon,
-            codons=codons
+            codons=codons,
+            threads=threads,
+            reader_threads=max(1, threads // len(r1)),
+            sampling=sampling,
+            seed=seed,
+            min_mean_quality=min_mean_quality,
+            max_low_quality_bases=max_low_quality_bases,
+            low_quality_threshold=low_quality_threshold,
+            trim_quality=trim_quality,
+            max_unique_pairs=max_unique_pairs,
+            backend=backend,
+            combine_codons=combine_codons,
+            member_sketch_width=member_sketch_width,
+            max_members=max_members,
+            adapters=adapters,
+            shard=(shard, shards) if shard is not None else None,
+            raw=True,
+            checkpoint=checkpoint,
+            checkpoint_interval=checkpoint_interval,
+            resume=resume,
+            metrics=metrics,
+            event_log=event_log,
+            options=options,
         )
+    except IncompatibleCheckpoint as e:
+        critical(f"{e} Remove it or run without --resume.")
+    print()
+
+    title = title if title is not None else r1[0].split(".")[0]
 
-        print(f"    - Reads found: {result['reads']}")
-        print(f"    - Reads aligned: {result['alignedReads']}")
-        print(f"    - Reads skipped (mate mismatches): {result['mismatchedPairs']}")
-        print(f"    - Reads skipped (too many point mutations): {result['tooManyPointMutations']}")
-        print()
-
-        results.append(result)
-
-    sample = {
-        "title": title if title is not None else r1[0].split(".")[0],
-        "reference": sanitised_sequence,
-        "splitOnCodon": split_on_codon,
-        "splitOnCodonSequences": codons,
-        "replicates": results,
-        "mismatches": (
-            np.mean([r["mismatches"] for r in results], axis=0),
-            np.std([r["mismatches"] for r in results], axis=0),
-        ),
-        "indels": (
-            np.mean([r["indels"] for r in results], axis=0),
-            np.std([r["indels"] for r in results], axis=0),
-        ),
-        "mutationTarget": (
-            np.mean([r["mutationTarget"] for r in results], axis=0),
-            np.std([r["mutationTarget"] for r in results], axis=0),
-        ),
-        "insertionTarget": (
-            np.mean([r["insertionTarget"] for r in results], axis=0),
-            np.std([r["insertionTarget"] for r in results], axis=0),
-        ),
-
-        "reads": np.mean([r["reads"] for r in results]),
-        "mismatchedPairs": np.mean([r["mismatchedPairs"] for r in results]),
-        "tooManyPointMutations": np.mean([r["tooManyPointMutations"] for r in results]),
-        "alignedReads": np.mean([r["alignedReads"] for r in results]),
-    }
-
-    aligned_reads_per_codon = {}
-    for k in results[0]["alignedReadsPerCodon"].keys():
-        aligned_reads_per_codon[k] = np.mean([r["alignedReadsPerCodon"][k] for r in results])
-    sample["alignedReadsPerCodon"] = aligned_reads_per_codon
+    raw_results = results
+    results = [normalise_result(result, codons) for result in raw_results]
+
+    for f1, f2, result in zip(r1, r2, results):
+        print_replicate(f1, f2, result)
+
+    if shard is not None:
+        # Raw counts of this shard, which deliqc merge adds up with the other shards
+        sample = {
+            "title": title,
+            "reference": sanitised_sequence,
+            "splitOnCodon": split_on_codon,
+            "splitOnCodonSequences": codons,
+            "files": list(zip(r1, r2)),
+            "shard": (shard, shards),
+            "options": options,
+            "replicates": raw_results,
+        }
+    else:
+        sample = summarise(title, sanitised_sequence, split_on_codon, codons, results)
+
+    stop = timer()
+
+    print(f"\n... Done [{stop-start:.1f} seconds]")
+
+    # Shards are always pickled, as deliqc merge needs all of their raw results
+    save_sample(save_as, sample, raw_results, format if shard is None else "pickle", compress)
+
+    if stats is not None:
+        metrics.save(stats)
+        print(f"Statistics saved ({stats})")
+
+    if event_log is not None:
+        print(f"Event log saved ({event_log})")
+
+    # The checkpoint is not needed anymore once the results are saved
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+
+def save_sample(save_as: str, sample: dict, raw_results: List[dict], file_format: str, compress: bool = False):
+    """
+    Saves a sample either as result file of the raw results of its replicates (see store.save_result), or as pickle.
+    :param save_as:
+    :param sample:
+    :param raw_results:
+    :param file_format: dqr or pickle
+    :param compress: Compress the arrays of a result file
+    :return:
+    """
+    if file_format == "dqr":
+        save_result(save_as, sample, raw_results, compress)
+    else:
+        with open(save_as, "wb") as fh:
+            pickle.dump(sample, fh)
+
+    print(f"File saved ({save_as})")
+
+
+def print_replicate(f1: str, f2: str, result: dict):
+    """
+    Prints the outcome of one replicate.
+    :param f1:
+    :param f2:
+    :param result:
+    :return:
+    """
+    print(f" - Extracted from {f1} and {f2}")
+    print(f"    - Reads found: {result['reads']}")
+    print(f"    - Unique read pairs: {result['uniquePairs']}")
+    print(f"    - Reads aligned: {result['alignedReads']}")
+    resolved = "/".join(str(result["resolvedBy"].get(tier, 0)) for tier in ("simple", "shifted", "advanced"))
+    print(f"    - Reads resolved (simple/shifted/advanced): {resolved}")
+    print(f"    - Reads skipped (low quality): {result['lowQualityPairs']}")
+    print(f"    - Reads skipped (mate mismatches): {result['mismatchedPairs']}")
+    print(f"    - Reads skipped (off-target): {result['offTargetPairs']}")
+    print(f"    - Reads skipped (too many point mutations): {result['tooManyPointMutations']}")
+    print(f"    - Reads with mates that could not be merged (included above): {result['unmergedPairs']}")
+    if len(result["libraryMembers"]) > 0:
+        print(f"    - Library members found: {len(result['libraryMembers'])} ({result['unassignedMemberReads']} reads unassigned)")
+    if len(result["splits"]) > 0:
+        print(f"    - Codon splits found: {len(result['splits'])} ({result['unassignedSplitReads']} reads unassigned)")
+    for stage, stats in result["stages"].items():
+        print(f"    - Stage {stage}: {stats['pairs']} pairs in {stats['wallSeconds']:.1f} s (workers busy for {stats['busySeconds']:.1f} s)")
+    print()
+
+
+def summarise(title: str, reference: str, split_on_codon, codons: List[str], results: List[dict]) -> dict:
+    """
+    Builds the saved sample from the normalised results of its replicates, with the mean and standard deviation of
+    each value, and prints the averages.
+    :param title:
+    :param reference:
+    :param split_on_codon:
+    :param codons:
+    :param results:
+    :return:
+    """
+    sample = average_results(title, reference, split_on_codon, codons, results)
 
     print(f" - Average reads found: {sample['reads']:.0f}")
     print(f" - Average reads aligned: {sample['alignedReads']:.0f}")
+    print(f" - Average reads skipped (low quality): {sample['lowQualityPairs']:.0f}")
     print(f" - Average reads skipped (mate mismatches): {sample['mismatchedPairs']:.0f}")
+    print(f" - Average reads skipped (off-target): {sample['offTargetPairs']:.0f}")
     print(f" - Average reads skipped (too many point mutations): {sample['tooManyPointMutations']:.0f}")
+    print(f" - Average reads with mates that could not be merged: {sample['unmergedPairs']:.0f}")
     print(f" - Average point (potential priming site): {sample['mismatches'][0][:8, 0].mean()*100:.1f}%")
     print(f" - Average point mutation rate: {sample['mismatches'][0][:, 0].mean()*100:.1f}%")
     print(f" - Average point insertion rate: {sample['indels'][0][:, 0, 0].mean()*100:.1f}%")
     print(f" - Average point deletion rate: {sample['indels'][0][:, 1, 0].mean()*100:.1f}%")
 
-    stop = timer()
-
-    print(f"\n... Done [{stop-start:.1f} seconds]")
-
-    with open(save_as, "wb") as fh:
-        pickle.dump(sample, fh)
-
-    print(f"File saved ({save_as})")
+    return sample
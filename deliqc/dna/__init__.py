@@ -1,6 +1,8 @@
 import numpy as np
+from typing import Union
 from .sanitation import is_valid, sanitise
 from .codons import get_codon_coordinates
+from . import packed
 
 complements = {
     "A": "T",
@@ -22,6 +24,23 @@ baseColour = {
 }
 baseToIndexDict = {bases[x]: x for x in range(len(bases))}
 
+# Lookup tables for sequences stored as uint8 arrays of ASCII codes. Unknown characters are kept as they are when
+# complementing, and are treated as N when converted to a base index.
+complementCodes = np.arange(256, dtype=np.uint8)
+for _base, _complement in complements.items():
+    complementCodes[ord(_base)] = ord(_complement)
+
+# ASCII code of each base index
+baseCodes = np.frombuffer(bases.encode("ascii"), dtype=np.uint8)
+
+baseIndexCodes = np.full(256, baseToIndexDict["N"], dtype=np.int8)
+for _base, _index in baseToIndexDict.items():
+    baseIndexCodes[ord(_base)] = _index
+
+# Translation tables to complement str and bytes sequences
+complementTable = str.maketrans(complements)
+complementBytesTable = complementCodes.tobytes()
+
 
 def get_nucleotide_colour_sequence(sequence):
     bar_colors = []
@@ -40,9 +59,9 @@ def base2Index(x):
     return baseToIndexDict[x]
 
 
-def reverse_complement(sequence: str) -> str:
+def reverse_complement(sequence: Union[str, bytes]) -> Union[str, bytes]:
     """
-    Returns the reverse complement of a sequence
+    Returns the reverse complement of a sequence, given as str or bytes
     :param sequence:
     :return:
     """
@@ -50,7 +69,7 @@ def reverse_complement(sequence: str) -> str:
     return reverse(complement(sequence))
 
 
-def reverse(sequence: str) -> str:
+def reverse(sequence: Union[str, bytes]) -> Union[str, bytes]:
     """
     Returns the reverse of a sequence
     :param sequence:
@@ -60,15 +79,39 @@ def reverse(sequence: str) -> str:
     return sequence[::-1]
 
 
-def complement(sequence: str) -> str:
+def complement(sequence: Union[str, bytes]) -> Union[str, bytes]:
     """
-    Returns the complement of a sequence
+    Returns the complement of a sequence, given as str or bytes. Unknown characters are kept as they are.
     :param sequence:
     :return:
     """
-    rc_seq = ""
+    if isinstance(sequence, str):
+        return sequence.translate(complementTable)
+    else:
+        return sequence.translate(complementBytesTable)
 
-    for base in sequence:
-        rc_seq += complements[base]
 
-    return rc_seq
+def encode(sequence: Union[str, bytes]) -> np.ndarray:
+    """
+    Returns a sequence as an uint8 array of ASCII codes
+    :param sequence:
+    :return:
+    """
+    return np.frombuffer(packed.to_bytes(sequence), dtype=np.uint8)
+
+
+def reverse_complement_matrix(matrix: np.ndarray, lengths: np.ndarray, padding: int = ord("N")) -> np.ndarray:
+    """
+    Returns the reverse complement of every row of a padded (n, width) matrix of ASCII codes.
+
+    Each row is reversed within its length, so the result is again left-aligned and padded with padding.
+    :param matrix:
+    :param lengths: Length of each row
+    :param padding:
+    :return:
+    """
+    positions = lengths[:, np.newaxis] - 1 - np.arange(matrix.shape[1])[np.newaxis, :]
+    rc = complementCodes[np.take_along_axis(matrix, np.maximum(positions, 0), axis=1)]
+    rc[positions < 0] = padding
+
+    return rc
@@ -0,0 +1,100 @@
+"""
+Packed representations of sequences for counting mismatches with XOR and popcount.
+
+A single sequence is packed into a python integer with one byte lane per base, holding the base index (A=0, C=1,
+G=2, T=3, N=4). Python integers are stored as arrays of machine words, so XOR-ing two packed sequences and counting
+the set bits works on whole words at a time.
+"""
+from functools import lru_cache
+from typing import List, Union
+
+# Base index of every byte. Unknown bytes are treated as N.
+indexTable = bytearray([4] * 256)
+for _index, _base in enumerate(b"ACGT"):
+    indexTable[_base] = _index
+indexTable = bytes(indexTable)
+
+if hasattr(int, "bit_count"):
+    def popcount(x: int) -> int:
+        return x.bit_count()
+else:
+    def popcount(x: int) -> int:
+        return bin(x).count("1")
+
+
+def to_bytes(sequence: Union[str, bytes]) -> bytes:
+    return sequence.encode("ascii") if isinstance(sequence, str) else sequence
+
+
+def pack(sequence: Union[str, bytes]) -> int:
+    """
+    Packs a sequence into an integer with one byte lane (holding the base index) per base. Lane i is base i.
+    :param sequence:
+    :return:
+    """
+    return int.from_bytes(to_bytes(sequence).translate(indexTable), "little")
+
+
+@lru_cache(maxsize=64)
+def lanes(length: int) -> int:
+    """
+    Returns an integer with the lowest bit of each of the first length lanes set.
+    :param length:
+    :return:
+    """
+    return int.from_bytes(b"\x01" * length, "little")
+
+
+def lane_mask(sequence: Union[str, bytes], ignore: bytes = b"N") -> int:
+    """
+    Returns an integer with the lowest bit set for each lane whose base is not in ignore.
+    :param sequence:
+    :param ignore:
+    :return:
+    """
+    sequence = to_bytes(sequence)
+    table = bytes(0 if b in ignore else 1 for b in range(256))
+
+    return int.from_bytes(sequence.translate(table), "little")
+
+
+def difference(a: int, b: int, mask: int) -> int:
+    """
+    Returns an integer with the lowest bit set for every lane in mask in which both packed sequences differ.
+    :param a:
+    :param b:
+    :param mask: For example lanes(length) or lane_mask(reference)
+    :return:
+    """
+    x = a ^ b
+
+    # Base indices need 3 bits, fold them into the lowest bit of each lane
+    return (x | x >> 1 | x >> 2) & mask
+
+
+def count_mismatches(a: int, b: int, mask: int) -> int:
+    """
+    Counts the lanes in mask in which both packed sequences differ.
+    :param a:
+    :param b:
+    :param mask:
+    :return:
+    """
+    return popcount(difference(a, b, mask))
+
+
+def positions(x: int) -> List[int]:
+    """
+    Returns the lanes in which the lowest bit is set, in increasing order.
+    :param x: For example the result of difference
+    :return:
+    """
+    result = []
+
+    while x:
+        low = x & -x
+        result.append((low.bit_length() - 1) >> 3)
+        x ^= low
+
+    return result
+
@@ -0,0 +1,231 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+# Maps bases to quaternary digits, so that a combination of codons can be parsed with int(..., 4)
+_quaternary = str.maketrans("ACGT", "0123")
+_bases = frozenset("ACGT")
+
+
+def pack_member(codons: Sequence[str]) -> Optional[int]:
+    """
+    Packs the codons of a read (one library member) into an integer with 2 bits per base. Returns None if a codon
+    contains anything but A, C, G or T.
+    :param codons:
+    :return:
+    """
+    sequence = "".join(codons)
+
+    if len(sequence) == 0 or not _bases.issuperset(sequence):
+        return None
+
+    return int(sequence.translate(_quaternary), 4)
+
+
+def unpack_member(key: int, lengths: Sequence[int]) -> Tuple[str, ...]:
+    """
+    Returns the codons of a packed library member.
+    :param key:
+    :param lengths: Length of each codon
+    :return:
+    """
+    total = sum(lengths)
+    bases = []
+    for _ in range(total):
+        bases.append("ACGT"[key & 3])
+        key >>= 2
+    sequence = "".join(reversed(bases))
+
+    codons = []
+    start = 0
+    for length in lengths:
+        codons.append(sequence[start:start + length])
+        start += length
+
+    return tuple(codons)
+
+
+class CountMinSketch:
+    """
+    Approximate counter of integer keys in a depth x width table, with one multiply-shift hash per row. Estimates
+    never undercount, and overcount by at most 2 * total / width with a probability of 1 - 2^-depth.
+
+    The hash parameters only depend on seed, so sketches with the same seed can be merged by adding their tables.
+    """
+    def __init__(self, width: int = 1 << 20, depth: int = 4, seed: int = 0):
+        # Width is rounded up to a power of 2 for the multiply-shift hashing
+        self.bits = max(1, int(np.ceil(np.log2(width))))
+        self.width = 1 << self.bits
+        self.depth = depth
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 63, size=depth, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=depth, dtype=np.uint64)
+
+        self.table = np.zeros((depth, self.width), dtype=np.int64)
+
+    @staticmethod
+    def _fold(key: int) -> int:
+        # Keys can be longer than 64 bits
+        while key >> 64:
+            key = (key & 0xFFFFFFFFFFFFFFFF) ^ (key >> 64)
+
+        return key
+
+    def _columns(self, keys: Sequence[int]) -> np.ndarray:
+        folded = np.array([self._fold(k) for k in keys], dtype=np.uint64)
+
+        with np.errstate(over="ignore"):
+            hashed = self._a[:, np.newaxis] * folded[np.newaxis, :] + self._b[:, np.newaxis]
+
+        return (hashed >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def add(self, keys: Sequence[int], counts: Sequence[int]):
+        """
+        Adds counts for a batch of keys.
+        :param keys:
+        :param counts:
+        :return:
+        """
+        if len(keys) == 0:
+            return
+
+        columns = self._columns(keys)
+        counts = np.asarray(counts, dtype=np.int64)
+
+        for row in range(self.depth):
+            np.add.at(self.table[row], columns[row], counts)
+
+    def estimate(self, keys: Sequence[int]) -> np.ndarray:
+        """
+        Returns the estimated count of each key.
+        :param keys:
+        :return:
+        """
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        columns = self._columns(keys)
+
+        return self.table[np.arange(self.depth)[:, np.newaxis], columns].min(axis=0)
+
+    def merge(self, other: "CountMinSketch"):
+        self.table += other.table
+
+
+class MemberCounts:
+    """
+    Counts the reads of each library member, identified by the combination of the codons at all codon positions.
+
+    By default, members are counted exactly in a dictionary keyed by the packed codons (see pack_member). For very
+    large libraries, sketch_width switches to an approximate count-min sketch. Only the max_members members with
+    the highest estimates are then remembered to be reported.
+
+    Workers count the members of their chunk exactly, which keeps their partial sums small, and only the instance
+    in the parent uses the sketch.
+    """
+    def __init__(self, lengths: Sequence[int], sketch_width: int = 0, sketch_depth: int = 4, max_members: int = 100_000, buffer_size: int = 1 << 14):
+        self.lengths = list(lengths)
+        self.max_members = max_members
+        self.buffer_size = buffer_size
+
+        self.exact = defaultdict(int)
+        self.sketch = CountMinSketch(sketch_width, sketch_depth) if sketch_width > 0 else None
+        self.candidates = set()
+
+        # Reads without a valid codon at every position
+        self.unassigned = 0
+
+        self._keys = []
+        self._counts = []
+
+    @property
+    def active(self) -> bool:
+        return len(self.lengths) > 0
+
+    @property
+    def approximate(self) -> bool:
+        return self.sketch is not None
+
+    def add(self, codons: List[str], count: int = 1):
+        """
+        Counts a read with the given codons count times.
+        :param codons:
+        :param count:
+        :return:
+        """
+        key = pack_member(codons) if len(codons) == len(self.lengths) else None
+
+        if key is None:
+            self.unassigned += count
+        elif self.sketch is None:
+            self.exact[key] += count
+        else:
+            self._buffer(key, count)
+
+    def _buffer(self, key: int, count: int):
+        self._keys.append(key)
+        self._counts.append(count)
+
+        if len(self._keys) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds all buffered keys to the sketch and updates the members to report.
+        :return:
+        """
+        if self.sketch is None or len(self._keys) == 0:
+            return
+
+        self.sketch.add(self._keys, self._counts)
+        self.candidates.update(self._keys)
+        self._keys = []
+        self._counts = []
+
+        self._prune()
+
+    def _prune(self):
+        if len(self.candidates) <= self.max_members:
+            return
+
+        keys = list(self.candidates)
+        estimates = self.sketch.estimate(keys)
+        keep = np.argsort(-estimates, kind="stable")[:self.max_members]
+        self.candidates = {keys[i] for i in keep}
+
+    def merge(self, other: "MemberCounts"):
+        """
+        Adds the counts of another instance to this one.
+        :param other:
+        :return:
+        """
+        self.unassigned += other.unassigned
+
+        if self.sketch is None:
+            for key, count in other.exact.items():
+                self.exact[key] += count
+        else:
+            for key, count in other.exact.items():
+                self._buffer(key, count)
+
+            if other.sketch is not None:
+                other.flush()
+                self.sketch.merge(other.sketch)
+                self.candidates.update(other.candidates)
+                self._prune()
+
+    def to_dict(self) -> Dict[Tuple[str, ...], int]:
+        """
+        Returns the (estimated) read count of each member, keyed by its tuple of codons.
+        :return:
+        """
+        if self.sketch is None:
+            counts = self.exact
+        else:
+            self.flush()
+            keys = list(self.candidates)
+            counts = dict(zip(keys, self.sketch.estimate(keys).tolist()))
+
+        return {unpack_member(key, self.lengths): count for key, count in counts.items()}
@@ -1,8 +1,27 @@
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
 import numpy as np
 
 from deliqc import dna
-from deliqc.sample.result import AlignedReadResult, FailedReadResult
+from deliqc.dna import packed
+from deliqc.sample.result import AlignedReadResult, FailedReadResult, SimpleBatchResult
 from deliqc.sample.errors import *
+from deliqc.sample.banded import ReferenceProfile, AlignmentEvents, score_profile, BAND, OP_MATCH, OP_DELETION, OP_INSERTION
+from deliqc.sample.banded import MATCH_SCORE, MISMATCH_SCORE, N_SCORE, GAP_OPEN, GAP_EXTEND
+from deliqc.sample.kernels import get_backend
+from deliqc.sample.prefilter import ADAPTERS
+from deliqc.sample.reader import sequences_to_matrix
+
+# Length of the k-mers used to find the overlap between both mates
+SEED_LENGTH = 10
+# Length of the start of each adapter that is searched for to find the end of short inserts
+ADAPTER_SEED_LENGTH = 12
+
+# Longest indel the shifted analyzer tries to resolve
+MAX_SHIFT = 2
+# Mismatches allowed next to the indel in the shifted analyzer. With more of them, a second indel can score better,
+# which is left to the alignment.
+MAX_SHIFTED_MISMATCHES = 1
 
 
 def _simple_analyzer(
@@ -16,94 +35,217 @@ def _simple_analyzer(
         split_on_codon=False,
         codons=[],
         coordinates=None,
+        packed_reference=None,
 ):
-    """ This simple analyzer only looks at point mutations. """
-    r1 = dna.reverse_complement(r1[:read_length])
-    r2 = r2[:read_length]
+    """
+    This simple analyzer only looks at point mutations.
 
-    codon = None
+    Reads can be given as str or bytes. Mismatches are counted on packed sequences (see dna.packed). The packed
+    reference and the mask of its non-N positions can be precomputed and are otherwise derived from reference.
+    """
+    r1 = dna.reverse_complement(packed.to_bytes(r1[:read_length]))
+    r2 = packed.to_bytes(r2[:read_length])
 
-    # Count mismatches between the two mates
-    pairMismatches = 0
-    realRead = ""
-    for nt1, nt2 in zip(r1, r2):
-        if nt1 != nt2:
-            pairMismatches += 1
+    if packed_reference is None:
+        packed_reference = packed.pack(reference), packed.lane_mask(reference)
 
-            realRead += nt1 if prefer_mate is False else nt2
-        else:
-            realRead += nt1
+    # Count mismatches between the two mates. Where they differ, the preferred mate is used.
+    length = min(len(r1), len(r2))
+    mate1 = packed.pack(r1[:length])
+    mate2 = packed.pack(r2[:length])
+
+    pairMismatches = packed.count_mismatches(mate1, mate2, packed.lanes(length))
 
     if pairMismatches > max_pair_mismatches:
         raise TooManyMismatchesBetweenPair
 
-    # Count the amount of mismatches compared to template
-    result = AlignedReadResult(read_length)
-    result.pairMismatches = pairMismatches
+    realRead, packedRead = (r2[:length], mate2) if prefer_mate else (r1[:length], mate1)
 
-    # readMismatches = np.zeros(readLength)
-    # readMutationTarget = np.zeros((readLength, 5))
+    if length < read_length:
+        print("Read too short?", realRead.decode("ascii"), reference)
 
-    for i in range(read_length):
-        try:
-            nt_ref = reference[i]
-            nt_read = realRead[i]
-        except IndexError:
-            print("Read too short?", realRead, reference)
-            break
+    # Count the amount of mismatches compared to template, ignoring N (=codon)
+    reference_packed, reference_mask = packed_reference
+    differences = packed.difference(packedRead, reference_packed, reference_mask & packed.lanes(length))
 
-        # Continue if matching
-        if nt_ref == nt_read:
-            continue
-
-        # Continue if reference contains N (=codon)
-        if nt_ref == "N":
-            continue
+    if packed.popcount(differences) > max_point_mutations:
+        raise TooManyMismatchesToReference
 
-        result.mismatches[i] += 1
-        result.mutationTarget[i, dna.base2Index(nt_read)] += 1
+    result = AlignedReadResult(read_length)
+    result.pairMismatches = pairMismatches
 
-    if result.mismatchCount > max_point_mutations:
-        raise TooManyMismatchesToReference
+    for i in packed.positions(differences):
+        result.add_mismatch(i, packed.indexTable[realRead[i]])
 
     # Split on codon if given
     codon = None
     if split_on_codon > 0:
         if split_on_codon < len(coordinates):
-            try:
-                x, y = coordinates[split_on_codon]
-                codonRead = realRead[x:y]
+            x, y = coordinates[split_on_codon]
+            codonRead = realRead[x:y].decode("ascii")
 
-                if codonRead in codons:
-                    codon = codonRead
-            except TypeError:
-                print(type(x), x, type(y), y)
+            if codonRead in codons:
+                codon = codonRead
         else:
             print("Codon number is beyond limits.")
 
     result.codon = codon
 
     # Save other codons, too
-    codons = []
-    for x, y in coordinates:
-        codons.append(realRead[x:y])
-    result.codons = codon
+    result.codons = [realRead[x:y].decode("ascii") for x, y in coordinates]
 
     return result
 
 
-def _match_score(x, y):
-    if x == "N":
-        return 1
-    elif y == x:
-        return 5
+def _shifted_analyzer(
+        r1,
+        r2,
+        read_length,
+        reference,
+        max_pair_mismatches,
+        max_point_mutations,
+        prefer_mate,
+        split_on_codon=False,
+        codons=[],
+        coordinates=None,
+        reference_codes=None,
+        max_shift=MAX_SHIFT,
+):
+    """
+    This analyzer resolves reads with a single short indel (up to max_shift bases) without aligning them, as an
+    intermediate step between the simple and the advanced analyzer.
+
+    An indel of k bases changes the length of the amplicon by k, so both mates are cut to read_length + k and compared
+    base by base. Their consensus is scored against the reference like in the alignment (see banded), in front of
+    the indel without and behind it with the shift, which gives the score of the indel at every position with two
+    cumulative sums. Like in the alignment, the best position is taken, deletions as far left and insertions as far
+    right as possible. The indel is only kept if it scores better than going on without it and if at most
+    MAX_SHIFTED_MISMATCHES mismatches remain, as more of them can be better explained by a further indel.
+
+    reference_codes (the reference as uint8 array) can be precomputed and is otherwise derived from reference.
+    """
+    r1 = packed.to_bytes(r1)
+    r2 = packed.to_bytes(r2)
+    L = read_length
+
+    if reference_codes is None:
+        reference_codes = dna.encode(reference)
+
+    best = None
+    pair_failed = False
+
+    for k in range(1, max_shift + 1):
+        gap = GAP_OPEN + (k - 1) * GAP_EXTEND
+
+        for shift in (-k, k):
+            length = L + shift
+            if len(r1) < length or len(r2) < length:
+                continue
+
+            mate1 = dna.encode(dna.reverse_complement(r1[:length]))
+            mate2 = dna.encode(r2[:length])
+
+            pairMismatches = int(np.count_nonzero(mate1 != mate2))
+            if pairMismatches > max_pair_mismatches:
+                pair_failed = True
+                continue
+
+            read = mate2 if prefer_mate else mate1
+
+            # Position i in front of the indel compares read[i] to reference[i], behind it read[i + insertion] to
+            # reference[i + deletion]. An indel at i has the front scores up to i and the scores behind from i on.
+            n = min(length, L)
+            front = _base_scores(read[:n], reference_codes[:n])
+            behind = _base_scores(read[max(shift, 0):][:n], reference_codes[max(-shift, 0):][:n])
+
+            totals = np.zeros(n + 1, dtype=np.int64)
+            totals[1:] = np.cumsum(front)
+            totals[:n] += np.cumsum(behind[::-1])[::-1]
+
+            if shift < 0:
+                start = int(np.argmax(totals[:n]))
+            else:
+                start = n - 1 - int(np.argmax(totals[n - 1::-1]))
+
+            # Without the indel, bases behind the end of the reference are free, while missing ones need a deletion
+            # at the end
+            score = int(totals[start]) + gap
+            plain = int(totals[n]) + (gap if shift < 0 else 0)
+
+            if score > plain and (best is None or score > best[0]):
+                best = score, shift, start, read, front, behind, pairMismatches
+
+    if best is None:
+        if pair_failed:
+            raise TooManyMismatchesBetweenPair
+        raise TooManyMismatchesToReference
+
+    _, shift, start, read, front, behind, pairMismatches = best
+
+    head = np.flatnonzero(front[:start] == MISMATCH_SCORE)
+    tail = np.flatnonzero(behind[start:] == MISMATCH_SCORE) + start
+
+    if len(head) + len(tail) > min(max_point_mutations, MAX_SHIFTED_MISMATCHES):
+        raise TooManyMismatchesToReference
+
+    result = AlignedReadResult(L)
+    result.pairMismatches = pairMismatches
+
+    for i in head.tolist():
+        result.add_mismatch(i, int(dna.baseIndexCodes[read[i]]))
+
+    if shift < 0:
+        # Reads behind the deletion are compared with reference[i - shift]
+        if reference_codes[start] != ord("N"):
+            result.add_deletion(start)
+
+        for i in tail.tolist():
+            result.add_mismatch(i - shift, int(dna.baseIndexCodes[read[i]]))
+
+        aligned = read[:start].tobytes() + b"-" * -shift + read[start:].tobytes()
     else:
-        return -2
+        result.add_insertion(start, int(dna.baseIndexCodes[read[start]]))
 
+        for i in tail.tolist():
+            result.add_mismatch(i, int(dna.baseIndexCodes[read[i + shift]]))
 
-def _advanced_analyzer(
+        aligned = read[:start].tobytes() + read[start + shift:].tobytes()
+
+    aligned = aligned.decode("ascii")
+
+    # Split on codon if given
+    codon = None
+    if 0 < split_on_codon < len(coordinates):
+        x, y = coordinates[split_on_codon]
+        codonRead = aligned[x:y]
+
+        if codonRead in codons:
+            codon = codonRead
+
+    result.codon = codon
+
+    # Save other codons, too
+    result.codons = [aligned[x:y] for x, y in coordinates]
+
+    return result
+
+
+def _base_scores(read: np.ndarray, reference_codes: np.ndarray) -> np.ndarray:
+    """
+    Returns the alignment score of each base of a read (ASCII codes) against the reference base at the same position.
+    """
+    return np.where(
+        reference_codes == ord("N"),
+        N_SCORE,
+        np.where(read == reference_codes, MATCH_SCORE, MISMATCH_SCORE),
+    )
+
+
+def _simple_analyzer_batch(
         r1,
         r2,
+        length1,
+        length2,
         read_length,
         reference,
         max_pair_mismatches,
@@ -112,214 +254,353 @@ def _advanced_analyzer(
         split_on_codon=False,
         codons=[],
         coordinates=None,
+        reference_codes=None,
+        reference_mask=None,
+        backend=None,
 ):
-    """ This advanced analyzer aligns both read to the reference. Thus, it looks at point mutations AND indels."""
-    from Bio import pairwise2
+    """
+    Batched version of the simple analyzer, working on (n, width) uint8 matrices of both mates.
 
-    # Invert read 1 (reverse read)
-    r1 = dna.reverse_complement(r1)
+    reference_codes (the reference as uint8 array) and reference_mask (True where the reference is not N) can be
+    precomputed and are otherwise derived from reference. backend selects the kernel implementation (see kernels).
+    """
+    n = len(r1)
+    L = read_length
+    kernels = get_backend(backend)
 
-    # Canonicalize both reads
-    pair_a = pairwise2.align.localcs(r1, r2, _match_score, -10, -1, one_alignment_only=True)[0]
+    if reference_codes is None:
+        reference_codes = dna.encode(reference)
+    if reference_mask is None:
+        reference_mask = reference_codes != ord("N")
 
-    ar1 = pair_a[0]
-    ar2 = pair_a[1]
+    # Make sure both matrices cover the whole reference
+    if r1.shape[1] < L:
+        r1 = np.pad(r1, ((0, 0), (0, L - r1.shape[1])), constant_values=ord("N"))
+    if r2.shape[1] < L:
+        r2 = np.pad(r2, ((0, 0), (0, L - r2.shape[1])), constant_values=ord("N"))
 
-    # We first clip away overhangs coming from adapter sequences
-    # Check if only ar1 starts with "-" and ar2 ends with "-"
-    if ar1[0] == "-" and ar1[-1] != "-" and ar2[0] != "-" and ar2[-1] == "-":
-        left = 0
-        for x in ar1:
-            if x == "-":
-                left += 1
-            else:
-                break
+    length1 = np.minimum(length1, L)
+    length2 = np.minimum(length2, L)
 
-        right = 0
-        for x in ar2[::-1]:
-            if x == "-":
-                right += 1
-            else:
-                break
-
-        length = len(ar1) - left - right
-
-        ar1 = ar1[left:left + length]
-        ar2 = ar2[left:left + length]
-    # Check the inverse.
-    elif ar1[0] != "-" and ar1[-1] == "-" and ar2[0] == "-" and ar2[-1] != "-":
-        left = 0
-        for x in ar2:
-            if x == "-":
-                left += 1
-            else:
-                break
+    mate1 = dna.reverse_complement_matrix(r1[:, :L], length1)
+    mate2 = r2[:, :L]
 
-        right = 0
-        for x in ar1[::-1]:
-            if x == "-":
-                right += 1
-            else:
-                break
+    # Only positions covered by both mates are compared
+    consensus_length = np.minimum(length1, length2)
 
-        length = len(ar1) - left - right
+    result = SimpleBatchResult(n, L)
+    result.consensusLength = consensus_length
 
-        ar1 = ar1[left:left + length]
-        ar2 = ar2[left:left + length]
-    else:
-        # print(ar1)
-        # print(ar2)
+    # Count mismatches between the two mates. Where they differ, the preferred mate is used.
+    consensus, result.pairMismatches = kernels.pair_consensus(
+        np.ascontiguousarray(mate1), np.ascontiguousarray(mate2), consensus_length, prefer_mate,
+    )
+    result.consensus = consensus
+
+    # Count the mismatches compared to the template, ignoring N (=codon)
+    mismatches = kernels.hamming(consensus, reference_codes[:L], reference_mask[:L], consensus_length)
+    result.mismatches = mismatches
+    result.mutationTarget = np.where(mismatches, dna.baseIndexCodes[consensus], -1).astype(np.int8)
+
+    too_many_pair_mismatches = result.pairMismatches > max_pair_mismatches
+    too_many_point_mutations = mismatches.sum(axis=1) > max_point_mutations
+
+    result.reason[too_many_point_mutations] = FailedReadResult.tooManyMismatchesToReference
+    result.reason[too_many_pair_mismatches] = FailedReadResult.tooManyMismatchesBetweenPair
+
+    # Split on codon if given
+    if 0 < split_on_codon < len(coordinates):
+        x, y = coordinates[split_on_codon]
+        segment = consensus[:, x:y]
+
+        for i in range(len(codons) - 1, -1, -1):
+            if len(codons[i]) != y - x:
+                continue
+
+            matches = (segment == dna.encode(codons[i])[np.newaxis, :]).all(axis=1) & (consensus_length >= y)
+            result.codonIndex[matches] = i + 1
+
+    return result
+
+
+def _seed_diagonal(mate1: np.ndarray, mate2: np.ndarray, k: int = SEED_LENGTH):
+    """
+    Returns the diagonal d with mate1[p + d] == mate2[p] supported by the most shared k-mers, or None.
+    :param mate1: ASCII codes of the first mate
+    :param mate2: ASCII codes of the second mate
+    :param k:
+    :return:
+    """
+    a = mate1.tobytes()
+    b = mate2.tobytes()
+
+    positions = {}
+    for p in range(len(b) - k + 1):
+        positions.setdefault(b[p:p + k], p)
+
+    votes = defaultdict(int)
+    for p in range(len(a) - k + 1):
+        q = positions.get(a[p:p + k])
+
+        if q is not None:
+            votes[p - q] += 1
+
+    if len(votes) == 0:
+        return None
+
+    return max(votes, key=votes.get)
+
+
+def merge_mates(mate1: str, mate2: str, prefer_mate: bool, band: int = BAND, backend: str = None):
+    """
+    Merges the overlapping part of two mates (both in the same orientation) into a canonical read.
+
+    The offset between both mates is found by shared k-mers, and the overlap is then aligned within a band around
+    it. Overhangs (coming from adapter sequences) are clipped away. Where the mates disagree, mate1 is used unless
+    prefer_mate is set; gaps are filled with the base of the other mate.
+    :param mate1:
+    :param mate2:
+    :param prefer_mate:
+    :param band:
+    :param backend: Kernel backend used for the alignment
+    :return: canonical read, amount of mismatches between the mates
+    """
+    a = dna.encode(mate1)
+    b = dna.encode(mate2)
+
+    d = _seed_diagonal(a, b)
+    if d is None:
         raise WeirdReads
 
-    # Create a canonical read.
-    canonical = ""
-    pairMismatches = 0
+    start = max(0, -d)
+    end = min(len(b), len(a) - d)
+    if end - start < SEED_LENGTH:
+        raise WeirdReads
 
-    for i in range(len(ar1)):
-        nt_1 = ar1[i]
-        nt_2 = ar2[i]
+    a = a[start + d:end + d]
+    b = b[start:end]
+    a_index = dna.baseIndexCodes[a]
+    b_index = dna.baseIndexCodes[b]
 
-        # If both reads have the same nucleotide - use it
-        if nt_1 == nt_2:
-            canonical += nt_1
-        else:
-            # No match means mismatch (large insertions/deletions are counted multiple times)
-            pairMismatches += 1
-
-            # Gap on nt_1 means nt_2 must have something there.
-            if nt_1 == "-":
-                canonical += nt_2
-            # Gap on nt_2 means nt_1 must have something
-            elif nt_2 == "-":
-                canonical += nt_1
-            # If neither is a gap it means a mismatch between both. For now, we use "N" in this case.
-            else:
-                if prefer_mate:
-                    canonical += nt_2
-                else:
-                    canonical += nt_1
+    ops = get_backend(backend).banded_align_single(score_profile(a_index), b_index, band)
+
+    is_match = ops == OP_MATCH
+    from_a = np.cumsum(ops != OP_INSERTION) - 1
+    from_b = np.cumsum(ops != OP_DELETION) - 1
+    base_a = a[np.clip(from_a, 0, len(a) - 1)]
+    base_b = b[np.clip(from_b, 0, len(b) - 1)]
+
+    # Any disagreement counts as mismatch (large insertions/deletions are counted multiple times)
+    pair_mismatches = int((~is_match | (base_a != base_b)).sum())
+
+    use_b = (ops == OP_INSERTION) | (is_match & (base_a != base_b) & prefer_mate)
+    canonical = np.where(use_b, base_b, base_a)
+
+    return canonical.tobytes().decode("ascii"), pair_mismatches
+
+
+def adapter_seeds(adapters: Iterable[str], k: int = ADAPTER_SEED_LENGTH) -> List[bytes]:
+    """
+    Returns the starts of the adapters searched for by overlap_mates.
+    :param adapters:
+    :param k:
+    :return:
+    """
+    return [packed.to_bytes(adapter)[:k] for adapter in adapters]
+
+
+def _insert_length(read: bytes, seeds: List[bytes]) -> Optional[int]:
+    """
+    Returns the position of the first adapter seed found in a read, or None.
+    """
+    positions = [p for p in (read.find(seed) for seed in seeds) if p >= 0]
+
+    return min(positions) if len(positions) > 0 else None
+
+
+def overlap_mates(r1, r2, prefer_mate: bool, seeds: List[bytes], max_pair_mismatches: int = 0) -> Optional[Tuple[str, int]]:
+    """
+    Merges both mates of a pair whose insert is shorter than the reads, without aligning them.
+
+    Such reads run into the adapters, which start at the same position in both mates. If both agree on it, the
+    insert of read 2 and the reverse complemented insert of read 1 overlap completely, and the canonical read is
+    the one of the preferred mate (mate1 being read 1, as in merge_mates). Returns None if this cannot be decided,
+    because no adapter was found, the mates disagree on its position, or an alignment could explain more
+    mismatches than allowed by a pair of gaps.
+    :param r1: Read 1 as sequenced
+    :param r2: Read 2 as sequenced
+    :param prefer_mate:
+    :param seeds: Adapter starts (see adapter_seeds)
+    :param max_pair_mismatches:
+    :return: canonical read, amount of mismatches between the mates, or None
+    """
+    r1 = packed.to_bytes(r1)
+    r2 = packed.to_bytes(r2)
+
+    length = _insert_length(r2, seeds)
+    if length is None or length < SEED_LENGTH or _insert_length(r1, seeds) != length:
+        return None
+
+    mate1 = dna.reverse_complement(r1[:length])
+    mate2 = r2[:length]
+    pair_mismatches = int(np.count_nonzero(dna.encode(mate1) != dna.encode(mate2)))
+
+    # Mates of the same length that differ can only get aligned with less mismatches by a pair of gaps, which
+    # count as at least two.
+    if pair_mismatches > max_pair_mismatches > 1:
+        return None
+
+    canonical = mate2 if prefer_mate else mate1
+
+    return canonical.decode("ascii"), pair_mismatches
+
+
+def _advanced_analyzer(
+        r1,
+        r2,
+        read_length,
+        reference,
+        max_pair_mismatches,
+        max_point_mutations,
+        prefer_mate,
+        split_on_codon=False,
+        codons=[],
+        coordinates=None,
+        profile=None,
+        backend=None,
+        adapter_seeds=None,
+):
+    """
+    This advanced analyzer aligns both reads to the reference. Thus, it looks at point mutations AND indels.
+
+    Both alignments (mate to mate and canonical read to reference) are banded. The reference profile can be
+    precomputed and is otherwise built from reference. backend selects the kernel implementation (see kernels).
+    If adapter_seeds are given, mates that run into the adapters are merged by their position instead of being
+    aligned (see overlap_mates).
+    """
+    if profile is None:
+        profile = ReferenceProfile(reference)
+
+    kernels = get_backend(backend)
+
+    # Invert read 1 (reverse read) and canonicalize both reads, aligning them only if the adapters do not tell how
+    # they overlap
+    merged = None
+    if adapter_seeds is not None:
+        merged = overlap_mates(r1, r2, prefer_mate, adapter_seeds, max_pair_mismatches)
+
+    if merged is None:
+        merged = merge_mates(dna.reverse_complement(r1), r2, prefer_mate, backend=backend)
+
+    canonical, pairMismatches = merged
 
     if pairMismatches > max_pair_mismatches:
         raise TooManyMismatchesBetweenPair
 
+    # Align canonical read to reference
+    query = dna.baseIndexCodes[dna.encode(canonical)]
+    ops = kernels.banded_align_single(profile.scores, query)
+    events = AlignmentEvents(ops[np.newaxis, :], profile.codes, query[np.newaxis, :])
+
+    if events.mismatches[0].sum() > max_point_mutations:
+        raise TooManyMismatchesToReference
+
+    if events.maxDeletion[0] > 2:
+        raise TooManyMismatchesToReference
+    if events.maxInsertion[0] > 2:
+        raise TooManyMismatchesToReference
+
     # Prepare the result object
     result = AlignedReadResult(read_length)
     result.pairMismatches = pairMismatches
 
-    # Align canonical read to reference
-    pair_b = pairwise2.align.localcs(reference, canonical, _match_score, -10, -1, one_alignment_only=True)[0]
-
-    a_ref = pair_b[0]
-    a_can = pair_b[1]
-
-    # Count mutations!
-    r_pos = 0
-    insertion_open = False
-    deletion_open = False
-    refMismatches = 0
-    readMismatches = np.zeros(read_length)
-    readMutationTarget = np.zeros((read_length, 5))
-    indelHappened = 0
-    insLength = 0
-    maxInsLength = 0
-    delLength = 0
-    maxDelLength = 0
-
-    for i in range(len(a_ref)):
-        nt_ref = a_ref[i]
-        nt_can = a_can[i]
-
-        if insLength > maxInsLength:
-            maxInsLength = insLength
-
-        if delLength > maxDelLength:
-            maxDelLength = delLength
-
-        # Just continue if reference contains "N"
-        if nt_ref == "N":
-            r_pos += 1
-            insertion_open = False
-            deletion_open = False
-            # If both agree we can increase r_pos and continue (= no mutation)
-        elif nt_ref == nt_can:
-            r_pos += 1
-            insertion_open = False
-            deletion_open = False
-        else:
-            # A gap on the reference is an insertion. Do not progress r_pos in this case.
-            if nt_ref == "-":
-                # Only count as one insertion
-                if insertion_open is False:
-                    result.indels[r_pos, 0] += 1
-                    result.insertionTarget[r_pos, dna.base2Index(nt_can)] += 1
-                    refMismatches += 1
-                    indelHappened += 1
-
-                    # Debug
-                    #if r_pos == 49:
-                    #    print(a_ref, a_can)
-                insertion_open = True
-                deletion_open = False
-                insLength += 1
-                delLength = 0
-            # A gap on the canonical is a deletion. Do progress r_pos in this case
-            elif nt_can == "-":
-                if deletion_open is False:
-                    result.indels[r_pos, 1] += 1
-                    refMismatches += 1
-                    indelHappened += 1
-                r_pos += 1
-                insertion_open = False
-                deletion_open = True
-                delLength += 1
-                insLength = 0
-            # Neither is a point mutation. progress r_pos in this case.
-            else:
-                result.mismatches[r_pos] += 1
-                result.mutationTarget[r_pos, dna.base2Index(nt_can)] += 1
+    for position in np.flatnonzero(events.mismatches[0]).tolist():
+        result.add_mismatch(position, int(events.mutationTarget[0, position]))
 
-                r_pos += 1
-                insertion_open = False
-                deletion_open = False
-                insLength = 0
-                delLength = 0
+    for position in np.flatnonzero(events.insertions[0]).tolist():
+        result.add_insertion(position, int(events.insertionTarget[0, position]))
 
-        # If we reached the end of the read we can stop.
-        # Any additional bases on the canonical strand are not counted.
-        if r_pos == read_length:
-            break
+    for position in np.flatnonzero(events.deletions[0]).tolist():
+        result.add_deletion(position)
 
-    if result.mismatchCount > max_point_mutations:
-        raise TooManyMismatchesToReference
-
-    if maxDelLength > 2:
-        #print("Too long deletions (>2).")
-        raise TooManyMismatchesToReference
-    if maxInsLength > 2:
-        #print("Too long insertions (>2).")
-        raise TooManyMismatchesToReference
+    aligned = events.aligned[0].tobytes().decode("ascii")
 
     # Split on codon if given
     codon = None
     if split_on_codon > 0:
         if split_on_codon < len(coordinates):
-            try:
-                x, y = coordinates[split_on_codon]
-                codonRead = a_can[x:y]
+            x, y = coordinates[split_on_codon]
+            codonRead = aligned[x:y]
 
-                if codonRead in codons:
-                    codon = codonRead
-            except TypeError:
-                print(type(x), x, type(y), y)
+            if codonRead in codons:
+                codon = codonRead
         else:
             print("Codon number is beyond limits.")
 
     result.codon = codon
 
     # Save other codons, too
-    codons = []
-    for x, y in coordinates:
-        codons.append(a_can[x:y])
-    result.codons = codons
+    result.codons = [aligned[x:y] for x, y in coordinates]
 
     return result
+
+
+def _compare_results(a, b) -> bool:
+    if type(a) is not type(b):
+        return False
+
+    if isinstance(a, FailedReadResult):
+        return a.reason == b.reason
+
+    return a.pairMismatches == b.pairMismatches and sorted(a.events) == sorted(b.events) and a.codon == b.codon
+
+
+def check_backend(backend: str, batch, reference: str, adapters: Iterable[str] = None, **kwargs) -> int:
+    """
+    Runs both analyzers on a batch of read pairs with the given backend and with the numpy backend, and returns the
+    amount of pairs for which the results differ.
+
+    The analyzers get the read pairs like in a run: the simple analyzer with both mates cut to the length of the
+    reference, and the advanced analyzer with the whole reads, merging mates that run into the adapters by their
+    position. The batch should therefore hold the reads at their full length.
+    :param backend: Name of the backend to check
+    :param batch: ReadBatch with the read pairs
+    :param reference:
+    :param adapters: Adapters read through after short inserts (None for the defaults in prefilter.ADAPTERS)
+    :param kwargs: max_pair_mismatches, max_point_mutations, prefer_mate, split_on_codon and codons
+    :return:
+    """
+    L = len(reference)
+    kwargs = dict(kwargs, reference=reference, read_length=L, coordinates=dna.get_codon_coordinates(reference))
+    profile = ReferenceProfile(reference)
+    seeds = adapter_seeds(adapters if adapters is not None else ADAPTERS.values())
+
+    pairs = list(batch.pairs())
+    r1, length1 = sequences_to_matrix([pair[0] for pair in pairs], L)
+    r2, length2 = sequences_to_matrix([pair[1] for pair in pairs], L)
+
+    simple = [
+        _simple_analyzer_batch(r1, r2, length1, length2, **kwargs, backend=name)
+        for name in ("numpy", backend)
+    ]
+
+    differs = np.zeros(len(batch), dtype=bool)
+    for name in ("consensus", "pairMismatches", "mismatches", "mutationTarget", "codonIndex", "reason"):
+        equal = getattr(simple[0], name) == getattr(simple[1], name)
+        differs |= ~equal.reshape(len(batch), -1).all(axis=1)
+
+    for i, (r1, r2) in enumerate(pairs):
+        results = []
+
+        for name in ("numpy", backend):
+            try:
+                results.append(_advanced_analyzer(r1, r2, **kwargs, profile=profile, backend=name, adapter_seeds=seeds))
+            except TooManyMismatchesBetweenPair:
+                results.append(FailedReadResult(FailedReadResult.tooManyMismatchesBetweenPair))
+            except (TooManyMismatchesToReference, WeirdReads):
+                results.append(FailedReadResult(FailedReadResult.tooManyMismatchesToReference))
+
+        if not _compare_results(*results):
+            differs[i] = True
+
+    return int(differs.sum())
@@ -0,0 +1,425 @@
+import numpy as np
+
+from deliqc import dna
+from deliqc.sample.errors import WeirdReads
+
+# Scores as used by the previous pairwise2 based alignment
+MATCH_SCORE = 5
+MISMATCH_SCORE = -2
+N_SCORE = 1
+GAP_OPEN = -10
+GAP_EXTEND = -1
+
+# Default half width of the band around the expected diagonal
+BAND = 6
+
+# Operations of an alignment
+OP_MATCH = 0
+OP_DELETION = 1
+OP_INSERTION = 2
+OP_NONE = 3
+
+_NEG = np.int32(-(1 << 30))
+# States in the order they are preferred on ties when coming from a match or a deletion
+_M_ORDER = np.array((OP_INSERTION, OP_MATCH, OP_DELETION), dtype=np.uint8)
+_X_ORDER = np.array((OP_DELETION, OP_MATCH, OP_INSERTION), dtype=np.uint8)
+_GAP = ord("-")
+
+
+def score_profile(codes: np.ndarray) -> np.ndarray:
+    """
+    Returns the (L, 5) score profile of a target sequence given as base indices.
+
+    profile[i, b] is the score of aligning base index b to position i of the target. An N in the target scores
+    N_SCORE for any base.
+    :param codes:
+    :return:
+    """
+    equal = codes[:, np.newaxis] == np.arange(5)[np.newaxis, :]
+    profile = np.where(equal, MATCH_SCORE, MISMATCH_SCORE)
+    profile[codes == 4, :] = N_SCORE
+
+    return profile.astype(np.int32)
+
+
+class ReferenceProfile:
+    """
+    Precomputed score profile of a reference, built once and reused for every alignment against it.
+    """
+    def __init__(self, reference: str):
+        self.reference = reference
+        self.codes = dna.baseIndexCodes[dna.encode(reference)]
+        self.scores = score_profile(self.codes)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def banded_align(scores: np.ndarray, query: np.ndarray, query_length: np.ndarray, band: int = BAND) -> np.ndarray:
+    """
+    Aligns a batch of queries to a target within a band around the main diagonal.
+
+    The alignment is global on the target and starts at the beginning of both sequences, while any bases at the
+    end of the query are free. A query that is up to band bases shorter than the target may also leave the rest of
+    the target free, which is then not part of the alignment. Gaps are scored affine (GAP_OPEN for the first,
+    GAP_EXTEND for each further base).
+
+    Returns an (n, T) matrix of alignment operations in forward order, padded with OP_NONE. OP_MATCH consumes a
+    base of both sequences, OP_DELETION a base of the target only and OP_INSERTION a base of the query only. Queries
+    shorter than the target by more than band cannot reach its end within the band; their rows are left empty.
+    :param scores: (L, 5) profile shared by all queries, or (n, L, 5) with a profile per query.
+    :param query: (n, Q) base indices of the queries.
+    :param query_length: (n,) length of each query.
+    :param band: Half width of the band.
+    :return:
+    """
+    n, Q = query.shape
+    L = scores.shape[-2]
+    B = 2 * band + 1
+    read = np.arange(n)
+    rows = read[:, np.newaxis]
+    offsets = np.arange(B) - band
+    # First row in which an alignment can end at the end of the query without reaching the end of the target
+    first_end = max(L - band, 0)
+
+    pointer_m = np.zeros((L + 1, n, B), dtype=np.uint8)
+    pointer_x = np.zeros((L + 1, n, B), dtype=np.uint8)
+    pointer_y = np.zeros((L + 1, n, B), dtype=np.uint8)
+
+    M = np.full((n, B), _NEG, dtype=np.int32)
+    X = np.full((n, B), _NEG, dtype=np.int32)
+    Y = np.full((n, B), _NEG, dtype=np.int32)
+    M[:, band] = 0
+
+    # Extension penalty of a gap reaching band column k from column 0, used to find insertions with a running maximum
+    extension = (np.arange(B) * GAP_EXTEND).astype(np.int32)
+
+    # Scores of matches and insertions ending at the end of the query in the rows from first_end on
+    end_m = np.full((L - first_end, n), _NEG, dtype=np.int32)
+    end_y = np.full((L - first_end, n), _NEG, dtype=np.int32)
+
+    for i in range(L + 1):
+        j = i + offsets
+        within = (j >= 0)[np.newaxis, :] & (j[np.newaxis, :] <= query_length[:, np.newaxis])
+        within_query = within & (j >= 1)[np.newaxis, :]
+
+        if i > 0:
+            # Matches and mismatches come from the same band column of the previous row
+            qc = query[:, np.clip(j - 1, 0, max(Q - 1, 0))] if Q > 0 else np.zeros((n, B), dtype=np.int8)
+            if scores.ndim == 2:
+                s = scores[i - 1][qc]
+            else:
+                s = scores[rows, i - 1, qc]
+
+            # Ties are resolved in favour of insertions before matches before deletions, which places insertions as
+            # far right and deletions as far left as possible.
+            previous = np.stack((Y, M, X))
+            choice = previous.argmax(axis=0)
+            pointer_m[i] = _M_ORDER[choice]
+            M_new = np.take_along_axis(previous, choice[np.newaxis], axis=0)[0] + s
+            M_new[~within_query] = _NEG
+
+            # Deletions come from the next band column of the previous row, preferably extending a deletion
+            shifted = np.full((3, n, B), _NEG, dtype=np.int32)
+            shifted[0, :, :-1] = X[:, 1:] + GAP_EXTEND
+            shifted[1, :, :-1] = M[:, 1:] + GAP_OPEN
+            shifted[2, :, :-1] = Y[:, 1:] + GAP_OPEN
+            choice = shifted.argmax(axis=0)
+            pointer_x[i] = _X_ORDER[choice]
+            X = np.take_along_axis(shifted, choice[np.newaxis], axis=0)[0]
+            X[~within] = _NEG
+
+            M = M_new
+
+        # Insertions come from the previous band column of the same row. A gap opened in column k' reaches column k
+        # with GAP_OPEN + (k - k' - 1) * GAP_EXTEND, so the best one is found with a running maximum.
+        opening = np.maximum(M, X)
+        best_opening = np.maximum.accumulate(opening - extension[np.newaxis, :], axis=1)
+
+        Y = np.full((n, B), _NEG, dtype=np.int32)
+        Y[:, 1:] = best_opening[:, :-1] + GAP_OPEN + extension[np.newaxis, :-1]
+        Y[~within_query] = _NEG
+
+        extended = np.full((n, B), _NEG, dtype=np.int32)
+        extended[:, 1:] = Y[:, :-1] + GAP_EXTEND
+        opened = np.full((n, B), _NEG, dtype=np.int32)
+        opened[:, 1:] = opening[:, :-1] + GAP_OPEN
+
+        from_x = np.zeros((n, B), dtype=bool)
+        from_x[:, 1:] = X[:, :-1] > M[:, :-1]
+        pointer_y[i] = np.where(extended >= opened, OP_INSERTION, np.where(from_x, OP_DELETION, OP_MATCH))
+
+        if first_end <= i < L:
+            end_k = query_length - i + band
+            valid = (end_k >= 0) & (end_k < B) & (query_length >= first_end)
+            end_k = np.clip(end_k, 0, B - 1)
+            end_m[i - first_end] = np.where(valid, M[read, end_k], _NEG)
+            end_y[i - first_end] = np.where(valid, Y[read, end_k], _NEG)
+
+    # Find the best end point in the last row, and then at the end of the query in the rows before
+    final = np.stack((M, X, Y)).transpose(1, 0, 2).reshape(n, 3 * B)
+    best = final.argmax(axis=1)
+    score = final[read, best]
+    state = (best // B).astype(np.uint8)
+    k = best % B
+    i = np.full(n, L)
+
+    for end in range(L - 1, first_end - 1, -1):
+        for end_state, end_scores in ((OP_MATCH, end_m), (OP_INSERTION, end_y)):
+            better = end_scores[end - first_end] > score
+            score = np.where(better, end_scores[end - first_end], score)
+            state[better] = end_state
+            k = np.where(better, query_length - end + band, k)
+            i[better] = end
+
+    # Trace back all alignments at once
+    ops = np.full((n, L + Q + 1), OP_NONE, dtype=np.uint8)
+    lengths = np.zeros(n, dtype=np.int64)
+    active = ~((i == 0) & (k == band)) & _reached(score)
+    step = 0
+
+    while active.any():
+        ops[active, step] = state[active]
+        lengths += active
+
+        p = np.where(
+            state == OP_MATCH,
+            pointer_m[i, read, k],
+            np.where(state == OP_DELETION, pointer_x[i, read, k], pointer_y[i, read, k]),
+        )
+
+        moves_row = active & (state != OP_INSERTION)
+        k = k + (active & (state == OP_DELETION)) - (active & (state == OP_INSERTION))
+        i = i - moves_row
+        state = np.where(active, p, state).astype(np.uint8)
+
+        active = active & ~((i == 0) & (k == band))
+        step += 1
+
+    # Operations were collected backwards, reverse them within each alignment
+    positions = lengths[:, np.newaxis] - 1 - np.arange(ops.shape[1])[np.newaxis, :]
+    forward = np.take_along_axis(ops, np.maximum(positions, 0), axis=1)
+    forward[positions < 0] = OP_NONE
+
+    return forward
+
+
+def banded_align_single(scores: list, query: list, band: int = BAND) -> list:
+    """
+    Aligns a single query to a target within a band, with the same scoring and tie breaking as banded_align.
+
+    Working on plain lists with scalar loops is much faster than the vectorised version for a single alignment.
+    :param scores: (L, 5) score profile as nested lists
+    :param query: Base indices of the query
+    :param band: Half width of the band
+    :return: List of alignment operations in forward order
+    :raises WeirdReads: If the query is shorter than the target by more than band, so that the alignment cannot
+        reach the end of the target within the band
+    """
+    NEG = int(_NEG)
+    L = len(scores)
+    Q = len(query)
+    B = 2 * band + 1
+
+    pointers_m = []
+    pointers_x = []
+    pointers_y = []
+    first_end = max(L - band, 0)
+    # (row, band column, match score, insertion score) of the alignments ending at the end of the query before the
+    # last row
+    ends = []
+
+    M_prev = X_prev = Y_prev = None
+    for i in range(L + 1):
+        M = [NEG] * B
+        X = [NEG] * B
+        Y = [NEG] * B
+        pm = [0] * B
+        px = [0] * B
+        py = [0] * B
+
+        lo = max(0, band - i)
+        hi = min(B, Q - i + band + 1)
+        row_scores = scores[i - 1] if i > 0 else None
+
+        for k in range(lo, hi):
+            j = i + k - band
+
+            if i == 0:
+                if j == 0:
+                    M[k] = 0
+            else:
+                # Match or mismatch, ties prefer insertions, then matches, then deletions
+                if j >= 1:
+                    best = Y_prev[k]
+                    state = OP_INSERTION
+                    if M_prev[k] > best:
+                        best = M_prev[k]
+                        state = OP_MATCH
+                    if X_prev[k] > best:
+                        best = X_prev[k]
+                        state = OP_DELETION
+                    M[k] = best + row_scores[query[j - 1]]
+                    pm[k] = state
+
+                # Deletion, ties prefer extending a deletion, then matches, then insertions
+                if k + 1 < B:
+                    best = X_prev[k + 1] + GAP_EXTEND
+                    state = OP_DELETION
+                    if M_prev[k + 1] + GAP_OPEN > best:
+                        best = M_prev[k + 1] + GAP_OPEN
+                        state = OP_MATCH
+                    if Y_prev[k + 1] + GAP_OPEN > best:
+                        best = Y_prev[k + 1] + GAP_OPEN
+                        state = OP_INSERTION
+                    X[k] = best
+                    px[k] = state
+
+            # Insertion, ties prefer extending an insertion, then matches, then deletions
+            if j >= 1 and k >= 1:
+                best = Y[k - 1] + GAP_EXTEND
+                state = OP_INSERTION
+                if M[k - 1] + GAP_OPEN > best:
+                    best = M[k - 1] + GAP_OPEN
+                    state = OP_MATCH
+                if X[k - 1] + GAP_OPEN > best:
+                    best = X[k - 1] + GAP_OPEN
+                    state = OP_DELETION
+                Y[k] = best
+                py[k] = state
+
+        pointers_m.append(pm)
+        pointers_x.append(px)
+        pointers_y.append(py)
+        M_prev, X_prev, Y_prev = M, X, Y
+
+        end_k = Q - i + band
+        if first_end <= i < L and 0 <= end_k < B and Q >= first_end:
+            ends.append((i, end_k, M[end_k], Y[end_k]))
+
+    # Find the best end point in the last row, preferring matches, then deletions, then insertions. Then look at the
+    # end of the query in the rows before, from the last one on.
+    best = NEG - 1
+    state = OP_MATCH
+    k = band
+    i = L
+    for s, row in ((OP_MATCH, M_prev), (OP_DELETION, X_prev), (OP_INSERTION, Y_prev)):
+        for c in range(B):
+            if row[c] > best:
+                best = row[c]
+                state = s
+                k = c
+
+    for end, c, match, insertion in reversed(ends):
+        for s, score in ((OP_MATCH, match), (OP_INSERTION, insertion)):
+            if score > best:
+                best = score
+                state = s
+                k = c
+                i = end
+
+    if not _reached(best):
+        raise WeirdReads
+
+    # Trace back
+    ops = []
+    while not (i == 0 and k == band):
+        ops.append(state)
+
+        if state == OP_MATCH:
+            state = pointers_m[i][k]
+            i -= 1
+        elif state == OP_DELETION:
+            state = pointers_x[i][k]
+            i -= 1
+            k += 1
+        else:
+            state = pointers_y[i][k]
+            k -= 1
+
+    ops.reverse()
+
+    return ops
+
+
+def _reached(score):
+    """
+    Returns True for end points of an alignment that can actually be reached. Cells outside of the band keep a score
+    close to _NEG, which gaps and mismatches cannot get below half of it.
+    """
+    return score > _NEG // 2
+
+
+def _max_run(flags: np.ndarray) -> np.ndarray:
+    """
+    Returns the length of the longest run of True in each row.
+    :param flags:
+    :return:
+    """
+    columns = np.arange(flags.shape[1])[np.newaxis, :]
+    last_false = np.maximum.accumulate(np.where(flags, -1, columns), axis=1)
+    runs = np.where(flags, columns - last_false, 0)
+
+    return runs.max(axis=1) if flags.shape[1] > 0 else np.zeros(len(flags), dtype=np.int64)
+
+
+class AlignmentEvents:
+    """
+    Events of a batch of queries aligned to a reference of length L, all indexed by reference position.
+
+    - mismatches: point mutations (ignoring N in the reference), mutationTarget holds the base index or -1.
+    - insertions: an insertion before the reference position, insertionTarget holds the first inserted base or -1.
+    - deletions: a deletion starting at the reference position (ignoring N in the reference).
+    - aligned: the read base (ASCII) aligned to each reference position, or "-" for deletions.
+    - maxInsertion, maxDeletion: length of the longest insertion and deletion of each query.
+
+    Reference positions behind the end of an alignment that ended with the query (see banded_align) stay N in aligned
+    and have no events.
+    """
+    def __init__(self, ops: np.ndarray, reference_codes: np.ndarray, query: np.ndarray):
+        n = len(ops)
+        L = len(reference_codes)
+        rows = np.broadcast_to(np.arange(n)[:, np.newaxis], ops.shape)
+
+        is_match = ops == OP_MATCH
+        is_deletion = ops == OP_DELETION
+        is_insertion = ops == OP_INSERTION
+
+        reference_index = np.cumsum(is_match | is_deletion, axis=1) - 1
+        query_index = np.cumsum(is_match | is_insertion, axis=1) - 1
+        query_base = query[np.arange(n)[:, np.newaxis], np.clip(query_index, 0, max(query.shape[1] - 1, 0))] if query.shape[1] > 0 else np.zeros(ops.shape, dtype=np.int8)
+        reference_base = reference_codes[np.clip(reference_index, 0, L - 1)]
+
+        self.mismatches = np.zeros((n, L), dtype=bool)
+        self.mutationTarget = np.full((n, L), -1, dtype=np.int8)
+        self.insertions = np.zeros((n, L), dtype=bool)
+        self.insertionTarget = np.full((n, L), -1, dtype=np.int8)
+        self.deletions = np.zeros((n, L), dtype=bool)
+        self.aligned = np.full((n, L), ord("N"), dtype=np.uint8)
+
+        # Point mutations
+        mutated = is_match & (query_base != reference_base) & (reference_base != 4)
+        self.mismatches[rows[mutated], reference_index[mutated]] = True
+        self.mutationTarget[rows[mutated], reference_index[mutated]] = query_base[mutated]
+
+        # Aligned bases
+        self.aligned[rows[is_match], reference_index[is_match]] = dna.baseCodes[query_base[is_match]]
+        self.aligned[rows[is_deletion], reference_index[is_deletion]] = _GAP
+
+        # Only the start of an insertion or deletion is counted
+        previous = np.full(ops.shape, OP_NONE, dtype=np.uint8)
+        previous[:, 1:] = ops[:, :-1]
+
+        opened = is_insertion & (previous != OP_INSERTION) & (reference_index + 1 < L)
+        self.insertions[rows[opened], reference_index[opened] + 1] = True
+        self.insertionTarget[rows[opened], reference_index[opened] + 1] = query_base[opened]
+
+        opened = is_deletion & (previous != OP_DELETION) & (reference_base != 4)
+        self.deletions[rows[opened], reference_index[opened]] = True
+
+        self.maxInsertion = _max_run(is_insertion)
+        self.maxDeletion = _max_run(is_deletion)
+
+    def __len__(self):
+        return len(self.mismatches)
+
@@ -0,0 +1,333 @@
+from collections import defaultdict, Counter
+from typing import Dict, Hashable, List, Sequence, Tuple
+import numpy as np
+
+from .result import AlignedReadResult, FailedReadResult, BaseResult
+from .reference import CompiledReference
+from .abundance import MemberCounts
+
+
+class EventCounts:
+    """
+    Integer counters of the events of aligned reads, for each reference position and each of C columns. Column 0
+    counts all reads, column i the reads assigned to the i-th codon.
+
+    Events are buffered and added with np.bincount once enough of them have been collected, which is much cheaper
+    than adding dense arrays per read. Counts only get converted to float when normalised.
+    """
+    def __init__(self, L: int, columns: int, buffer_size: int = 1 << 16):
+        self.L = L
+        self.columns = columns
+        self.buffer_size = buffer_size
+
+        self.mismatches = np.zeros((L, columns), dtype=np.int64)
+        self.mutationTarget = np.zeros((L, 5, columns), dtype=np.int64)
+        self.indels = np.zeros((L, 2, columns), dtype=np.int64)
+        self.insertionTarget = np.zeros((L, 5, columns), dtype=np.int64)
+
+        self._positions = []
+        self._kinds = []
+        self._bases = []
+        self._columns = []
+        self._weights = []
+
+    def add(self, result: AlignedReadResult, column: int = 0, count: int = 1):
+        """
+        Adds the events of an aligned read, counting them count times in column 0 and in the given column.
+        :param result:
+        :param column:
+        :param count:
+        :return:
+        """
+        for position, kind, base in result.events:
+            self._positions.append(position)
+            self._kinds.append(kind)
+            self._bases.append(base)
+            self._columns.append(column)
+            self._weights.append(count)
+
+        if len(self._positions) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds all buffered events to the counters.
+        :return:
+        """
+        if len(self._positions) == 0:
+            return
+
+        positions = np.array(self._positions, dtype=np.int64)
+        kinds = np.array(self._kinds, dtype=np.int64)
+        bases = np.array(self._bases, dtype=np.int64)
+        columns = np.array(self._columns, dtype=np.int64)
+        weights = np.array(self._weights, dtype=np.int64)
+
+        self._positions.clear()
+        self._kinds.clear()
+        self._bases.clear()
+        self._columns.clear()
+        self._weights.clear()
+
+        # Every event is counted in column 0, and again in its codon column if it has one
+        codon = columns > 0
+        positions = np.concatenate((positions, positions[codon]))
+        kinds = np.concatenate((kinds, kinds[codon]))
+        bases = np.concatenate((bases, bases[codon]))
+        weights = np.concatenate((weights, weights[codon]))
+        columns = np.concatenate((np.zeros(len(codon), dtype=np.int64), columns[codon]))
+
+        mismatch = kinds == AlignedReadResult.MISMATCH
+        insertion = kinds == AlignedReadResult.INSERTION
+        indel = ~mismatch
+
+        self._count(self.mismatches, (positions[mismatch], columns[mismatch]), weights[mismatch])
+        self._count(self.mutationTarget, (positions[mismatch], bases[mismatch], columns[mismatch]), weights[mismatch])
+        self._count(self.indels, (positions[indel], kinds[indel] - AlignedReadResult.INSERTION, columns[indel]), weights[indel])
+        self._count(self.insertionTarget, (positions[insertion], bases[insertion], columns[insertion]), weights[insertion])
+
+    def merge(self, other: "EventCounts"):
+        """
+        Adds the counters of another instance to this one.
+        :param other:
+        :return:
+        """
+        self.flush()
+        other.flush()
+
+        self.mismatches += other.mismatches
+        self.mutationTarget += other.mutationTarget
+        self.indels += other.indels
+        self.insertionTarget += other.insertionTarget
+
+    @staticmethod
+    def _count(target: np.ndarray, index: tuple, weights: np.ndarray):
+        flat = np.ravel_multi_index(index, target.shape)
+        target += np.bincount(flat, weights=weights, minlength=target.size).astype(np.int64).reshape(target.shape)
+
+    def normalised(self, totals: np.ndarray):
+        """
+        Returns the counters as float arrays, each column divided by the amount of reads in totals.
+        :param totals: Amount of reads for each column
+        :return: mismatches, mutationTarget, indels, insertionTarget
+        """
+        self.flush()
+
+        return normalise_events((self.mismatches, self.mutationTarget, self.indels, self.insertionTarget), totals)
+
+
+def normalise_events(counters: Sequence[np.ndarray], totals: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Divides each column (last axis) of integer event counters by the amount of reads in totals.
+    :param counters:
+    :param totals: Amount of reads for each column
+    :return:
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        totals = np.asarray(totals, dtype=float)
+
+        return tuple(counter / totals for counter in counters)
+
+
+class SplitCounts:
+    """
+    Sparse event counters of aligned reads, split by the codons found at one or several codon positions.
+
+    Without combine, every position is split on separately and the keys are (position, codon). With combine, reads are
+    split on the combination of all positions and the keys are tuples of codons, one per position. Only codons made
+    of A, C, G and T are used. Reads without one at any of the positions (or, when combining, at one of them) are
+    counted as unassigned.
+
+    The counters are hash-indexed by key, and each key only stores the events that were actually seen as a Counter of
+    (position, kind, base), so memory grows with the building blocks observed instead of with all possible
+    combinations.
+    """
+    _bases = frozenset("ACGT")
+
+    def __init__(self, positions: Sequence[int] = (), combine: bool = False):
+        self.positions = list(positions)
+        self.combine = combine
+
+        self.reads = defaultdict(int)
+        self.events = defaultdict(Counter)
+        self.unassigned = 0
+
+    @property
+    def active(self) -> bool:
+        return len(self.positions) > 0
+
+    def _valid(self, codon: str) -> bool:
+        return len(codon) > 0 and self._bases.issuperset(codon)
+
+    def keys(self, codons: List[str]) -> List[Hashable]:
+        """
+        Returns the keys a read with the given codons is counted for.
+        :param codons: All codons of a read
+        :return:
+        """
+        found = [codons[p] if p < len(codons) and self._valid(codons[p]) else None for p in self.positions]
+
+        if self.combine:
+            return [tuple(found)] if None not in found else []
+        else:
+            return [(p, codon) for p, codon in zip(self.positions, found) if codon is not None]
+
+    def add(self, result: AlignedReadResult, count: int = 1):
+        """
+        Adds the events of an aligned read to all its keys, count times.
+        :param result:
+        :param count:
+        :return:
+        """
+        keys = self.keys(result.codons)
+
+        if len(keys) == 0:
+            self.unassigned += count
+
+        for key in keys:
+            self.reads[key] += count
+
+            if len(result.events) > 0:
+                events = self.events[key]
+                for event in result.events:
+                    events[event] += count
+
+    def merge(self, other: "SplitCounts"):
+        """
+        Adds the counters of another instance to this one.
+        :param other:
+        :return:
+        """
+        for key, reads in other.reads.items():
+            self.reads[key] += reads
+
+        for key, events in other.events.items():
+            self.events[key].update(events)
+
+        self.unassigned += other.unassigned
+
+    def to_dict(self) -> Dict[Hashable, Tuple[int, Dict[Tuple[int, int, int], int]]]:
+        """
+        Returns the counters as plain dictionary mapping each key to (reads, {(position, kind, base): count}).
+        :return:
+        """
+        return {key: (reads, dict(self.events.get(key, {}))) for key, reads in self.reads.items()}
+
+
+def split_profile(split: Tuple[int, Dict[Tuple[int, int, int], int]], L: int):
+    """
+    Converts an entry of SplitCounts.to_dict into dense profiles normalised by the amount of reads, in the same layout
+    as the total profiles of a sample.
+    :param split: (reads, events)
+    :param L: Length of the reference
+    :return: mismatches (L,), mutationTarget (L, 5), indels (L, 2), insertionTarget (L, 5)
+    """
+    reads, events = split
+    result = AlignedReadResult(L)
+
+    counts = EventCounts(L, 1)
+    for event, count in events.items():
+        result.events = [event]
+        counts.add(result, 0, count)
+
+    mismatches, mutation_target, indels, insertion_target = counts.normalised([reads])
+
+    return mismatches[:, 0], mutation_target[:, :, 0], indels[:, :, 0], insertion_target[:, :, 0]
+
+
+class SampleCounts:
+    """
+    All counters of a sample, or of a part of it: the event counters, the amount of reads per outcome and per
+    codon, the codon splits and the library members. Workers fill one instance per chunk of reads, and the parent
+    merges them.
+    """
+    def __init__(
+            self,
+            reference: CompiledReference,
+            split_positions: Sequence[int] = (),
+            combine: bool = False,
+            count_members: bool = True,
+            sketch_width: int = 0,
+            sketch_depth: int = 4,
+            max_members: int = 100_000,
+    ):
+        # Only the codon lookup of the reference is kept, so that partial counts stay small when they are sent back
+        # from the workers or saved in checkpoints
+        self.codonIndex = reference.codonIndex
+        self.events = EventCounts(len(reference), 1 + len(reference.codons))
+        self.splits = SplitCounts(split_positions, combine)
+        self.members = MemberCounts(
+            [y - x for x, y in reference.coordinates] if count_members else [],
+            sketch_width, sketch_depth, max_members,
+        )
+
+        self.reads = 0
+        self.alignedReads = 0
+        self.mismatchedPairs = 0
+        self.tooManyPointMutations = 0
+        self.offTargetPairs = 0
+        # Failed pairs whose mates could not be merged, counted in addition to their reason
+        self.unmergedPairs = 0
+        self.alignedReadsPerCodon = defaultdict(int)
+        # Aligned reads per analyzer tier that resolved them
+        self.resolvedBy = defaultdict(int)
+
+    def add(self, result: BaseResult):
+        """
+        Counts a result, weighted by the amount of identical read pairs it stands for.
+        :param result:
+        :return:
+        """
+        count = result.count
+        self.reads += count
+
+        if isinstance(result, AlignedReadResult):
+            self.alignedReads += count
+            self.resolvedBy[result.tier] += count
+
+            # Get codon index
+            codon_index = self.codonIndex.get(result.codon, 0)
+            if codon_index > 0:
+                self.alignedReadsPerCodon[result.codon] += count
+
+            # Count up, in total and codon specific
+            self.events.add(result, codon_index, count)
+
+            if self.splits.active:
+                self.splits.add(result, count)
+
+            if self.members.active:
+                self.members.add(result.codons, count)
+        elif isinstance(result, FailedReadResult):
+            if result.reason == FailedReadResult.tooManyMismatchesBetweenPair:
+                self.mismatchedPairs += count
+            elif result.reason == FailedReadResult.tooManyMismatchesToReference:
+                self.tooManyPointMutations += count
+            elif result.reason == FailedReadResult.offTarget:
+                self.offTargetPairs += count
+
+            if result.unmerged:
+                self.unmergedPairs += count
+
+    def merge(self, other: "SampleCounts"):
+        """
+        Adds the counters of another instance to this one.
+        :param other:
+        :return:
+        """
+        self.events.merge(other.events)
+        self.splits.merge(other.splits)
+        self.members.merge(other.members)
+
+        self.reads += other.reads
+        self.alignedReads += other.alignedReads
+        self.mismatchedPairs += other.mismatchedPairs
+        self.tooManyPointMutations += other.tooManyPointMutations
+        self.offTargetPairs += other.offTargetPairs
+        self.unmergedPairs += other.unmergedPairs
+
+        for codon, count in other.alignedReadsPerCodon.items():
+            self.alignedReadsPerCodon[codon] += count
+
+        for tier, count in other.resolvedBy.items():
+            self.resolvedBy[tier] += count
@@ -0,0 +1,286 @@
+import gzip
+import mmap
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
+
+GZIP_MAGIC = b"\x1f\x8b\x08"
+# Minimal header size of a gzip member with an extra field (up to and including XLEN)
+GZIP_HEADER_SIZE = 12
+
+
+def is_gzip(source: str) -> bool:
+    """
+    Checks if a file starts with a gzip header.
+    :param source:
+    :return:
+    """
+    with open(source, "rb") as fh:
+        return fh.read(3) == GZIP_MAGIC
+
+
+def _bgzf_member_size(data, offset: int):
+    """
+    Returns the total size of the BGZF member starting at offset, or None if the member is not a BGZF block or if
+    its header is not completely contained in data.
+    :param data:
+    :param offset:
+    :return:
+    """
+    if len(data) < offset + GZIP_HEADER_SIZE:
+        return None
+
+    if data[offset:offset + 3] != GZIP_MAGIC or not data[offset + 3] & 4:
+        return None
+
+    xlen, = struct.unpack_from("<H", data, offset + 10)
+    if len(data) < offset + GZIP_HEADER_SIZE + xlen:
+        return None
+
+    # Walk the subfields of the extra field to find the BC field containing the block size
+    position = offset + GZIP_HEADER_SIZE
+    end = position + xlen
+    while position + 4 <= end:
+        si1, si2, slen = struct.unpack_from("<BBH", data, position)
+
+        if si1 == 66 and si2 == 67 and slen == 2:
+            bsize, = struct.unpack_from("<H", data, position + 4)
+            return bsize + 1
+
+        position += 4 + slen
+
+    return None
+
+
+def is_bgzf(source: str) -> bool:
+    """
+    Checks if a file is block gzip compressed (BGZF), as written by bgzip or samtools.
+
+    BGZF files consist of independent gzip members that store their compressed size in the header, which allows
+    them to be inflated in parallel.
+    :param source:
+    :return:
+    """
+    with open(source, "rb") as fh:
+        header = fh.read(1024)
+
+    return _bgzf_member_size(header, 0) is not None
+
+
+def _inflate_members(data: bytes) -> bytes:
+    """
+    Inflates a buffer of one or more concatenated gzip members. Raises EOFError like gzip if the last member is cut
+    short.
+    :param data:
+    :return:
+    """
+    out = []
+
+    while len(data) > 0:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        out.append(decompressor.decompress(data))
+        data = decompressor.unused_data
+
+        if not decompressor.eof:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+    return b"".join(out)
+
+
+class _BufferedReader:
+    """
+    Base for readers that produce decompressed data in chunks. Subclasses implement _next_chunk, which returns
+    b"" at the end of the stream.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._eof = False
+
+    def _next_chunk(self) -> bytes:
+        raise NotImplementedError()
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._next_chunk()
+
+            if len(chunk) == 0:
+                self._eof = True
+            else:
+                self._buffer += chunk
+
+        if size < 0 or size >= len(self._buffer):
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        else:
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+
+        return data
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class ParallelBGZFReader(_BufferedReader):
+    """
+    Reads a BGZF file by inflating groups of independent blocks on a thread pool.
+
+    zlib releases the GIL while inflating, so the blocks are decompressed concurrently. Groups are returned in file
+    order, and at most 2 * threads groups are kept in flight to bound memory.
+    """
+    def __init__(self, source: str, threads: int = 4, chunk_size: int = 1 << 22):
+        super().__init__()
+        self._fh = open(source, "rb")
+        self._executor = ThreadPoolExecutor(threads)
+        self._pending = deque()
+        self._rest = b""
+        self._chunk_size = chunk_size
+        self._max_pending = 2 * threads
+        self._source_eof = False
+
+    def _submit(self):
+        data = self._rest + self._fh.read(self._chunk_size)
+
+        if len(data) == len(self._rest):
+            self._source_eof = True
+
+        # Find the last complete member within the compressed data
+        end = 0
+        while True:
+            size = _bgzf_member_size(data, end)
+
+            if size is None or end + size > len(data):
+                break
+
+            end += size
+
+        if self._source_eof:
+            # Whatever is left is inflated as well, which fails if the file is truncated
+            end = len(data)
+
+        self._rest = data[end:]
+
+        if end > 0:
+            self._pending.append(self._executor.submit(_inflate_members, data[:end]))
+
+    def _next_chunk(self) -> bytes:
+        while not self._source_eof and len(self._pending) < self._max_pending:
+            self._submit()
+
+        if len(self._pending) == 0:
+            return b""
+
+        return self._pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._fh.close()
+
+
+class BackgroundGzipReader(_BufferedReader):
+    """
+    Reads a regular (single or multi-member) gzip file with inflation running in a background thread.
+
+    Member boundaries of ordinary gzip files are only known after inflating them, so the stream cannot be split
+    up. Inflating ahead in a separate thread still overlaps decompression with parsing.
+    """
+    def __init__(self, source: str, chunk_size: int = 1 << 22, max_pending: int = 4):
+        super().__init__()
+        self._fh = gzip.open(source, "rb")
+        self._queue = Queue(max_pending)
+        self._chunk_size = chunk_size
+        self._closed = False
+        self._thread = Thread(target=self._inflate, daemon=True)
+        self._thread.start()
+
+    def _inflate(self):
+        try:
+            while not self._closed:
+                chunk = self._fh.read(self._chunk_size)
+                self._queue.put(chunk)
+
+                if len(chunk) == 0:
+                    break
+        except Exception as e:
+            self._queue.put(e)
+
+    def _next_chunk(self) -> bytes:
+        chunk = self._queue.get()
+
+        if isinstance(chunk, Exception):
+            raise chunk
+
+        return chunk
+
+    def close(self):
+        self._closed = True
+
+        # Drain the queue so the background thread is not stuck on a full queue
+        while self._thread.is_alive():
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._thread.join(0.01)
+
+        self._fh.close()
+
+
+class MappedReader:
+    """
+    Reads an uncompressed file through a read-only memory map.
+    """
+    def __init__(self, source: str):
+        self._fh = open(source, "rb")
+
+        try:
+            self._map = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._fh.close()
+            raise
+
+    def read(self, size: int = -1) -> bytes:
+        return self._map.read(size)
+
+    def close(self):
+        self._map.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_fastq(source: str, threads: int = 1):
+    """
+    Opens a fastq file for binary reading, choosing the fastest available strategy.
+
+    - BGZF files get inflated block-wise on a thread pool with the given amount of threads.
+    - Other gzip files get inflated in a background thread (if threads > 1) or directly.
+    - Uncompressed files get memory mapped.
+    :param source:
+    :param threads:
+    :return: A file-like object supporting read() and the context manager protocol.
+    """
+    if is_gzip(source):
+        if threads > 1 and is_bgzf(source):
+            return ParallelBGZFReader(source, threads)
+        elif threads > 1:
+            return BackgroundGzipReader(source)
+        else:
+            return gzip.open(source, "rb")
+    else:
+        try:
+            return MappedReader(source)
+        except ValueError:
+            # Empty files cannot be mapped
+            return open(source, "rb")
@@ -0,0 +1,49 @@
+from typing import Iterator, Tuple
+
+Pair = Tuple[bytes, bytes]
+
+
+class PairCollapser:
+    """
+    Collapses identical read pairs so that each distinct pair only needs to be analysed once.
+
+    Pairs are counted in a table of at most max_unique distinct pairs. Once the table is full, all pairs in it get
+    released together with their multiplicity and the table starts over, which keeps memory bounded while still
+    collapsing the (typically very frequent) duplicates within each window.
+    """
+    def __init__(self, max_unique: int = 100_000):
+        self.max_unique = max_unique
+        # Maps a pair to [number of its first read, count]
+        self.table = {}
+
+        # Amount of distinct pairs released so far
+        self.unique = 0
+
+    def add(self, read_number: int, pair: Pair) -> Iterator[Tuple[int, Pair, int]]:
+        """
+        Adds a pair and yields (read number, pair, count) for all released pairs if the table is full.
+        :param read_number:
+        :param pair:
+        :return:
+        """
+        entry = self.table.get(pair)
+
+        if entry is None:
+            self.table[pair] = [read_number, 1]
+        else:
+            entry[1] += 1
+
+        if len(self.table) >= self.max_unique:
+            yield from self.flush()
+
+    def flush(self) -> Iterator[Tuple[int, Pair, int]]:
+        """
+        Yields (read number, pair, count) for every pair in the table and empties it.
+        :return:
+        """
+        table = self.table
+        self.table = {}
+        self.unique += len(table)
+
+        for pair, (read_number, count) in table.items():
+            yield read_number, pair, count
@@ -8,3 +8,7 @@ class TooManyMismatchesBetweenPair(Exception):
 
 class TooManyMismatchesToReference(Exception):
     pass
+
+
+class IncompatibleCheckpoint(Exception):
+    pass
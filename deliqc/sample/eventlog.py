@@ -0,0 +1,305 @@
+from typing import Dict, Iterator, List, Sequence, Tuple, Union
+import json
+import os
+import struct
+import numpy as np
+
+from .result import AlignedReadResult, BaseResult
+
+# Start of every event log, followed by the length of the header
+MAGIC = b"DQE\x01"
+# Records per batch. Batches are written as soon as they are full, so that a writer never holds more than this.
+BATCH_RECORDS = 1 << 16
+
+# kind of the record of a read without events, or of a failed read
+NO_EVENT = -1
+KINDS = {
+    "none": NO_EVENT,
+    "mismatch": AlignedReadResult.MISMATCH,
+    "insertion": AlignedReadResult.INSERTION,
+    "deletion": AlignedReadResult.DELETION,
+}
+# reason of aligned reads
+ALIGNED = -1
+# tier of the analyzer that resolved a read, 0 for failed reads
+TIERS = ("failed", "simple", "shifted", "advanced")
+# Codon that is not made of A, C, G and T only, or longer than MAX_CODON_LENGTH
+NO_CODON = 0xFFFF
+MAX_CODON_LENGTH = 7
+# Flag of a failed read whose mates could not be merged
+UNMERGED = 1
+
+_HEADER = struct.Struct("<4sQ")
+_BATCH = struct.Struct("<I")
+_quaternary = str.maketrans("ACGT", "0123")
+
+
+def record_dtype(codons: int) -> np.dtype:
+    """
+    Returns the record of the event log for a reference with the given amount of codons. Every read gets one
+    record per event, or a single record with kind NO_EVENT if it has none or failed. All records of a read hold the
+    read (number of its first pair), count (amount of identical pairs), reason (ALIGNED or the FailedReadResult
+    reason), tier, flags, pairMismatches and codons (see encode_codon); position and base describe the event.
+    :param codons:
+    :return:
+    """
+    return np.dtype([
+        ("sample", "<u2"),
+        ("read", "<u8"),
+        ("count", "<u4"),
+        ("reason", "i1"),
+        ("tier", "u1"),
+        ("flags", "u1"),
+        ("pairMismatches", "<u2"),
+        ("kind", "i1"),
+        ("position", "<i2"),
+        ("base", "i1"),
+        ("codons", "<u2", (codons,)),
+    ])
+
+
+def encode_codon(codon: str) -> int:
+    """
+    Returns a codon as integer with 2 bits per base, or NO_CODON.
+    :param codon:
+    :return:
+    """
+    if codon is None or not 0 < len(codon) <= MAX_CODON_LENGTH or codon.strip("ACGT") != "":
+        return NO_CODON
+
+    return int(codon.translate(_quaternary), 4)
+
+
+def decode_codon(value: int, length: int) -> str:
+    """
+    Returns the codon of length bases encoded by encode_codon, or None for NO_CODON.
+    :param value:
+    :param length:
+    :return:
+    """
+    if value == NO_CODON:
+        return None
+
+    return "".join("ACGT"[(value >> (2 * (length - 1 - i))) & 3] for i in range(length))
+
+
+def event_records(results: Sequence[Tuple[int, BaseResult]], codons: int) -> np.ndarray:
+    """
+    Converts the results of a chunk of read pairs into records of the event log.
+    :param results: (read number, result) of each pair
+    :param codons: Amount of codons of the reference
+    :return:
+    """
+    dtype = record_dtype(codons)
+    size = sum(max(1, len(result.events)) if isinstance(result, AlignedReadResult) else 1 for _, result in results)
+    records = np.zeros(size, dtype=dtype)
+    records["kind"] = NO_EVENT
+    records["reason"] = ALIGNED
+    records["codons"] = NO_CODON
+
+    i = 0
+    for read, result in results:
+        if isinstance(result, AlignedReadResult):
+            n = max(1, len(result.events))
+            rows = records[i:i + n]
+            rows["tier"] = TIERS.index(result.tier)
+            rows["pairMismatches"] = result.pairMismatches
+            rows["codons"] = [encode_codon(codon) for codon in result.codons]
+
+            for j, (position, kind, base) in enumerate(result.events):
+                rows["kind"][j] = kind
+                rows["position"][j] = position
+                rows["base"][j] = base
+        else:
+            n = 1
+            rows = records[i:i + 1]
+            rows["reason"] = result.reason
+            rows["flags"] = UNMERGED if result.unmerged else 0
+
+        rows["read"] = read
+        rows["count"] = result.count
+        i += n
+
+    return records
+
+
+class EventLogWriter:
+    """
+    Streams records of the event log to a file in batches of at most BATCH_RECORDS records, each preceded by its
+    amount of records. The file starts with MAGIC, the length of the header and the header as JSON, which holds the
+    reference, the codon coordinates, the read files of each sample and the record layout.
+
+    flush writes the current batch even if it is not full and returns the size of the file; opening a writer with
+    resume_at continues a log from such a size, dropping everything written after it.
+    """
+    def __init__(self, filename: str, reference: str, coordinates: List[Tuple[int, int]], files: List[Tuple[str, str]], resume_at: int = None):
+        self.filename = filename
+        self.dtype = record_dtype(len(coordinates))
+        self.batch = np.zeros(BATCH_RECORDS, dtype=self.dtype)
+        self.size = 0
+
+        if resume_at is not None:
+            self.fh = open(filename, "r+b")
+            self.fh.truncate(resume_at)
+            self.fh.seek(resume_at)
+            return
+
+        header = json.dumps({
+            "reference": reference,
+            "coordinates": [list(c) for c in coordinates],
+            "files": [list(pair) for pair in files],
+            "batchRecords": BATCH_RECORDS,
+            "dtype": self.dtype.descr,
+        }).encode("utf-8")
+
+        self.fh = open(filename, "wb")
+        self.fh.write(_HEADER.pack(MAGIC, len(header)))
+        self.fh.write(header)
+
+    def write(self, sample: int, records: np.ndarray):
+        """
+        Adds the records of a sample.
+        :param sample: Index of the sample
+        :param records: Records returned by event_records
+        :return:
+        """
+        start = 0
+        while start < len(records):
+            n = min(len(records) - start, BATCH_RECORDS - self.size)
+            self.batch[self.size:self.size + n] = records[start:start + n]
+            self.batch["sample"][self.size:self.size + n] = sample
+            self.size += n
+            start += n
+
+            if self.size == BATCH_RECORDS:
+                self._write_batch()
+
+    def _write_batch(self):
+        if self.size > 0:
+            self.fh.write(_BATCH.pack(self.size))
+            self.fh.write(self.batch[:self.size].tobytes())
+            self.size = 0
+
+    def flush(self) -> int:
+        """
+        Writes the current batch and returns the size of the file.
+        :return:
+        """
+        self._write_batch()
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+
+        return self.fh.tell()
+
+    def close(self):
+        self.flush()
+        self.fh.close()
+
+
+class EventLog:
+    """
+    Reads an event log written by EventLogWriter one batch at a time, so that logs of any size can be filtered
+    without loading them.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+
+        with open(filename, "rb") as fh:
+            magic, length = _HEADER.unpack(fh.read(_HEADER.size))
+
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a deliqc event log.")
+
+            header = json.loads(fh.read(length).decode("utf-8"))
+
+        self.start = _HEADER.size + length
+        self.reference = header["reference"]
+        self.coordinates = [tuple(c) for c in header["coordinates"]]
+        self.files = [tuple(pair) for pair in header["files"]]
+        self.dtype = np.dtype([tuple(field) if len(field) == 2 else (field[0], field[1], tuple(field[2])) for field in header["dtype"]])
+
+    def batches(self) -> Iterator[np.ndarray]:
+        """
+        Yields the records of the log batch by batch.
+        :return:
+        """
+        with open(self.filename, "rb") as fh:
+            fh.seek(self.start)
+
+            while True:
+                data = fh.read(_BATCH.size)
+                if len(data) < _BATCH.size:
+                    break
+
+                size, = _BATCH.unpack(data)
+                records = np.frombuffer(fh.read(size * self.dtype.itemsize), dtype=self.dtype)
+
+                # A batch cut short by an interrupted run is dropped
+                if len(records) < size:
+                    break
+
+                yield records
+
+    def filter(
+            self,
+            codons: Dict[int, str] = None,
+            position: Union[int, Tuple[int, int]] = None,
+            kind: Union[str, Sequence[str]] = None,
+            sample: int = None,
+            aligned: bool = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Yields the records of each batch that match all given conditions.
+        :param codons: Maps codon numbers (indices into the codon coordinates, as for split_on_codon) to the codon
+            that has to be found there
+        :param position: A reference position, or a (start, end) range of them
+        :param kind: One or several of none, mismatch, insertion and deletion
+        :param sample: Index of the sample
+        :param aligned: Only aligned (True) or failed (False) reads
+        :return:
+        """
+        for number in (codons or {}):
+            if not 0 <= number < len(self.coordinates):
+                raise ValueError(f"Codon number {number} does not exist, the reference of {self.filename} has {len(self.coordinates)} codons.")
+
+        if isinstance(kind, str):
+            kind = [kind]
+        if isinstance(position, int):
+            position = (position, position + 1)
+
+        kinds = [KINDS[k] for k in kind] if kind is not None else None
+        encoded = {number: encode_codon(codon) for number, codon in (codons or {}).items()}
+
+        for records in self.batches():
+            mask = np.ones(len(records), dtype=bool)
+
+            for number, codon in encoded.items():
+                mask &= records["codons"][:, number] == codon
+            if position is not None:
+                mask &= (records["position"] >= position[0]) & (records["position"] < position[1]) & (records["kind"] != NO_EVENT)
+            if kinds is not None:
+                mask &= np.isin(records["kind"], kinds)
+            if sample is not None:
+                mask &= records["sample"] == sample
+            if aligned is not None:
+                mask &= (records["reason"] == ALIGNED) == aligned
+
+            if mask.any():
+                yield records[mask]
+
+    def select(self, **kwargs) -> np.ndarray:
+        """
+        Returns all records matching the conditions of filter at once.
+        :param kwargs: See filter
+        :return:
+        """
+        return np.concatenate([np.empty(0, dtype=self.dtype)] + list(self.filter(**kwargs)))
+
+    def decode_codons(self, records: np.ndarray) -> List[Tuple[str, ...]]:
+        """
+        Returns the codons of records as tuples of str (None for codons that could not be read).
+        :param records:
+        :return:
+        """
+        lengths = [y - x for x, y in self.coordinates]
+        return [tuple(decode_codon(int(v), length) for v, length in zip(row, lengths)) for row in records["codons"]]
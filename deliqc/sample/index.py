@@ -0,0 +1,432 @@
+import os
+import zlib
+import numpy as np
+from typing import Iterator, List, Optional, Tuple
+
+from .decompression import is_gzip
+
+# Suffix of the sidecar file storing the index next to the fastq file
+INDEX_SUFFIX = ".dqi"
+
+# Minimal distance (in uncompressed bytes) between two stored gzip access points
+ACCESS_POINT_SPACING = 1 << 20
+
+_CHUNK_SIZE = 1 << 20
+
+
+def _parse_tile(header: bytes) -> int:
+    """
+    Extracts the tile number from an Illumina read header, or returns -1 if the header has no known format.
+
+    Supports the current format (@instrument:run:flowcell:lane:tile:x:y) and the older one (@instrument:lane:tile:x:y).
+    :param header:
+    :return:
+    """
+    fields = header.split(maxsplit=1)[0].split(b":") if len(header) > 0 else []
+
+    try:
+        if len(fields) >= 7:
+            return int(fields[4])
+        elif len(fields) == 5:
+            return int(fields[2])
+    except ValueError:
+        pass
+
+    return -1
+
+
+def _inflate_with_access_points(fh, spacing: int):
+    """
+    Inflates a (multi-member) gzip file, yielding the decompressed data in chunks together with the access points
+    found within that chunk.
+
+    An access point is a pair of (compressed offset, uncompressed offset) at which a new gzip member starts, and
+    decompression can therefore begin without any prior state.
+    :param fh:
+    :param spacing:
+    :return:
+    """
+    compressed_position = 0
+    uncompressed_position = 0
+    last_point = 0
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    while True:
+        data = fh.read(_CHUNK_SIZE)
+        if not data:
+            break
+
+        points = []
+        out = []
+        member_start = compressed_position
+        compressed_position += len(data)
+
+        while len(data) > 0:
+            chunk = decompressor.decompress(data)
+            out.append(chunk)
+            uncompressed_position += len(chunk)
+
+            if not decompressor.eof:
+                break
+
+            # A member ended. Whatever is left over belongs to the next member.
+            data = decompressor.unused_data
+            member_start = compressed_position - len(data)
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+            if len(data) > 0 and uncompressed_position - last_point >= spacing:
+                points.append((member_start, uncompressed_position))
+                last_point = uncompressed_position
+
+        yield b"".join(out), points
+
+
+class FastqIndex:
+    """
+    Index of the record offsets within a fastq file.
+
+    offsets contains the (uncompressed) byte offset of every record, tiles the Illumina tile the record comes from
+    (-1 if unknown), and access_points pairs of (compressed, uncompressed) offsets where reading can start. For plain
+    files, the only access point is the start of the file, as every offset can be seeked to directly.
+    """
+    VERSION = 1
+
+    def __init__(self, source: str, offsets: np.ndarray, tiles: np.ndarray, access_points: np.ndarray, end: int, compressed: bool):
+        self.source = source
+        self.offsets = offsets
+        self.tiles = tiles
+        self.access_points = access_points
+        # Uncompressed size of the file, which is also the end of the last record
+        self.end = end
+        self.compressed = compressed
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @staticmethod
+    def sidecar(source: str) -> str:
+        return source + INDEX_SUFFIX
+
+    @classmethod
+    def build(cls, source: str, spacing: int = ACCESS_POINT_SPACING) -> "FastqIndex":
+        """
+        Builds the index by reading through the whole file once.
+        :param source:
+        :param spacing: Minimal distance between gzip access points.
+        :return:
+        """
+        compressed = is_gzip(source)
+
+        offsets = []
+        tiles = []
+        access_points = [(0, 0)]
+        position = 0
+        rest = b""
+
+        with open(source, "rb") as fh:
+            if compressed:
+                chunks = _inflate_with_access_points(fh, spacing)
+            else:
+                chunks = ((data, []) for data in iter(lambda: fh.read(_CHUNK_SIZE), b""))
+
+            for chunk, points in chunks:
+                access_points += points
+                lines = (rest + chunk).split(b"\n")
+
+                # Only complete records are indexed, the rest is kept for the next chunk
+                complete = (len(lines) - 1) // 4 * 4
+                rest = b"\n".join(lines[complete:])
+
+                line_lengths = np.fromiter((len(line) + 1 for line in lines[:complete]), dtype=np.int64, count=complete)
+                line_starts = np.cumsum(line_lengths) - line_lengths + position
+
+                offsets.append(line_starts[0::4])
+                tiles.append(np.fromiter((_parse_tile(h) for h in lines[0:complete:4]), dtype=np.int32, count=complete // 4))
+                position += int(line_lengths.sum())
+
+        # A last record might be missing its final newline
+        if len(rest.splitlines()) == 4:
+            offsets.append(np.array([position], dtype=np.int64))
+            tiles.append(np.array([_parse_tile(rest.splitlines()[0])], dtype=np.int32))
+
+        return cls(
+            source,
+            np.concatenate(offsets) if len(offsets) > 0 else np.zeros(0, dtype=np.int64),
+            np.concatenate(tiles) if len(tiles) > 0 else np.zeros(0, dtype=np.int32),
+            np.array(access_points, dtype=np.int64),
+            position + len(rest),
+            compressed,
+        )
+
+    def save(self, filename: str = None):
+        """
+        Saves the index, by default as a sidecar file next to the fastq file.
+        :param filename:
+        :return:
+        """
+        stat = os.stat(self.source)
+        filename = filename or self.sidecar(self.source)
+        temporary = f"{filename}.{os.getpid()}.tmp"
+
+        # Runs on other shards of the same file might load the index at the same time, so it only appears once it
+        # is complete
+        with open(temporary, "wb") as fh:
+            np.savez(
+                fh,
+                version=self.VERSION,
+                size=stat.st_size,
+                mtime=stat.st_mtime_ns,
+                offsets=self.offsets,
+                tiles=self.tiles,
+                access_points=self.access_points,
+                end=self.end,
+                compressed=self.compressed,
+            )
+
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, source: str, filename: str = None) -> Optional["FastqIndex"]:
+        """
+        Loads the sidecar index of a fastq file. Returns None if there is no index or if it is outdated.
+        :param source:
+        :param filename:
+        :return:
+        """
+        filename = filename or cls.sidecar(source)
+
+        if not os.path.exists(filename):
+            return None
+
+        stat = os.stat(source)
+
+        with np.load(filename) as data:
+            if int(data["version"]) != cls.VERSION or int(data["size"]) != stat.st_size or int(data["mtime"]) != stat.st_mtime_ns:
+                return None
+
+            return cls(
+                source,
+                data["offsets"],
+                data["tiles"],
+                data["access_points"],
+                int(data["end"]),
+                bool(data["compressed"]),
+            )
+
+    @classmethod
+    def get(cls, source: str) -> "FastqIndex":
+        """
+        Returns the index of a fastq file, building and saving it if necessary.
+        :param source:
+        :return:
+        """
+        index = cls.load(source)
+
+        if index is None:
+            index = cls.build(source)
+
+            try:
+                index.save()
+            except OSError:
+                # The index still works, it just needs to get rebuilt next time.
+                pass
+
+        return index
+
+    def read_records(self, records: np.ndarray) -> Iterator[bytes]:
+        """
+        Reads the raw records with the given (sorted) numbers.
+        :param records:
+        :return:
+        """
+        ends = np.append(self.offsets[1:], self.end)
+
+        with open(self.source, "rb") as fh:
+            if self.compressed:
+                cursor = _GzipCursor(fh, self.access_points)
+                for record in records:
+                    yield cursor.read(self.offsets[record], ends[record])
+            else:
+                for record in records:
+                    fh.seek(self.offsets[record])
+                    yield fh.read(ends[record] - self.offsets[record])
+
+    def read_sequences(self, records: np.ndarray) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Reads the sequences and quality strings of the records with the given (sorted) numbers.
+        :param records:
+        :return:
+        """
+        for record in self.read_records(records):
+            lines = record.split(b"\n", 4)
+            yield lines[1].rstrip(b"\r"), lines[3].rstrip(b"\r")
+
+
+class _GzipCursor:
+    """
+    Reads ranges of uncompressed data from a gzip file, moving forward through the file and jumping to the nearest
+    access point if that is closer than the current position.
+    """
+    def __init__(self, fh, access_points: np.ndarray):
+        self.fh = fh
+        self.access_points = access_points
+        self.decompressor = None
+        self.position = None
+        self.buffer = b""
+
+    def _jump(self, k: int):
+        self.fh.seek(self.access_points[k, 0])
+        self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        self.position = int(self.access_points[k, 1])
+        self.buffer = b""
+
+    def _inflate(self) -> bool:
+        data = self.fh.read(_CHUNK_SIZE)
+
+        if not data:
+            return False
+
+        out = [self.buffer]
+        while len(data) > 0:
+            out.append(self.decompressor.decompress(data))
+
+            if not self.decompressor.eof:
+                break
+
+            data = self.decompressor.unused_data
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+        self.buffer = b"".join(out)
+        return True
+
+    def read(self, start: int, end: int) -> bytes:
+        k = int(np.searchsorted(self.access_points[:, 1], start, side="right")) - 1
+
+        if self.position is None or start < self.position or self.access_points[k, 1] > self.position + len(self.buffer):
+            self._jump(k)
+
+        while self.position + len(self.buffer) < end:
+            # Drop data before the requested range to keep the buffer small
+            drop = min(start - self.position, len(self.buffer))
+            if drop > 0:
+                self.buffer = self.buffer[drop:]
+                self.position += drop
+
+            if not self._inflate():
+                break
+
+        data = self.buffer[start - self.position:end - self.position]
+
+        self.buffer = self.buffer[end - self.position:]
+        self.position = end
+
+        return data
+
+
+def sample_records(tiles: np.ndarray, num_reads: int, mode: str = "random", seed: int = None) -> np.ndarray:
+    """
+    Draws a sorted subsample of record numbers without replacement.
+
+    In "head" mode, the first records are taken. In "random" mode, records get drawn uniformly. In "tile" mode, each
+    tile contributes reads proportional to its size, so that every region of the flow cell is represented.
+    :param tiles: Tile number of every record
+    :param num_reads:
+    :param mode: "head", "random" or "tile"
+    :param seed:
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    total = len(tiles)
+
+    if num_reads >= total:
+        return np.arange(total)
+
+    if mode == "head":
+        records = np.arange(num_reads)
+    elif mode == "random":
+        records = rng.choice(total, num_reads, replace=False)
+    elif mode == "tile":
+        tile_ids, tile_inverse, tile_counts = np.unique(tiles, return_inverse=True, return_counts=True)
+
+        # Largest remainder allocation of the reads to each tile
+        share = tile_counts * num_reads / total
+        allocation = np.floor(share).astype(int)
+        remainder = num_reads - allocation.sum()
+        allocation[np.argsort(allocation - share)[:remainder]] += 1
+
+        records = []
+        for t in range(len(tile_ids)):
+            members = np.flatnonzero(tile_inverse == t)
+            records.append(rng.choice(members, allocation[t], replace=False))
+        records = np.concatenate(records)
+    else:
+        raise ValueError(f"Unknown sampling mode {mode}.")
+
+    return np.sort(records)
+
+
+def shard_records(records: np.ndarray, shard: int, shards: int) -> np.ndarray:
+    """
+    Returns the shard-th of shards contiguous ranges of about the same size of the given record numbers. Runs on
+    every shard together read each record exactly once.
+    :param records:
+    :param shard: 0 to shards - 1
+    :param shards:
+    :return:
+    """
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} does not exist, it must be between 0 and {shards - 1}.")
+
+    return records[len(records) * shard // shards:len(records) * (shard + 1) // shards]
+
+
+def read_sampled_sequences(
+        fn1: str,
+        fn2: str,
+        num_reads: int,
+        mode: str = "random",
+        seed: int = None,
+        batch_size: int = 4096,
+        with_qualities: bool = False,
+        shard: Tuple[int, int] = None,
+        skip: int = 0,
+) -> Iterator[Tuple[Tuple[List[bytes], Optional[List[bytes]]], Tuple[List[bytes], Optional[List[bytes]]]]]:
+    """
+    Draws a subsample of read pairs using the offset indices of both files.
+
+    Yields a (sequences, qualities) tuple for each mate, with at most batch_size entries each. The qualities are None
+    unless with_qualities is set.
+    :param fn1:
+    :param fn2:
+    :param num_reads:
+    :param mode: "head", "random" or "tile"
+    :param seed:
+    :param batch_size:
+    :param with_qualities:
+    :param shard: (i, n) to only read the i-th of n contiguous ranges of the subsample (see shard_records)
+    :param skip: Amount of pairs of the (sharded) subsample to skip
+    :return:
+    """
+    index1 = FastqIndex.get(fn1)
+    index2 = FastqIndex.get(fn2)
+
+    total = min(len(index1), len(index2))
+    records = sample_records(index1.tiles[:total], num_reads, mode, seed)
+
+    if shard is not None:
+        records = shard_records(records, *shard)
+
+    records = records[skip:]
+
+    records1 = index1.read_sequences(records)
+    records2 = index2.read_sequences(records)
+
+    for start in range(0, len(records), batch_size):
+        count = min(batch_size, len(records) - start)
+
+        blocks = []
+        for mate in (records1, records2):
+            sequences, qualities = zip(*[next(mate) for _ in range(count)])
+            blocks.append((list(sequences), list(qualities) if with_qualities else None))
+
+        yield blocks[0], blocks[1]
@@ -0,0 +1,54 @@
+"""
+Interchangeable implementations (backends) of the inner loops of the analyzers.
+
+Every backend module provides the same kernels:
+- pair_consensus(mate1, mate2, consensus_length, prefer_mate) -> (consensus, pair_mismatches)
+- hamming(consensus, reference_codes, reference_mask, consensus_length) -> mismatches
+- banded_align(scores, query, query_length, band) -> operations of a batch of alignments
+- banded_align_single(scores, query, band) -> operations of a single alignment
+
+The first two are used by the batched simple analyzer on every chunk of the first stage, the alignments by the
+advanced analyzer.
+
+The numpy backend is always available. The numba backend compiles the kernels and is only available if numba is
+installed.
+"""
+from . import numpy_backend
+
+BACKENDS = ("numpy", "numba")
+
+_loaded = {"numpy": numpy_backend}
+
+
+def available(name: str) -> bool:
+    """
+    Checks if a backend can be used.
+    :param name:
+    :return:
+    """
+    return get_backend(name).NAME == name
+
+
+def get_backend(name: str = None):
+    """
+    Returns the backend module of the given name. Falls back to the numpy backend if the requested one is not
+    available.
+    :param name: Name of the backend, defaults to numpy.
+    :return:
+    """
+    if name is None:
+        name = "numpy"
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}.")
+
+    if name not in _loaded:
+        try:
+            if name == "numba":
+                from . import numba_backend as backend
+        except ImportError:
+            backend = numpy_backend
+
+        _loaded[name] = backend
+
+    return _loaded[name]
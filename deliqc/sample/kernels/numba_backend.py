@@ -0,0 +1,237 @@
+import numpy as np
+from numba import njit
+
+from deliqc.sample import banded
+from deliqc.sample.errors import WeirdReads
+
+NAME = "numba"
+
+_N = ord("N")
+_NEG = int(banded._NEG)
+_MATCH = banded.OP_MATCH
+_DELETION = banded.OP_DELETION
+_INSERTION = banded.OP_INSERTION
+_NONE = banded.OP_NONE
+_GAP_OPEN = banded.GAP_OPEN
+_GAP_EXTEND = banded.GAP_EXTEND
+
+
+@njit(cache=True)
+def _pair_consensus(mate1, mate2, consensus_length, prefer_mate, consensus, pair_mismatches):
+    n, L = mate1.shape
+
+    for r in range(n):
+        count = 0
+
+        for p in range(L):
+            if p >= consensus_length[r]:
+                consensus[r, p] = _N
+            elif mate1[r, p] != mate2[r, p]:
+                count += 1
+                consensus[r, p] = mate2[r, p] if prefer_mate else mate1[r, p]
+            else:
+                consensus[r, p] = mate1[r, p]
+
+        pair_mismatches[r] = count
+
+
+@njit(cache=True)
+def _hamming(consensus, reference_codes, reference_mask, consensus_length, mismatches):
+    n, L = consensus.shape
+
+    for r in range(n):
+        for p in range(min(L, consensus_length[r])):
+            mismatches[r, p] = reference_mask[p] and consensus[r, p] != reference_codes[p]
+
+
+@njit(cache=True)
+def _banded_align_single(scores, query, query_length, band, ops):
+    """
+    Scalar banded alignment, identical to banded.banded_align_single. Returns the amount of operations, or -1 if the
+    alignment cannot reach the end of the target within the band.
+    """
+    L = scores.shape[0]
+    Q = query_length
+    B = 2 * band + 1
+
+    pointers_m = np.zeros((L + 1, B), dtype=np.uint8)
+    pointers_x = np.zeros((L + 1, B), dtype=np.uint8)
+    pointers_y = np.zeros((L + 1, B), dtype=np.uint8)
+
+    # Scores of matches and insertions ending at the end of the query in the rows from first_end on
+    first_end = max(L - band, 0)
+    end_m = np.full(L - first_end, _NEG, dtype=np.int64)
+    end_y = np.full(L - first_end, _NEG, dtype=np.int64)
+
+    M_prev = np.full(B, _NEG, dtype=np.int64)
+    X_prev = np.full(B, _NEG, dtype=np.int64)
+    Y_prev = np.full(B, _NEG, dtype=np.int64)
+    M = np.full(B, _NEG, dtype=np.int64)
+    X = np.full(B, _NEG, dtype=np.int64)
+    Y = np.full(B, _NEG, dtype=np.int64)
+
+    for i in range(L + 1):
+        M[:] = _NEG
+        X[:] = _NEG
+        Y[:] = _NEG
+
+        lo = max(0, band - i)
+        hi = min(B, Q - i + band + 1)
+
+        for k in range(lo, hi):
+            j = i + k - band
+
+            if i == 0:
+                if j == 0:
+                    M[k] = 0
+            else:
+                if j >= 1:
+                    best = Y_prev[k]
+                    state = _INSERTION
+                    if M_prev[k] > best:
+                        best = M_prev[k]
+                        state = _MATCH
+                    if X_prev[k] > best:
+                        best = X_prev[k]
+                        state = _DELETION
+                    M[k] = best + scores[i - 1, query[j - 1]]
+                    pointers_m[i, k] = state
+
+                if k + 1 < B:
+                    best = X_prev[k + 1] + _GAP_EXTEND
+                    state = _DELETION
+                    if M_prev[k + 1] + _GAP_OPEN > best:
+                        best = M_prev[k + 1] + _GAP_OPEN
+                        state = _MATCH
+                    if Y_prev[k + 1] + _GAP_OPEN > best:
+                        best = Y_prev[k + 1] + _GAP_OPEN
+                        state = _INSERTION
+                    X[k] = best
+                    pointers_x[i, k] = state
+
+            if j >= 1 and k >= 1:
+                best = Y[k - 1] + _GAP_EXTEND
+                state = _INSERTION
+                if M[k - 1] + _GAP_OPEN > best:
+                    best = M[k - 1] + _GAP_OPEN
+                    state = _MATCH
+                if X[k - 1] + _GAP_OPEN > best:
+                    best = X[k - 1] + _GAP_OPEN
+                    state = _DELETION
+                Y[k] = best
+                pointers_y[i, k] = state
+
+        end_k = Q - i + band
+        if first_end <= i < L and 0 <= end_k < B and Q >= first_end:
+            end_m[i - first_end] = M[end_k]
+            end_y[i - first_end] = Y[end_k]
+
+        M_prev[:] = M
+        X_prev[:] = X
+        Y_prev[:] = Y
+
+    best = _NEG - 1
+    state = _MATCH
+    k = band
+    for c in range(B):
+        if M_prev[c] > best:
+            best = M_prev[c]
+            state = _MATCH
+            k = c
+    for c in range(B):
+        if X_prev[c] > best:
+            best = X_prev[c]
+            state = _DELETION
+            k = c
+    for c in range(B):
+        if Y_prev[c] > best:
+            best = Y_prev[c]
+            state = _INSERTION
+            k = c
+
+    i = L
+    for end in range(L - 1, first_end - 1, -1):
+        if end_m[end - first_end] > best:
+            best = end_m[end - first_end]
+            state = _MATCH
+            k = Q - end + band
+            i = end
+        if end_y[end - first_end] > best:
+            best = end_y[end - first_end]
+            state = _INSERTION
+            k = Q - end + band
+            i = end
+
+    if best <= _NEG // 2:
+        return -1
+
+    # Trace back, collecting the operations backwards
+    count = 0
+    while not (i == 0 and k == band):
+        if i < 0 or k < 0 or k >= B or count >= len(ops):
+            return -1
+
+        ops[count] = state
+        count += 1
+
+        if state == _MATCH:
+            state = pointers_m[i, k]
+            i -= 1
+        elif state == _DELETION:
+            state = pointers_x[i, k]
+            i -= 1
+            k += 1
+        else:
+            state = pointers_y[i, k]
+            k -= 1
+
+    ops[:count] = ops[:count][::-1].copy()
+
+    return count
+
+
+@njit(cache=True)
+def _banded_align(scores, query, query_length, band, ops):
+    for r in range(query.shape[0]):
+        if _banded_align_single(scores, query[r], query_length[r], band, ops[r]) < 0:
+            ops[r, :] = _NONE
+
+
+def pair_consensus(mate1: np.ndarray, mate2: np.ndarray, consensus_length: np.ndarray, prefer_mate: bool):
+    consensus = np.empty(mate1.shape, dtype=np.uint8)
+    pair_mismatches = np.zeros(len(mate1), dtype=np.int32)
+
+    _pair_consensus(mate1, mate2, consensus_length.astype(np.int64), prefer_mate, consensus, pair_mismatches)
+
+    return consensus, pair_mismatches
+
+
+def hamming(consensus: np.ndarray, reference_codes: np.ndarray, reference_mask: np.ndarray, consensus_length: np.ndarray) -> np.ndarray:
+    mismatches = np.zeros(consensus.shape, dtype=np.bool_)
+
+    _hamming(consensus, reference_codes, reference_mask, consensus_length.astype(np.int64), mismatches)
+
+    return mismatches
+
+
+def banded_align(scores: np.ndarray, query: np.ndarray, query_length: np.ndarray, band: int = banded.BAND) -> np.ndarray:
+    if scores.ndim != 2:
+        # Profiles per query are only supported by the numpy implementation
+        return banded.banded_align(scores, query, query_length, band)
+
+    ops = np.full((len(query), scores.shape[0] + query.shape[1] + 1), _NONE, dtype=np.uint8)
+
+    _banded_align(scores, np.ascontiguousarray(query, dtype=np.int64), query_length.astype(np.int64), band, ops)
+
+    return ops
+
+
+def banded_align_single(scores: np.ndarray, query: np.ndarray, band: int = banded.BAND) -> np.ndarray:
+    ops = np.full(scores.shape[0] + len(query) + 1, _NONE, dtype=np.uint8)
+
+    count = _banded_align_single(scores, query.astype(np.int64), len(query), band, ops)
+
+    if count < 0:
+        raise WeirdReads
+
+    return ops[:count]
@@ -0,0 +1,39 @@
+import numpy as np
+
+from deliqc.sample import banded
+
+NAME = "numpy"
+
+
+def pair_consensus(mate1: np.ndarray, mate2: np.ndarray, consensus_length: np.ndarray, prefer_mate: bool):
+    """
+    Builds the consensus of two (n, L) mate matrices. Where they differ, mate1 is used unless prefer_mate is set.
+    Positions beyond consensus_length are set to N and not compared.
+    :return: consensus, amount of mismatches between both mates
+    """
+    within = np.arange(mate1.shape[1])[np.newaxis, :] < consensus_length[:, np.newaxis]
+
+    pair_mismatches = ((mate1 != mate2) & within).sum(axis=1).astype(np.int32)
+
+    consensus = np.array(mate2 if prefer_mate else mate1)
+    consensus[~within] = ord("N")
+
+    return consensus, pair_mismatches
+
+
+def hamming(consensus: np.ndarray, reference_codes: np.ndarray, reference_mask: np.ndarray, consensus_length: np.ndarray) -> np.ndarray:
+    """
+    Returns the (n, L) positions at which the consensus differs from the reference, ignoring positions where
+    reference_mask is False and positions beyond consensus_length.
+    """
+    within = np.arange(consensus.shape[1])[np.newaxis, :] < consensus_length[:, np.newaxis]
+
+    return (consensus != reference_codes[np.newaxis, :]) & reference_mask[np.newaxis, :] & within
+
+
+def banded_align(scores: np.ndarray, query: np.ndarray, query_length: np.ndarray, band: int = banded.BAND) -> np.ndarray:
+    return banded.banded_align(scores, query, query_length, band)
+
+
+def banded_align_single(scores: np.ndarray, query: np.ndarray, band: int = banded.BAND) -> np.ndarray:
+    return np.array(banded.banded_align_single(scores.tolist(), query.tolist(), band), dtype=np.uint8)
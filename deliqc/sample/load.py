@@ -1,50 +1,170 @@
 from collections import defaultdict
-import numpy as np
-from typing import List
+from typing import List, Optional, Tuple, Union
 from multiprocessing import Pool
+import copy
+import numpy as np
+import os
+import pickle
+
+from .worker import install_worker_data, WorkerData
+from .eventlog import EventLogWriter
+from .metrics import RunMetrics
+from .stages import run_stages, Boundary, ALIGN_BATCHES, ALIGN_SHARE
+from .reader import read_batches, read_pair_blocks
+from .quality import QualityFilter
+from .dedup import PairCollapser
+from .counts import normalise_events
+from .errors import IncompatibleCheckpoint
+
+# Seconds between two checkpoints
+CHECKPOINT_INTERVAL = 300
+CHECKPOINT_VERSION = 4
+
+
+def _read_pairs(fn1, fn2, num_reads, reader_threads=1, sampling="head", seed=None, quality_filter=None, shard=None, skip=0):
+    """
+    Yields the blocks of read pairs of a sample as (offset, pairs). Matrices of the reads are only built if they are
+    needed for quality filtering, otherwise the raw sequences are passed on as they are.
+    """
+    if quality_filter is not None and quality_filter.active:
+        for batch in read_batches(fn1, fn2, num_reads, threads=reader_threads, sampling=sampling, seed=seed, with_qualities=True, shard=shard, skip=skip):
+            # Pairs that are filtered out still count towards the records read
+            yield batch.offset, len(batch), quality_filter.apply(batch).pairs()
+    else:
+        for offset, s1, s2, _, _ in read_pair_blocks(fn1, fn2, num_reads, threads=reader_threads, sampling=sampling, seed=seed, shard=shard, skip=skip):
+            yield offset, len(s1), zip(s1, s2)
+
+
+def file_reader(fn1, fn2, num_reads, reader_threads=1, sampling="head", seed=None, quality_filter=None, collapser=None, shard=None, skip=0):
+    for offset, n, pairs in _read_pairs(fn1, fn2, num_reads, reader_threads, sampling, seed, quality_filter, shard, skip):
+        for i, (r1, r2) in enumerate(pairs, start=offset):
+            if collapser is None:
+                yield i, (r1, r2), 1
+            else:
+                for j, pair, count in collapser.add(i, (r1, r2)):
+                    yield j, pair, count
+
+        # All records up to here have been passed on, which allows a checkpoint
+        yield Boundary(offset + n)
+
+    if collapser is not None:
+        for j, pair, count in collapser.flush():
+            yield j, pair, count
 
-from .worker import worker, WorkerData
-from .reader import read_lines
-from .result import AlignedReadResult, FailedReadResult
 
+def chunk_reader(reads, chunk_size):
+    """
+    Groups the read pairs of file_reader into chunks of chunk_size for the first stage (see stages.run_stages).
+    Chunks end at every Boundary, which is passed on after them.
+    :param reads:
+    :param chunk_size:
+    :return:
+    """
+    chunk = []
 
-def file_reader(fn1, fn2, num_reads, metadata):
-    read = 0
-    for i, (r1, r2) in enumerate(zip(read_lines(fn1, num_reads), read_lines(fn2, num_reads))):
-        if read >= num_reads:
-            break
+    for read in reads:
+        if isinstance(read, Boundary):
+            if len(chunk) > 0:
+                yield chunk
+                chunk = []
 
-        yield i, (r1, r2), metadata
+            yield read
+            continue
 
-        read += 1
+        chunk.append(read)
 
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
 
-def load_sample(
+    if len(chunk) > 0:
+        yield chunk
+
+
+def load_sample(reference: str, fn1: str, fn2: str, **kwargs):
+    """
+    Loads a single sample. See load_samples for the options.
+    :param reference:
+    :param fn1:
+    :param fn2:
+    :param kwargs:
+    :return:
+    """
+    return load_samples(reference, [(fn1, fn2)], **kwargs)[0]
+
+
+def load_samples(
         reference: str,
-        fn1: str,
-        fn2: str,
+        files: List[Tuple[str, str]],
         max_reads: int = 2000,
         max_pair_mismatches: int = 0,
         max_point_mutations: int = 5,
-        split_on_codon: int = 0,
+        split_on_codon: Union[int, List[int]] = 0,
         codons: List[str] = [],
         threads: int = 8,
         batches: int = 100,
-):
+        align_batches: int = ALIGN_BATCHES,
+        align_share: float = ALIGN_SHARE,
+        reader_threads: int = 1,
+        sampling: str = "head",
+        seed: int = None,
+        min_mean_quality: float = None,
+        max_low_quality_bases: int = None,
+        low_quality_threshold: int = 20,
+        trim_quality: int = None,
+        max_unique_pairs: int = 100_000,
+        backend: str = "numpy",
+        combine_codons: bool = False,
+        count_members: bool = True,
+        member_sketch_width: int = 0,
+        member_sketch_depth: int = 4,
+        max_members: int = 100_000,
+        filter_off_target: bool = True,
+        adapters: List[str] = None,
+        shard: Tuple[int, int] = None,
+        raw: bool = False,
+        checkpoint: str = None,
+        checkpoint_interval: float = CHECKPOINT_INTERVAL,
+        resume: bool = False,
+        metrics: RunMetrics = None,
+        event_log: str = None,
+        options: dict = None,
+) -> List[dict]:
+    """
+    Loads several samples (such as replicates) given as (fn1, fn2) pairs of read files, with the same options. All of
+    them are analysed at the same time on one pool of threads workers, and one result is returned per sample.
+
+    With shard set to (i, n), only the i-th of n parts of the selected pairs of each sample is analysed. Raw results
+    of all parts can be added up with merge_raw_results and then normalised with normalise_result. Raw results
+    contain the integer event counters instead of their normalised values.
+
+    If checkpoint is given, the counts of all samples are saved to this file every checkpoint_interval seconds,
+    together with the amount of records counted. With resume set, a run with the same options continues from
+    there instead of starting over. The stages then only cover the continued part.
+
+    If metrics is given, it collects the throughput of each stage and worker, queue depths and failures of the whole
+    run (see metrics.RunMetrics).
+
+    If event_log is given, the records of every analysed pair (its events, codons, pair mismatches or failure reason)
+    are streamed to this file while the samples are analysed (see eventlog.EventLog to read it). Checkpoints include
+    the size of the event log, which is cut back to it when resuming.
+
+    If options is given, it is filled with everything that decides which records are analysed and how they are
+    counted, as compared when resuming from a checkpoint. Shards of a run can only be merged if these are the same.
+    """
+    if len(files) == 0:
+        return []
+
     read_length = len(reference)
-    # Array to keep track of mismatch count
-    total_mismatches = np.zeros((read_length, 1 + len(codons)))
-    # Array to keep track of insertions (0) and deletions (1)
-    total_indels = np.zeros((read_length, 2, 1 + len(codons)))
-    # Array to keep track of the target of a point mutation
-    mutation_targets = np.zeros((read_length, 5, 1 + len(codons)))
-    # Array to keep track of the inserted base
-    insertion_targets = np.zeros((read_length, 5, 1 + len(codons)))
-
-    codon_counts = defaultdict(int)
-    count_mismatched_pairs = 0
-    count_too_many_point_mutations = 0
-    count_aligned_reads = 0
+
+    # A single codon position (0 for none) only splits the profiles on the given codons. A list of positions
+    # additionally splits on all codons found at each of them, or on their combination if combine_codons is set. The
+    # profiles of the given codons use the first position.
+    if isinstance(split_on_codon, int):
+        split_positions = []
+    else:
+        split_positions = list(split_on_codon)
+        split_on_codon = split_positions[0] if len(split_positions) > 0 else 0
 
     worker_data = WorkerData(
         reference=reference,
@@ -53,72 +173,299 @@ def load_sample(
         max_point_mutations=max_point_mutations,
         split_on_codon=split_on_codon,
         codons=codons,
+        backend=backend,
+        split_positions=split_positions,
+        combine_codons=combine_codons,
+        count_members=count_members,
+        filter_off_target=filter_off_target,
+        adapters=adapters,
+        log_events=event_log is not None,
     )
 
-    reads_worked = 0
-    with Pool(threads) as pool:
-        # Prepare the file reader to seed workers
-        r = file_reader(fn1, fn2, max_reads, worker_data)
-
-        for result in pool.imap_unordered(worker, r, batches):
-            reads_worked += 1
-
-            # Check what kind of result we got
-
-            if isinstance(result, AlignedReadResult):
-                # Successfully aligned result
-                count_aligned_reads += 1
-
-                # Get codon index
-                if result.codon in codons:
-                    codon_index = codons.index(result.codon) + 1
-                    codon_counts[result.codon] += 1
-                else:
-                    codon_index = 0
-
-                # Count up
-                total_mismatches[:, 0] += result.mismatches
-                mutation_targets[:, :, 0] += result.mutationTarget
-                total_indels[:, :, 0] += result.indels
-                insertion_targets[:, :, 0] += result.insertionTarget
-
-                # Count codon specific result
-                if codon_index > 0:
-                    total_mismatches[:, codon_index] += result.mismatches
-                    mutation_targets[:, :, codon_index] += result.mutationTarget
-                    total_indels[:, :, codon_index] += result.indels
-                    insertion_targets[:, :, codon_index] += result.insertionTarget
-            elif isinstance(result, FailedReadResult):
-                # Failed result
-                if result.reason == FailedReadResult.tooManyMismatchesBetweenPair:
-                    count_mismatched_pairs += 1
-                elif result.reason == FailedReadResult.tooManyMismatchesToReference:
-                    count_too_many_point_mutations += 1
-
-    # Normalise all
-    total_mismatches[:, 0] /= count_aligned_reads
-    mutation_targets[:, :, 0] /= count_aligned_reads
-    total_indels[:, :, 0] /= count_aligned_reads
-    insertion_targets[:, :, 0] /= count_aligned_reads
-
-    # And normalise for each codon
-    for i in range(len(codons)):
-        codon = codons[i]
-
-        total_mismatches[:, i+1] /= codon_counts[codon]
-        mutation_targets[:, :, i+1] /= codon_counts[codon]
-        total_indels[:, :, i+1] /= codon_counts[codon]
-        insertion_targets[:, :, i+1] /= codon_counts[codon]
+    # Everything that changes the counts has to be the same to continue from a checkpoint
+    key = {
+        "reference": reference,
+        "files": [tuple(pair) for pair in files],
+        "maxReads": max_reads,
+        "maxPairMismatches": max_pair_mismatches,
+        "maxPointMutations": max_point_mutations,
+        "splitOnCodon": split_positions or split_on_codon,
+        "codons": list(codons),
+        "sampling": sampling,
+        "seed": seed,
+        "quality": (min_mean_quality, max_low_quality_bases, low_quality_threshold, trim_quality),
+        "maxUniquePairs": max_unique_pairs,
+        "combineCodons": combine_codons,
+        "members": (count_members, member_sketch_width, member_sketch_depth, max_members),
+        "filterOffTarget": filter_off_target,
+        "adapters": worker_data.reference.adapters,
+        "shard": shard,
+        "eventLog": event_log,
+    }
+
+    if options is not None:
+        options.update(key)
+
+    state = load_checkpoint(checkpoint, key) if resume and checkpoint is not None else None
+    samples = state["samples"] if state is not None else None
+
+    quality_filters = []
+    collapsers = []
+    counts = []
+    chunks = []
+
+    for i, (fn1, fn2) in enumerate(files):
+        if samples is not None:
+            saved = samples[i]
+            quality_filters.append(saved["qualityFilter"])
+            collapsers.append(saved["collapser"])
+            counts.append(saved["counts"])
+
+            # Samples that were read completely are done
+            if saved["records"] is None:
+                chunks.append([])
+            else:
+                r = file_reader(fn1, fn2, max_reads, reader_threads, sampling, seed, saved["qualityFilter"], saved["collapser"], shard, saved["records"])
+                chunks.append(chunk_reader(r, batches))
+
+            continue
+
+        quality_filter = QualityFilter(
+            region=read_length,
+            min_mean_quality=min_mean_quality,
+            max_low_quality_bases=max_low_quality_bases,
+            low_quality_threshold=low_quality_threshold,
+            trim_quality=trim_quality,
+        )
+
+        # Identical pairs get analysed only once. 0 disables collapsing.
+        collapser = PairCollapser(max_unique_pairs) if max_unique_pairs > 0 else None
+
+        # Counters of mismatches, their target, insertions (0) and deletions (1) and the inserted base, in total
+        # (column 0) and for each codon, together with the amount of reads per outcome. Library members get counted
+        # exactly within each chunk and, if member_sketch_width is given, approximately here.
+        sample_counts = worker_data.new_counts(
+            sketch_width=member_sketch_width,
+            sketch_depth=member_sketch_depth,
+            max_members=max_members,
+        )
+
+        # Prepare the file reader to seed workers with chunks of batches reads
+        r = file_reader(fn1, fn2, max_reads, reader_threads, sampling, seed, quality_filter, collapser, shard)
+
+        quality_filters.append(quality_filter)
+        collapsers.append(collapser)
+        counts.append(sample_counts)
+        chunks.append(chunk_reader(r, batches))
+
+    log_writer = None
+    if event_log is not None:
+        resume_at = state["eventLog"] if state is not None else None
+
+        if resume_at is not None and (not os.path.exists(event_log) or os.path.getsize(event_log) < resume_at):
+            raise IncompatibleCheckpoint(f"Event log {event_log} is shorter than when checkpoint {checkpoint} was saved.")
+
+        log_writer = EventLogWriter(event_log, reference, worker_data.reference.coordinates, files, resume_at)
+
+    def save_checkpoint(positions):
+        log_size = log_writer.flush() if log_writer is not None else None
+        _save_checkpoint(checkpoint, key, positions, counts, quality_filters, collapsers, log_size)
+
+    # The worker data (including the compiled reference) is installed once in every worker
+    try:
+        with Pool(threads, initializer=install_worker_data, initargs=(worker_data,)) as pool:
+            # Chunks of batches pairs are analysed without alignment first, and the pairs that need one are aligned in
+            # batches of align_batches. Workers return one partial sum per task, which only need to get merged.
+            stages = run_stages(
+                pool, chunks, counts, threads, align_batches, align_share,
+                checkpoint=save_checkpoint if checkpoint is not None else None,
+                checkpoint_interval=checkpoint_interval,
+                metrics=metrics,
+                event_log=log_writer,
+            )
+    finally:
+        if log_writer is not None:
+            log_writer.close()
+
+    if metrics is not None:
+        metrics.finish(counts, sum(quality_filter.rejected for quality_filter in quality_filters))
+
+    results = [_raw_result(*sample) for sample in zip(counts, quality_filters, collapsers, stages)]
+
+    if raw:
+        return results
+
+    return [normalise_result(result, codons) for result in results]
+
+
+def _save_checkpoint(filename, key, positions, counts, quality_filters, collapsers, event_log_size=None):
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "key": key,
+        "eventLog": event_log_size,
+        "samples": [
+            {"records": records, "counts": sample_counts, "qualityFilter": quality_filter, "collapser": collapser}
+            for records, sample_counts, quality_filter, collapser in zip(positions, counts, quality_filters, collapsers)
+        ],
+    }
+
+    # A checkpoint is only replaced once the new one is complete
+    temporary = f"{filename}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as fh:
+        pickle.dump(state, fh)
+
+    os.replace(temporary, filename)
+
+
+def load_checkpoint(filename: str, key: dict) -> Optional[dict]:
+    """
+    Returns the saved state of a checkpoint, or None if there is none. Raises IncompatibleCheckpoint if the
+    checkpoint was saved by another version or a run with other options (key).
+    :param filename:
+    :param key:
+    :return: samples, with records (None if all were counted), counts, qualityFilter and collapser of each sample,
+        and the size of the event log (eventLog, None if there is none)
+    """
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, "rb") as fh:
+        state = pickle.load(fh)
+
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise IncompatibleCheckpoint(f"Checkpoint {filename} was saved by another version.")
+
+    if state["key"] != key:
+        different = sorted(k for k in key if state["key"].get(k) != key[k])
+        raise IncompatibleCheckpoint(f"Checkpoint {filename} was saved with other options ({', '.join(different)}).")
+
+    return state
+
+
+# Keys of the raw results holding the integer event counters, which get normalised by the amount of aligned reads
+EVENT_KEYS = ("mismatches", "mutationTarget", "indels", "insertionTarget")
+
+
+def _raw_result(counts, quality_filter, collapser, stages):
+    counts.events.flush()
 
     return {
-        "reads": reads_worked,
-        "mismatchedPairs": count_mismatched_pairs,
-        "tooManyPointMutations": count_too_many_point_mutations,
-        "mismatches": total_mismatches,
-        "indels": total_indels,
-        "alignedReads": count_aligned_reads,
-        "alignedReadsPerCodon": codon_counts,
-        "mutationTarget": mutation_targets,
-        "insertionTarget": insertion_targets,
+        "reads": counts.reads + quality_filter.rejected,
+        "lowQualityPairs": quality_filter.rejected,
+        "uniquePairs": collapser.unique if collapser is not None else counts.reads,
+        "mismatchedPairs": counts.mismatchedPairs,
+        "tooManyPointMutations": counts.tooManyPointMutations,
+        "offTargetPairs": counts.offTargetPairs,
+        "unmergedPairs": counts.unmergedPairs,
+        "mismatches": counts.events.mismatches,
+        "indels": counts.events.indels,
+        "alignedReads": counts.alignedReads,
+        "alignedReadsPerCodon": dict(counts.alignedReadsPerCodon),
+        "resolvedBy": dict(counts.resolvedBy),
+        "stages": {stage: stats.to_dict() for stage, stats in stages.items()},
+        "mutationTarget": counts.events.mutationTarget,
+        "insertionTarget": counts.events.insertionTarget,
+        "splits": counts.splits.to_dict(),
+        "unassignedSplitReads": counts.splits.unassigned,
+        "libraryMembers": counts.members.to_dict(),
+        "libraryMembersApproximate": counts.members.approximate,
+        "unassignedMemberReads": counts.members.unassigned,
+    }
+
+
+def normalise_result(raw: dict, codons: List[str]) -> dict:
+    """
+    Converts a raw result (see load_samples) into a normalised one, where the event counters are divided by the
+    amount of aligned reads, in total and for each codon.
+    :param raw:
+    :param codons: The codons the results were split on
+    :return:
+    """
+    result = dict(raw)
+    codon_counts = defaultdict(int, raw["alignedReadsPerCodon"])
+
+    # Normalise all, and each codon by its own amount of reads
+    totals = [raw["alignedReads"]] + [codon_counts[codon] for codon in codons]
+    normalised = normalise_events([raw[key] for key in EVENT_KEYS], totals)
+
+    result.update(zip(EVENT_KEYS, normalised))
+    result["alignedReadsPerCodon"] = codon_counts
+
+    return result
+
+
+def merge_raw_results(results: List[dict]) -> dict:
+    """
+    Adds up raw results of the same sample, such as the ones of several shards. Pairs found in several parts are
+    counted as unique in each of them.
+    :param results:
+    :return:
+    """
+    merged = copy.deepcopy(results[0])
+
+    for result in results[1:]:
+        for key, value in result.items():
+            if key in EVENT_KEYS:
+                merged[key] = merged[key] + value
+            elif key in ("alignedReadsPerCodon", "resolvedBy", "libraryMembers"):
+                for k, count in value.items():
+                    merged[key][k] = merged[key].get(k, 0) + count
+            elif key == "splits":
+                for k, (reads, events) in value.items():
+                    merged_reads, merged_events = merged[key].get(k, (0, {}))
+                    merged_events = dict(merged_events)
+                    for event, count in events.items():
+                        merged_events[event] = merged_events.get(event, 0) + count
+                    merged[key][k] = (merged_reads + reads, merged_events)
+            elif key == "stages":
+                for stage, stats in value.items():
+                    merged_stats = merged[key].setdefault(stage, dict.fromkeys(stats, 0))
+                    for k, v in stats.items():
+                        # Parts run at the same time
+                        merged_stats[k] = max(merged_stats[k], v) if k == "wallSeconds" else merged_stats[k] + v
+            elif key == "libraryMembersApproximate":
+                merged[key] = merged[key] or value
+            else:
+                merged[key] += value
+
+    return merged
+
+
+# Counters averaged over the replicates of a sample
+AVERAGED_KEYS = ("reads", "lowQualityPairs", "mismatchedPairs", "offTargetPairs", "tooManyPointMutations", "unmergedPairs", "alignedReads")
+
+
+def average_results(title: str, reference: str, split_on_codon, codons: List[str], results: List[dict]) -> dict:
+    """
+    Builds a sample from the normalised results of its replicates, with the mean and standard deviation of each event
+    array and the mean of each counter.
+    :param title:
+    :param reference:
+    :param split_on_codon:
+    :param codons:
+    :param results:
+    :return:
+    """
+    sample = {
+        "title": title,
+        "reference": reference,
+        "splitOnCodon": split_on_codon,
+        "splitOnCodonSequences": codons,
+        "replicates": results,
     }
 
+    for key in EVENT_KEYS:
+        values = [r[key] for r in results]
+        sample[key] = (np.mean(values, axis=0), np.std(values, axis=0))
+
+    for key in AVERAGED_KEYS:
+        # Results saved by older versions do not have all counters
+        if all(key in r for r in results):
+            sample[key] = np.mean([r[key] for r in results])
+
+    aligned_reads_per_codon = {}
+    for k in results[0]["alignedReadsPerCodon"].keys():
+        aligned_reads_per_codon[k] = np.mean([r["alignedReadsPerCodon"][k] for r in results])
+    sample["alignedReadsPerCodon"] = aligned_reads_per_codon
+
+    return sample
@@ -0,0 +1,165 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Dict, Sequence
+import json
+
+from .counts import SampleCounts
+
+# Failure tallies of SampleCounts
+FAILURES = ("mismatchedPairs", "tooManyPointMutations", "offTargetPairs", "unmergedPairs")
+
+
+def _rate(pairs: int, seconds: float) -> float:
+    return pairs / seconds if seconds > 0 else 0.0
+
+
+class RunMetrics:
+    """
+    Throughput of a run (see stages.run_stages), per stage and per worker process:
+
+    - reading: pairs taken from the readers, and the time the parent spent reading them
+    - simple and advanced: pairs and tasks of each stage, and the time the workers spent on them
+    - aggregation: partial counts merged by the parent, and the time it took
+    - queue: pairs waiting for an alignment and tasks running per stage, currently and at most (only the maxima are
+      saved)
+    - workers: tasks, pairs and busy time of each worker process (by process id)
+    - failures: failed pairs by reason, together with the pairs whose mates could not be merged
+
+    Rates are pairs per second of the time spent on them; for the stages, this is per worker. If interval is given,
+    a progress line is printed at least interval seconds apart.
+    """
+    def __init__(self, interval: float = None):
+        self.interval = interval
+        self.start = perf_counter()
+        self.lastReport = self.start
+        self.end = None
+
+        self.reading = {"pairs": 0, "seconds": 0.0}
+        self.stages = {stage: {"pairs": 0, "tasks": 0, "busySeconds": 0.0} for stage in ("simple", "advanced")}
+        self.aggregation = {"tasks": 0, "seconds": 0.0}
+        self.queue = {
+            "waitingPairs": 0,
+            "maxWaitingPairs": 0,
+            "running": {stage: 0 for stage in self.stages},
+            "maxRunning": {stage: 0 for stage in self.stages},
+        }
+        self.workers = defaultdict(lambda: {"tasks": 0, "pairs": 0, "busySeconds": 0.0})
+        self.failures = dict.fromkeys(FAILURES, 0)
+        self.reads = 0
+        self.alignedReads = 0
+
+    def read(self, pairs: int, seconds: float):
+        self.reading["pairs"] += pairs
+        self.reading["seconds"] += seconds
+
+    def finished(self, stage: str, worker: int, pairs: int, busy: float):
+        for stats in (self.stages[stage], self.workers[worker]):
+            stats["pairs"] += pairs
+            stats["tasks"] += 1
+            stats["busySeconds"] += busy
+
+    def merged(self, seconds: float):
+        self.aggregation["tasks"] += 1
+        self.aggregation["seconds"] += seconds
+
+    def queued(self, waiting: int, running: Dict[str, int]):
+        self.queue["waitingPairs"] = waiting
+        self.queue["maxWaitingPairs"] = max(self.queue["maxWaitingPairs"], waiting)
+
+        for stage, tasks in running.items():
+            self.queue["running"][stage] = tasks
+            self.queue["maxRunning"][stage] = max(self.queue["maxRunning"][stage], tasks)
+
+    def count(self, counts: Sequence[SampleCounts]):
+        """
+        Takes the amount of reads, aligned reads and failures from the counts of all samples.
+        :param counts:
+        :return:
+        """
+        self.reads = sum(c.reads for c in counts)
+        self.alignedReads = sum(c.alignedReads for c in counts)
+
+        for key in FAILURES:
+            self.failures[key] = sum(getattr(c, key) for c in counts)
+
+    @property
+    def advancedShare(self) -> float:
+        """
+        Share of the pairs analysed by the first stage that needed an alignment.
+        """
+        pairs = self.stages["simple"]["pairs"]
+        return self.stages["advanced"]["pairs"] / pairs if pairs > 0 else 0.0
+
+    def report(self, counts: Sequence[SampleCounts], force: bool = False):
+        """
+        Prints a progress line if interval seconds have passed since the last one.
+        :param counts: Counts of all samples
+        :param force: Print even if the interval has not passed yet
+        :return:
+        """
+        now = perf_counter()
+
+        if self.interval is None or (not force and now - self.lastReport < self.interval):
+            return
+
+        self.lastReport = now
+        self.count(counts)
+
+        elapsed = now - self.start
+        simple = self.stages["simple"]
+        advanced = self.stages["advanced"]
+
+        print(
+            f"    [{elapsed:.0f} s] {self.reads} reads ({_rate(self.reads, elapsed):.0f}/s), "
+            f"{self.alignedReads} aligned, "
+            f"simple {_rate(simple['pairs'], simple['busySeconds']):.0f}/s, "
+            f"advanced {_rate(advanced['pairs'], advanced['busySeconds']):.0f}/s ({self.advancedShare * 100:.1f}%), "
+            f"waiting {self.queue['waitingPairs']}, "
+            f"running {self.queue['running']['simple']}/{self.queue['running']['advanced']}, "
+            f"failed {sum(self.failures.values()) - self.failures['unmergedPairs']}",
+            flush=True,
+        )
+
+    def finish(self, counts: Sequence[SampleCounts], low_quality_pairs: int = 0):
+        """
+        Records the final counts at the end of the run.
+        :param counts: Counts of all samples
+        :param low_quality_pairs: Pairs rejected by the quality filters, which never reach the counts
+        :return:
+        """
+        self.end = perf_counter()
+        self.count(counts)
+        self.failures["lowQualityPairs"] = low_quality_pairs
+
+    def to_dict(self) -> dict:
+        """
+        Returns all metrics as dictionary of plain types.
+        :return:
+        """
+        elapsed = (self.end or perf_counter()) - self.start
+
+        def with_rate(stats, seconds_key):
+            return dict(stats, pairsPerSecond=_rate(stats["pairs"], stats[seconds_key]))
+
+        return {
+            "seconds": elapsed,
+            "reads": self.reads,
+            "readsPerSecond": _rate(self.reads, elapsed),
+            "alignedReads": self.alignedReads,
+            "reading": with_rate(self.reading, "seconds"),
+            "stages": {stage: with_rate(stats, "busySeconds") for stage, stats in self.stages.items()},
+            "advancedShare": self.advancedShare,
+            "aggregation": dict(self.aggregation, tasksPerSecond=_rate(self.aggregation["tasks"], self.aggregation["seconds"])),
+            "queue": {"maxWaitingPairs": self.queue["maxWaitingPairs"], "maxRunning": self.queue["maxRunning"]},
+            "workers": {str(worker): with_rate(stats, "busySeconds") for worker, stats in self.workers.items()},
+            "failures": self.failures,
+        }
+
+    def save(self, filename: str):
+        """
+        Saves the metrics as JSON file.
+        :param filename:
+        :return:
+        """
+        with open(filename, "w") as fh:
+            json.dump(self.to_dict(), fh, indent=2)
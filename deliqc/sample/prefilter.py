@@ -0,0 +1,104 @@
+from typing import Dict, Iterable, Union
+
+from deliqc import dna
+from deliqc.dna import packed
+
+# Adapters that are read through after short inserts, in the orientation they appear in the reads
+ADAPTERS = {
+    "TruSeq read 1": "AGATCGGAAGAGCACACGTCTGAACTCCAGTCAC",
+    "TruSeq read 2": "AGATCGGAAGAGCGTCGTGTAGGGAAAGAGTGT",
+    "Nextera": "CTGTCTCTTATACACATCT",
+    "Small RNA": "TGGAATTCTCGGGTGCCAAGG",
+}
+
+KMER_LENGTH = 10
+KMER_STRIDE = 2
+# A k-mer of a read only counts if it is found within this distance of its position in the reference
+MAX_KMER_OFFSET = 4
+# Least amount of sampled k-mers of a pair that have to be found in the reference
+MIN_REFERENCE_HITS = 1
+
+
+def kmers(sequence: bytes, k: int) -> Dict[bytes, int]:
+    """
+    Returns all k-mers of a sequence that do not contain an N, together with the position they first occur at.
+    :param sequence:
+    :param k:
+    :return:
+    """
+    positions = {}
+    for i in range(len(sequence) - k + 1):
+        if b"N" not in sequence[i:i + k]:
+            positions.setdefault(sequence[i:i + k], i)
+
+    return positions
+
+
+class OffTargetFilter:
+    """
+    Recognises read pairs that do not come from the template, such as primer dimers, PhiX spike-in or adapter-only
+    reads, with a few k-mer lookups instead of an alignment.
+
+    Every stride-th k-mer within the first reference length bases of both reads is looked up in the k-mers of the
+    reference (read 2 in forward, read 1 in reverse orientation), where it has to be found within max_offset of its
+    position in the read, and in the k-mers of the adapters. A pair is off-target if less than min_hits k-mers are
+    found in the reference, or if more of them come from adapters than from the reference. Primer dimers thus get
+    recognised by their primers being found at the wrong position, and by the adapters following them.
+
+    By chance, a k-mer is found at its position with a probability of about (2 * max_offset + 1) / 4^k, so that even
+    heavily mutated reads from the template get recognised, while random sequences hardly ever do.
+    """
+    def __init__(
+            self,
+            reference: Union[str, bytes],
+            adapters: Iterable[str] = ADAPTERS.values(),
+            k: int = KMER_LENGTH,
+            stride: int = KMER_STRIDE,
+            min_hits: int = MIN_REFERENCE_HITS,
+            max_offset: int = MAX_KMER_OFFSET,
+    ):
+        reference = packed.to_bytes(reference)
+        reverse = dna.reverse_complement(reference)
+
+        self.L = len(reference)
+        self.k = k
+        self.max_offset = max_offset
+
+        self.forward = kmers(reference, k)
+        self.reverse = kmers(reverse, k)
+        self.adapters = set()
+        for adapter in adapters:
+            self.adapters.update(kmers(packed.to_bytes(adapter), k))
+
+        self.positions = list(range(0, self.L - k + 1, stride))
+        self.min_hits = min_hits
+
+    def is_off_target(self, r1: Union[str, bytes], r2: Union[str, bytes]) -> bool:
+        """
+        Returns True if a pair does not come from the template.
+        :param r1:
+        :param r2:
+        :return:
+        """
+        k = self.k
+        reference = 0
+        adapters = 0
+        remaining = 2 * len(self.positions)
+
+        for read, index in ((packed.to_bytes(r2), self.forward), (packed.to_bytes(r1), self.reverse)):
+            for i in self.positions:
+                kmer = read[i:i + k]
+                position = index.get(kmer)
+
+                if position is not None:
+                    if abs(position - i) <= self.max_offset:
+                        reference += 1
+                elif kmer in self.adapters:
+                    adapters += 1
+
+                # Stop as soon as the remaining k-mers cannot change the outcome
+                remaining -= 1
+                if reference >= self.min_hits and reference >= adapters + remaining:
+                    return False
+
+        return reference < self.min_hits or adapters > reference
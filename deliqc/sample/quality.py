@@ -0,0 +1,82 @@
+import numpy as np
+
+from .reader import ReadBatch
+
+
+class QualityFilter:
+    """
+    Vectorised Phred quality filter for read batches.
+
+    Only the first region bases of each read are considered, as these are the ones that get compared to the
+    reference. A pair is rejected if either mate
+    - has a mean quality below min_mean_quality,
+    - has more than max_low_quality_bases bases with a quality below low_quality_threshold, or
+    - is shorter than the region after trimming it at the first base with a quality below trim_quality, as it can
+      then no longer cover the reference.
+    Each criterion is disabled if set to None.
+    """
+    def __init__(
+            self,
+            region: int = None,
+            min_mean_quality: float = None,
+            max_low_quality_bases: int = None,
+            low_quality_threshold: int = 20,
+            trim_quality: int = None,
+    ):
+        self.region = region
+        self.min_mean_quality = min_mean_quality
+        self.max_low_quality_bases = max_low_quality_bases
+        self.low_quality_threshold = low_quality_threshold
+        self.trim_quality = trim_quality
+
+        # Amount of pairs rejected so far
+        self.rejected = 0
+
+    @property
+    def active(self) -> bool:
+        return self.min_mean_quality is not None or self.max_low_quality_bases is not None or self.trim_quality is not None
+
+    def _passes(self, qualities: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        width = qualities.shape[1] if self.region is None else min(self.region, qualities.shape[1])
+        qualities = qualities[:, :width]
+        lengths = np.minimum(lengths, width)
+
+        within = np.arange(width)[np.newaxis, :] < lengths[:, np.newaxis]
+        passes = np.ones(len(qualities), dtype=bool)
+
+        if self.min_mean_quality is not None:
+            mean = (qualities * within).sum(axis=1) / np.maximum(lengths, 1)
+            passes &= mean >= self.min_mean_quality
+
+        if self.max_low_quality_bases is not None:
+            low = ((qualities < self.low_quality_threshold) & within).sum(axis=1)
+            passes &= low <= self.max_low_quality_bases
+
+        if self.trim_quality is not None and self.region is not None:
+            passes &= lengths >= self.region
+
+        return passes
+
+    def _trim(self, qualities: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        low = (qualities < self.trim_quality) & (np.arange(qualities.shape[1])[np.newaxis, :] < lengths[:, np.newaxis])
+
+        return np.where(low.any(axis=1), low.argmax(axis=1), lengths).astype(lengths.dtype)
+
+    def apply(self, batch: ReadBatch) -> ReadBatch:
+        """
+        Returns a batch with all pairs removed that fail the filter, and counts them as rejected. If trimming is
+        enabled, the lengths of the remaining reads are trimmed.
+        :param batch:
+        :return:
+        """
+        if not self.active:
+            return batch
+
+        if self.trim_quality is not None:
+            batch.length1 = self._trim(batch.q1, batch.length1)
+            batch.length2 = self._trim(batch.q2, batch.length2)
+
+        passes = self._passes(batch.q1, batch.length1) & self._passes(batch.q2, batch.length2)
+        self.rejected += int(len(batch) - passes.sum())
+
+        return batch.select(passes)
@@ -1,4 +1,11 @@
 import gzip
+import numpy as np
+from .decompression import open_fastq
+from .index import read_sampled_sequences
+from typing import Iterator, List, Optional, Tuple
+
+# Offset of the ASCII encoded (Sanger / Illumina 1.8+) Phred quality scores
+PHRED_OFFSET = 33
 
 
 def read_lines(source: str, max_reads: int =20):
@@ -33,3 +40,247 @@ def read_lines(source: str, max_reads: int =20):
 
             if worked_lines >= max_reads:
                 break
+
+
+class ReadBatch:
+    """
+    A batch of read pairs stored as fixed-width uint8 matrices.
+
+    Rows are padded with PADDING after the end of each read; the true lengths are kept in length1 and length2.
+    """
+    PADDING = ord("N")
+
+    def __init__(
+            self,
+            r1: np.ndarray,
+            r2: np.ndarray,
+            length1: np.ndarray,
+            length2: np.ndarray,
+            offset: int = 0,
+            q1: np.ndarray = None,
+            q2: np.ndarray = None,
+    ):
+        self.r1 = r1
+        self.r2 = r2
+        self.length1 = length1
+        self.length2 = length2
+        # Number of the first read pair of this batch within the file
+        self.offset = offset
+        # Phred quality scores of each base, only present if they were requested from the reader
+        self.q1 = q1
+        self.q2 = q2
+
+    def __len__(self):
+        return len(self.length1)
+
+    def pair(self, i: int) -> Tuple[bytes, bytes]:
+        """
+        Returns the i-th read pair as bytes.
+        :param i:
+        :return:
+        """
+        return (
+            self.r1[i, :self.length1[i]].tobytes(),
+            self.r2[i, :self.length2[i]].tobytes(),
+        )
+
+    def pairs(self) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Iterates over all read pairs as bytes.
+        :return:
+        """
+        for i in range(len(self)):
+            yield self.pair(i)
+
+    def select(self, mask: np.ndarray) -> "ReadBatch":
+        """
+        Returns a new batch containing only the read pairs selected by mask.
+        :param mask:
+        :return:
+        """
+        return ReadBatch(
+            self.r1[mask],
+            self.r2[mask],
+            self.length1[mask],
+            self.length2[mask],
+            self.offset,
+            self.q1[mask] if self.q1 is not None else None,
+            self.q2[mask] if self.q2 is not None else None,
+        )
+
+
+def read_sequence_blocks(
+        source: str,
+        max_reads: int = 20,
+        batch_size: int = 4096,
+        block_size: int = 1 << 22,
+        threads: int = 1,
+        with_qualities: bool = False,
+        skip: int = 0,
+) -> Iterator[Tuple[List[bytes], Optional[List[bytes]]]]:
+    """
+    Reads sequences from a fastq source in blocks instead of line by line.
+
+    Yields tuples of at most batch_size raw sequences and quality strings (bytes, without line endings). The quality
+    strings are None unless with_qualities is set.
+    :param source:
+    :param max_reads:
+    :param batch_size:
+    :param block_size: Amount of bytes read from the file at once.
+    :param threads: Amount of threads used for decompression, see open_fastq.
+    :param with_qualities:
+    :param skip: Amount of records at the start that are read, but not returned. They count towards max_reads.
+    :return:
+    """
+    worked_reads = 0
+    sequences = []
+    qualities = []
+    rest = b""
+
+    with open_fastq(source, threads) as fh:
+        while worked_reads < max_reads:
+            block = fh.read(block_size)
+
+            if not block:
+                lines = rest.splitlines()
+                rest = b""
+            else:
+                lines = (rest + block).split(b"\n")
+                # Everything behind the last complete record is kept for the next block
+                complete = (len(lines) - 1) // 4 * 4
+                rest = b"\n".join(lines[complete:])
+                lines = lines[:complete]
+
+            for read, quality in zip(lines[1::4], lines[3::4]):
+                worked_reads += 1
+
+                if worked_reads > skip:
+                    sequences.append(read.rstrip(b"\r"))
+                    if with_qualities:
+                        qualities.append(quality.rstrip(b"\r"))
+
+                    if len(sequences) >= batch_size:
+                        yield sequences, qualities if with_qualities else None
+                        sequences = []
+                        qualities = []
+
+                if worked_reads >= max_reads:
+                    break
+
+            if not block:
+                break
+
+    if len(sequences) > 0:
+        yield sequences, qualities if with_qualities else None
+
+
+def sequences_to_matrix(sequences: List[bytes], width: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Converts a list of raw sequences into a padded (n, width) uint8 matrix and a vector of lengths.
+
+    Sequences longer than width get truncated.
+    :param sequences:
+    :param width: Width of the matrix. Defaults to the longest sequence.
+    :return:
+    """
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int32, count=len(sequences))
+
+    if width is None:
+        width = int(lengths.max()) if len(sequences) > 0 else 0
+
+    padding = bytes([ReadBatch.PADDING])
+    if len(sequences) > 0 and lengths.min() == width and lengths.max() == width:
+        buffer = b"".join(sequences)
+    else:
+        buffer = b"".join(s[:width].ljust(width, padding) for s in sequences)
+
+    matrix = np.frombuffer(buffer, dtype=np.uint8).reshape(len(sequences), width)
+    np.minimum(lengths, width, out=lengths)
+
+    return matrix, lengths
+
+
+def read_pair_blocks(
+        fn1: str,
+        fn2: str,
+        max_reads: int = 20,
+        batch_size: int = 4096,
+        threads: int = 1,
+        sampling: str = "head",
+        seed: int = None,
+        with_qualities: bool = False,
+        shard: Tuple[int, int] = None,
+        skip: int = 0,
+) -> Iterator[Tuple[int, List[bytes], List[bytes], Optional[List[bytes]], Optional[List[bytes]]]]:
+    """
+    Reads both mates of a paired end run in blocks of raw sequences, without converting them into matrices.
+
+    Yields (offset, sequences1, sequences2, qualities1, qualities2) for at most batch_size pairs, where offset is the
+    number of the first pair of the block. The qualities are None unless with_qualities is set. See read_batches for
+    the options.
+    :return:
+    """
+    if sampling == "head" and shard is None:
+        blocks1 = read_sequence_blocks(fn1, max_reads, batch_size, threads=threads, with_qualities=with_qualities, skip=skip)
+        blocks2 = read_sequence_blocks(fn2, max_reads, batch_size, threads=threads, with_qualities=with_qualities, skip=skip)
+        blocks = zip(blocks1, blocks2)
+    else:
+        blocks = read_sampled_sequences(fn1, fn2, max_reads, sampling, seed, batch_size, with_qualities, shard, skip)
+
+    offset = skip
+    for (s1, qs1), (s2, qs2) in blocks:
+        n = min(len(s1), len(s2))
+
+        if with_qualities:
+            yield offset, s1[:n], s2[:n], qs1[:n], qs2[:n]
+        else:
+            yield offset, s1[:n], s2[:n], None, None
+
+        offset += n
+
+
+def read_batches(
+        fn1: str,
+        fn2: str,
+        max_reads: int = 20,
+        batch_size: int = 4096,
+        width: int = None,
+        threads: int = 1,
+        sampling: str = "head",
+        seed: int = None,
+        with_qualities: bool = False,
+        shard: Tuple[int, int] = None,
+        skip: int = 0,
+) -> Iterator[ReadBatch]:
+    """
+    Reads both mates of a paired end run in batches.
+
+    By default, the first max_reads pairs are read ("head"). With sampling set to "random" or "tile", a uniform or
+    tile-stratified subsample of max_reads pairs is drawn using a sidecar offset index of each file (see FastqIndex).
+    The index is also used to only read one shard of the selected pairs (see shard_records), so that several runs
+    can share the work.
+    :param fn1:
+    :param fn2:
+    :param max_reads:
+    :param batch_size: Maximum amount of read pairs per batch.
+    :param width: Fixed width of the read matrices. Defaults to the longest read in each batch.
+    :param threads: Amount of decompression threads per file.
+    :param sampling: "head", "random" or "tile"
+    :param seed: Random seed used for sampling.
+    :param with_qualities: Also parse the quality strings into Phred score matrices.
+    :param shard: (i, n) to only read the i-th of n parts of the selected pairs. Random sampling needs a seed then.
+    :param skip: Amount of the selected pairs to skip, such as the ones already analysed before a checkpoint.
+    :return:
+    """
+    blocks = read_pair_blocks(fn1, fn2, max_reads, batch_size, threads, sampling, seed, with_qualities, shard, skip)
+
+    for offset, s1, s2, qs1, qs2 in blocks:
+        r1, length1 = sequences_to_matrix(s1, width)
+        r2, length2 = sequences_to_matrix(s2, width)
+
+        q1 = q2 = None
+        if with_qualities:
+            q1 = sequences_to_matrix(qs1, r1.shape[1])[0] - PHRED_OFFSET
+            q2 = sequences_to_matrix(qs2, r2.shape[1])[0] - PHRED_OFFSET
+
+        yield ReadBatch(r1, r2, length1, length2, offset, q1, q2)
@@ -0,0 +1,56 @@
+from typing import Iterable, List
+import numpy as np
+
+from deliqc import dna
+from deliqc.dna import packed
+from deliqc.sample.banded import ReferenceProfile
+from deliqc.sample.alignment import adapter_seeds
+from deliqc.sample.prefilter import ADAPTERS, OffTargetFilter
+
+
+class CompiledReference:
+    """
+    A reference with everything the analyzers need precomputed.
+
+    It is built once per run and installed in every worker process by the pool initializer (see
+    worker.install_worker_data), so it does not have to travel with the reads.
+
+    - codes: the reference as uint8 array of ASCII codes, mask: True where the reference is not N
+    - packedReference: the packed reference and the lane mask of its non-N positions (see dna.packed)
+    - profile: the score profile for the banded alignment
+    - coordinates: (start, end) of each codon as list, and as (k, 2) array in coordinateArray
+    - codonIndex: maps each codon to split on (as str and as bytes) to its index + 1
+    - adapters: the adapters read through after short inserts, and the starts searched for in adapterSeeds (see
+      alignment.overlap_mates)
+    - offTargetFilter: the k-mer index to recognise pairs that do not come from the reference (see prefilter)
+    """
+    def __init__(self, reference: str, codons: List[str] = [], adapters: Iterable[str] = None):
+        self.reference = reference
+        self.codes = dna.encode(reference)
+        self.mask = self.codes != ord("N")
+        self.packedReference = packed.pack(reference), packed.lane_mask(reference)
+        self.profile = ReferenceProfile(reference)
+
+        self.adapters = list(adapters) if adapters is not None else list(ADAPTERS.values())
+        self.adapterSeeds = adapter_seeds(self.adapters)
+        self.offTargetFilter = OffTargetFilter(reference, self.adapters)
+
+        self.coordinates = dna.get_codon_coordinates(reference)
+        self.coordinateArray = np.array(self.coordinates, dtype=np.int64).reshape(-1, 2)
+
+        self.codons = list(codons)
+        self.codonIndex = {}
+        for i in range(len(self.codons) - 1, -1, -1):
+            self.codonIndex[self.codons[i]] = i + 1
+            self.codonIndex[self.codons[i].encode("ascii")] = i + 1
+
+    def __len__(self):
+        return len(self.codes)
+
+    def codon_index(self, codon) -> int:
+        """
+        Returns the index + 1 of a codon to split on, or 0 if it is none of them.
+        :param codon: str or bytes
+        :return:
+        """
+        return self.codonIndex.get(codon, 0)
@@ -2,28 +2,150 @@ import numpy as np
 
 
 class BaseResult:
-    pass
+    __slots__ = ("count",)
+
+    def __init__(self):
+        # Amount of identical read pairs a result stands for
+        self.count = 1
 
 
 class AlignedReadResult(BaseResult):
+    """
+    Result of an aligned read pair against a reference of length L.
+
+    Instead of dense arrays, the result only stores its events as (position, kind, base) tuples, as a typical read
+    has none or one of them. kind is one of MISMATCH, INSERTION (before the position) or DELETION. base is the base
+    index of the read for mismatches, the first inserted base for insertions and -1 for deletions.
+
+    The dense arrays of the previous format (mismatches, mutationTarget, insertionTarget and indels) are still
+    available as properties. tier names the analyzer that resolved the read (simple, shifted or advanced).
+    """
+    __slots__ = ("L", "events", "pairMismatches", "codon", "codons", "tier")
+
+    MISMATCH = 0
+    INSERTION = 1
+    DELETION = 2
+
     def __init__(self, L: int):
-        self.mismatches = np.zeros(L)
-        self.mutationTarget = np.zeros((L, 5))
-        self.insertionTarget = np.zeros((L, 5))
-        self.indels = np.zeros((L, 2))
+        super().__init__()
+        self.L = L
+        self.events = []
 
         self.pairMismatches = 0
         self.codon = None
         self.codons = []
+        self.tier = None
+
+    def add_mismatch(self, position: int, base: int):
+        self.events.append((position, self.MISMATCH, base))
+
+    def add_insertion(self, position: int, base: int):
+        self.events.append((position, self.INSERTION, base))
+
+    def add_deletion(self, position: int):
+        self.events.append((position, self.DELETION, -1))
 
     @property
     def mismatchCount(self):
-        return self.mismatches.sum()
+        return sum(1 for _, kind, _ in self.events if kind == self.MISMATCH)
+
+    @property
+    def mismatches(self) -> np.ndarray:
+        mismatches = np.zeros(self.L)
+        for position, kind, base in self.events:
+            if kind == self.MISMATCH:
+                mismatches[position] += 1
+        return mismatches
+
+    @property
+    def mutationTarget(self) -> np.ndarray:
+        target = np.zeros((self.L, 5))
+        for position, kind, base in self.events:
+            if kind == self.MISMATCH:
+                target[position, base] += 1
+        return target
+
+    @property
+    def insertionTarget(self) -> np.ndarray:
+        target = np.zeros((self.L, 5))
+        for position, kind, base in self.events:
+            if kind == self.INSERTION:
+                target[position, base] += 1
+        return target
+
+    @property
+    def indels(self) -> np.ndarray:
+        indels = np.zeros((self.L, 2))
+        for position, kind, base in self.events:
+            if kind != self.MISMATCH:
+                indels[position, kind - self.INSERTION] += 1
+        return indels
 
 
 class FailedReadResult(BaseResult):
+    """
+    Result of a read pair that could not be analysed for the given reason. unmerged is set if the mates of the pair
+    did not even overlap for an alignment (WeirdReads); the reason is then the one of the simple analyzer.
+    """
+    __slots__ = ("reason", "unmerged")
+
     tooManyMismatchesBetweenPair = 0
     tooManyMismatchesToReference = 1
+    offTarget = 2
 
-    def __init__(self, reason):
+    def __init__(self, reason, unmerged: bool = False):
+        super().__init__()
         self.reason = reason
+        self.unmerged = unmerged
+
+
+class SimpleBatchResult(BaseResult):
+    """
+    Result of the batched simple analyzer for n read pairs and a reference of length L.
+
+    mutationTarget holds the base index of the read at each mismatching position and -1 elsewhere. codonIndex is 0 if
+    the read could not be assigned to a codon, or i+1 for the i-th codon to split on. reason is -1 for aligned reads or
+    the FailedReadResult reason.
+    """
+    def __init__(self, n: int, L: int):
+        super().__init__()
+        self.pairMismatches = np.zeros(n, dtype=np.int32)
+        self.consensus = np.zeros((n, L), dtype=np.uint8)
+        self.consensusLength = np.zeros(n, dtype=np.int32)
+        self.mismatches = np.zeros((n, L), dtype=bool)
+        self.mutationTarget = np.full((n, L), -1, dtype=np.int8)
+        self.codonIndex = np.zeros(n, dtype=np.int32)
+        self.reason = np.full(n, -1, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.reason)
+
+    @property
+    def aligned(self) -> np.ndarray:
+        return self.reason < 0
+
+    def read_result(self, i: int, codons=[], coordinates=[]) -> BaseResult:
+        """
+        Converts the result of the i-th read pair into a per-read result.
+        :param i:
+        :param codons: Codons to split on
+        :param coordinates: Codon coordinates of the reference
+        :return:
+        """
+        if self.reason[i] >= 0:
+            return FailedReadResult(int(self.reason[i]))
+
+        L = self.mismatches.shape[1]
+        result = AlignedReadResult(L)
+        result.pairMismatches = int(self.pairMismatches[i])
+
+        for position in np.flatnonzero(self.mismatches[i]).tolist():
+            result.add_mismatch(position, int(self.mutationTarget[i, position]))
+
+        if self.codonIndex[i] > 0:
+            result.codon = codons[self.codonIndex[i] - 1]
+
+        consensus = self.consensus[i, :self.consensusLength[i]].tobytes().decode("ascii")
+        result.codons = [consensus[x:y] for x, y in coordinates]
+
+        return result
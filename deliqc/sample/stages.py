@@ -0,0 +1,208 @@
+from collections import deque
+from queue import Queue
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from .counts import SampleCounts
+from .eventlog import EventLogWriter
+from .metrics import RunMetrics
+from .worker import simple_chunk_worker, advanced_chunk_worker
+
+# Pairs per task of the second stage. Aligning takes about 20 times as long as the simple analysis.
+ALIGN_BATCHES = 20
+# Share of the task slots that alignments may occupy while there are still reads for the first stage
+ALIGN_SHARE = 0.5
+# Tasks per worker submitted at once, so that workers do not wait for the parent
+TASKS_PER_WORKER = 2
+
+
+class Boundary:
+    """
+    Yielded by the chunk iterators of run_stages between chunks, once all records of a sample up to records have been
+    passed on in chunks. Checkpoints can only be taken at these points.
+    """
+    def __init__(self, records: int):
+        self.records = records
+
+
+class StageStats:
+    """
+    Statistics of one stage of load_sample: the amount of (unique) read pairs and tasks it handled, the time the
+    workers spent on them (busy), and the time from its first task being submitted to its last result (wall).
+    """
+    def __init__(self):
+        self.pairs = 0
+        self.tasks = 0
+        self.busy = 0.0
+        self.first = None
+        self.last = None
+
+    def submitted(self, pairs: int):
+        if self.first is None:
+            self.first = perf_counter()
+
+        self.pairs += pairs
+        self.tasks += 1
+
+    def finished(self, busy: float):
+        self.busy += busy
+        self.last = perf_counter()
+
+    @property
+    def wall(self) -> float:
+        return self.last - self.first if self.first is not None else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "pairs": self.pairs,
+            "tasks": self.tasks,
+            "busySeconds": self.busy,
+            "wallSeconds": self.wall,
+        }
+
+
+def run_stages(
+        pool,
+        chunks: Sequence[Iterable[List]],
+        counts: Sequence[SampleCounts],
+        threads: int,
+        align_batches: int = ALIGN_BATCHES,
+        align_share: float = ALIGN_SHARE,
+        checkpoint: Callable[[List[Optional[int]]], None] = None,
+        checkpoint_interval: float = None,
+        metrics: RunMetrics = None,
+        event_log: EventLogWriter = None,
+) -> List[Dict[str, StageStats]]:
+    """
+    Analyses the chunks of read pairs of one or several samples in two stages on a pool with installed worker data,
+    and merges their counts.
+
+    The first stage resolves the pairs that do not need an alignment (see worker.simple_worker). The remaining pairs
+    are collected and aligned in batches of align_batches in the second stage, so that the expensive alignments do
+    not make the first stage's tasks uneven. Batches of both stages share the pool: alignments get at most
+    align_share of the task slots while the first stage still has reads, and slots one stage does not use go to the
+    other. The first stage pauses if too many pairs wait for an alignment, until they have been aligned.
+
+    Chunks of all samples are taken in turns, and the sample with the most pairs waiting is aligned first, so that
+    all samples share the pool until the last one is done.
+
+    Every checkpoint_interval seconds, each sample stops at its next Boundary, all pairs taken so far are analysed
+    and checkpoint is called with the records of each sample read up to its boundary (None for samples that have
+    been read completely). The counts are then complete for these records.
+    :param pool:
+    :param chunks: Chunks of (read number, pair, count) of each sample, and Boundary objects in between
+    :param counts: Counts of each sample to merge its results into
+    :param threads: Amount of workers of the pool
+    :param align_batches:
+    :param align_share:
+    :param checkpoint: Called at every checkpoint
+    :param checkpoint_interval: Seconds between checkpoints
+    :param metrics: Collects the throughput of the whole run and prints the progress
+    :param event_log: Receives the records of every read if the workers log them
+    :return: Statistics of the simple and advanced stage of each sample
+    """
+    slots = TASKS_PER_WORKER * threads
+    align_slots = min(slots, max(1, round(slots * align_share)))
+    max_remaining = slots * align_batches
+
+    stats = [{"simple": StageStats(), "advanced": StageStats()} for _ in counts]
+    running = {"simple": 0, "advanced": 0}
+    done = Queue()
+
+    def submit(sample, stage, function, chunk):
+        stats[sample][stage].submitted(len(chunk))
+        running[stage] += 1
+        pool.apply_async(
+            function, (chunk,),
+            callback=lambda result: done.put((sample, stage, len(chunk), result)),
+            error_callback=lambda error: done.put((sample, stage, len(chunk), error)),
+        )
+
+    # Samples that still have chunks for the first stage, in turns
+    readers = deque((sample, iter(sample_chunks)) for sample, sample_chunks in enumerate(chunks))
+    # Pairs of each sample waiting for an alignment
+    remaining = [[] for _ in counts]
+
+    # Samples stopped at a boundary for the next checkpoint, and the records read up to each one's last boundary
+    stopped = []
+    positions = [0 for _ in counts]
+    last_checkpoint = perf_counter()
+
+    while True:
+        while running["simple"] + running["advanced"] < slots:
+            exhausted = len(readers) == 0
+            first_stage_done = exhausted and running["simple"] == 0
+            waiting = sum(len(pairs) for pairs in remaining)
+
+            sample = max(range(len(remaining)), key=lambda i: len(remaining[i]))
+            # Pairs waiting for an alignment may be spread over several samples without any of them reaching a full
+            # batch, in which case the sample with the most pairs is aligned anyway
+            full = len(remaining[sample]) >= align_batches or waiting >= max_remaining
+            may_align = running["advanced"] < align_slots or exhausted or waiting >= max_remaining
+
+            if (full and may_align) or (first_stage_done and waiting > 0):
+                submit(sample, "advanced", advanced_chunk_worker, remaining[sample][:align_batches])
+                remaining[sample] = remaining[sample][align_batches:]
+            elif not exhausted and waiting < max_remaining:
+                sample, reader = readers.popleft()
+                started = perf_counter()
+                chunk = next(reader, None)
+
+                if metrics is not None and isinstance(chunk, list):
+                    metrics.read(len(chunk), perf_counter() - started)
+
+                if chunk is None:
+                    positions[sample] = None
+                elif isinstance(chunk, Boundary):
+                    positions[sample] = chunk.records
+
+                    if checkpoint is not None and perf_counter() - last_checkpoint >= checkpoint_interval:
+                        stopped.append((sample, reader))
+                    else:
+                        readers.append((sample, reader))
+                else:
+                    submit(sample, "simple", simple_chunk_worker, chunk)
+                    readers.append((sample, reader))
+            else:
+                break
+
+        if running["simple"] + running["advanced"] == 0:
+            if len(stopped) == 0:
+                break
+
+            # All samples are stopped or done, and everything read so far has been counted
+            checkpoint(positions)
+            last_checkpoint = perf_counter()
+            readers.extend(stopped)
+            stopped = []
+            continue
+
+        if metrics is not None:
+            metrics.queued(sum(len(pairs) for pairs in remaining), running)
+
+        sample, stage, pairs, result = done.get()
+        running[stage] -= 1
+
+        if isinstance(result, BaseException):
+            raise result
+
+        if stage == "simple":
+            partial, unresolved, records, busy, worker = result
+            remaining[sample].extend(unresolved)
+        else:
+            partial, records, busy, worker = result
+
+        if event_log is not None and records is not None:
+            event_log.write(sample, records)
+
+        started = perf_counter()
+        counts[sample].merge(partial)
+
+        if metrics is not None:
+            metrics.merged(perf_counter() - started)
+            metrics.finished(stage, worker, pairs, busy)
+            metrics.report(counts)
+
+        stats[sample][stage].finished(busy)
+
+    return stats
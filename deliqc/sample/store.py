@@ -0,0 +1,304 @@
+from typing import List, Tuple
+import json
+import os
+import pickle
+import struct
+import zlib
+import numpy as np
+
+from .counts import normalise_events
+from .load import EVENT_KEYS, average_results, normalise_result
+
+# Start of every result file, followed by the length of the header
+MAGIC = b"DQR\x01"
+# Array sections start at multiples of this, so that they can be mapped with the right alignment
+ALIGNMENT = 64
+# Name of the section holding the amount of aligned reads each column of the event counters is divided by
+DENOMINATORS = "denominators"
+SAMPLE_KEYS = ("title", "reference", "splitOnCodon", "splitOnCodonSequences")
+
+_HEADER = struct.Struct("<4sQ")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _encode(value):
+    """
+    Converts a value into plain JSON types. Dictionaries with keys that are not strings, such as the splits and
+    library members, are stored as lists of items, and tuples are marked as such.
+    """
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: _encode(v) for key, v in value.items()}
+        return {"__items__": [[_encode(key), _encode(v)] for key, v in value.items()]}
+    elif isinstance(value, tuple):
+        return {"__tuple__": [_encode(v) for v in value]}
+    elif isinstance(value, list):
+        return [_encode(v) for v in value]
+    elif isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__items__" in value:
+            return {_decode(key): _decode(v) for key, v in value["__items__"]}
+        elif "__tuple__" in value:
+            return tuple(_decode(v) for v in value["__tuple__"])
+        return {key: _decode(v) for key, v in value.items()}
+    elif isinstance(value, list):
+        return [_decode(v) for v in value]
+
+    return value
+
+
+def denominators(result: dict, codons: List[str]) -> np.ndarray:
+    """
+    Returns the amount of aligned reads of a result in total and for each codon, which the columns of its event
+    counters are divided by.
+    :param result:
+    :param codons:
+    :return:
+    """
+    per_codon = result["alignedReadsPerCodon"]
+    return np.array([result["alignedReads"]] + [per_codon.get(codon, 0) for codon in codons], dtype=np.int64)
+
+
+def is_result_file(filename: str) -> bool:
+    """
+    Returns True if filename was saved by save_result.
+    :param filename:
+    :return:
+    """
+    with open(filename, "rb") as fh:
+        return fh.read(len(MAGIC)) == MAGIC
+
+
+def save_result(filename: str, sample: dict, results: List[dict], compress: bool = False):
+    """
+    Saves the raw results of the replicates of a sample (see load_samples) to a result file.
+
+    The file starts with MAGIC, the length of the header and the header as JSON. The header holds the title,
+    reference and codons of the sample, the counters of each replicate and where each array section is. The event
+    counters of each replicate are saved as int64 arrays together with their denominators, each section starting at
+    a multiple of ALIGNMENT after the header. Compressed sections (zlib) cannot be mapped and are read as a whole.
+    :param filename:
+    :param sample: Title, reference, splitOnCodon and splitOnCodonSequences of the sample
+    :param results: Raw results of each replicate
+    :param compress:
+    :return:
+    """
+    codons = sample["splitOnCodonSequences"]
+    sections = []
+    replicates = []
+    offset = 0
+
+    for i, result in enumerate(results):
+        arrays = {key: np.ascontiguousarray(result[key], dtype="<i8") for key in EVENT_KEYS}
+        arrays[DENOMINATORS] = denominators(result, codons)
+
+        for name, array in arrays.items():
+            data = array.tobytes()
+            if compress:
+                data = zlib.compress(data)
+
+            sections.append((data, {
+                "replicate": i,
+                "name": name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+                "offset": offset,
+                "size": len(data),
+                "compression": "zlib" if compress else None,
+            }))
+            offset = _aligned(offset + len(data))
+
+        replicates.append({key: _encode(value) for key, value in result.items() if key not in EVENT_KEYS})
+
+    header = json.dumps({
+        "sample": {key: _encode(sample[key]) for key in SAMPLE_KEYS},
+        "replicates": replicates,
+        "sections": [section for _, section in sections],
+    }).encode("utf-8")
+    start = _aligned(_HEADER.size + len(header))
+
+    # Written next to the target first, so that an interrupted save does not leave a broken file behind
+    temporary = f"{filename}.tmp"
+    with open(temporary, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, len(header)))
+        fh.write(header)
+
+        for data, section in sections:
+            fh.seek(start + section["offset"])
+            fh.write(data)
+
+    os.replace(temporary, filename)
+
+
+class ResultFile:
+    """
+    A result file saved by save_result. Only the header is read when opening it; the arrays are read lazily, as
+    read-only np.memmap of the file if their section is not compressed, so that only the parts that are used get
+    read from the disk.
+
+    counts returns the integer event counters of a replicate, rates the counters divided by their denominators (as
+    in the results of load_samples) and summary their mean and standard deviation across replicates.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+
+        with open(filename, "rb") as fh:
+            magic, length = _HEADER.unpack(fh.read(_HEADER.size))
+
+            if magic != MAGIC:
+                raise ValueError(f"{filename} is not a deliqc result file.")
+
+            header = json.loads(fh.read(length).decode("utf-8"))
+
+        self.start = _aligned(_HEADER.size + length)
+        self.sample = _decode(header["sample"])
+        self.replicates = [_decode(replicate) for replicate in header["replicates"]]
+        self.sections = {(section["replicate"], section["name"]): section for section in header["sections"]}
+
+    @property
+    def title(self) -> str:
+        return self.sample["title"]
+
+    @property
+    def reference(self) -> str:
+        return self.sample["reference"]
+
+    @property
+    def codons(self) -> List[str]:
+        return self.sample["splitOnCodonSequences"]
+
+    def __len__(self):
+        return len(self.replicates)
+
+    def _array(self, replicate: int, name: str) -> np.ndarray:
+        section = self.sections[(replicate, name)]
+        dtype = np.dtype(section["dtype"])
+        shape = tuple(section["shape"])
+
+        if section["compression"] is None:
+            if section["size"] == 0:
+                return np.zeros(shape, dtype=dtype)
+
+            return np.memmap(self.filename, dtype=dtype, mode="r", offset=self.start + section["offset"], shape=shape)
+
+        with open(self.filename, "rb") as fh:
+            fh.seek(self.start + section["offset"])
+            data = zlib.decompress(fh.read(section["size"]))
+
+        return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+    def counts(self, key: str, replicate: int = 0) -> np.ndarray:
+        """
+        Returns the integer event counters of a replicate.
+        :param key: mismatches, mutationTarget, indels or insertionTarget
+        :param replicate:
+        :return:
+        """
+        if key not in EVENT_KEYS:
+            raise KeyError(key)
+
+        return self._array(replicate, key)
+
+    def denominators(self, replicate: int = 0) -> np.ndarray:
+        """
+        Returns the amount of aligned reads in total and for each codon of a replicate.
+        :param replicate:
+        :return:
+        """
+        return self._array(replicate, DENOMINATORS)
+
+    def rates(self, key: str, replicate: int = 0) -> np.ndarray:
+        """
+        Returns the event counters of a replicate divided by their denominators.
+        :param key:
+        :param replicate:
+        :return:
+        """
+        return normalise_events([self.counts(key, replicate)], self.denominators(replicate))[0]
+
+    def summary(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the mean and standard deviation of the rates of all replicates.
+        :param key:
+        :return:
+        """
+        rates = [self.rates(key, i) for i in range(len(self))]
+        return np.mean(rates, axis=0), np.std(rates, axis=0)
+
+    def raw_result(self, replicate: int = 0) -> dict:
+        """
+        Returns a replicate as raw result (see load_samples), with all arrays read into memory.
+        :param replicate:
+        :return:
+        """
+        result = dict(self.replicates[replicate])
+        for key in EVENT_KEYS:
+            result[key] = np.array(self.counts(key, replicate))
+
+        return result
+
+    def to_sample(self) -> dict:
+        """
+        Reads the whole file into the dictionary that run saves as pickle.
+        :return:
+        """
+        results = [normalise_result(self.raw_result(i), self.codons) for i in range(len(self))]
+        return average_results(self.title, self.reference, self.sample["splitOnCodon"], self.codons, results)
+
+
+def raw_from_normalised(result: dict, codons: List[str]) -> dict:
+    """
+    Converts a normalised result back into a raw one, by multiplying the event rates with their denominators.
+    :param result:
+    :param codons:
+    :return:
+    """
+    raw = dict(result)
+    totals = denominators(result, codons)
+
+    for key in EVENT_KEYS:
+        raw[key] = np.rint(np.nan_to_num(result[key] * totals)).astype(np.int64)
+
+    raw["alignedReadsPerCodon"] = dict(result["alignedReadsPerCodon"])
+
+    return raw
+
+
+def convert_pickle(pickle_filename: str, filename: str, compress: bool = False) -> int:
+    """
+    Converts a pickle saved by run into a result file.
+    :param pickle_filename:
+    :param filename:
+    :param compress:
+    :return: Amount of replicates
+    """
+    with open(pickle_filename, "rb") as fh:
+        sample = pickle.load(fh)
+
+    codons = sample["splitOnCodonSequences"]
+    results = [raw_from_normalised(result, codons) for result in sample["replicates"]]
+    save_result(filename, sample, results, compress)
+
+    return len(results)
+
+
+def load_result(filename: str) -> dict:
+    """
+    Loads a sample saved by run, either as result file or as pickle.
+    :param filename:
+    :return:
+    """
+    if is_result_file(filename):
+        return ResultFile(filename).to_sample()
+
+    with open(filename, "rb") as fh:
+        return pickle.load(fh)
@@ -1,59 +1,248 @@
-from typing import Tuple
-from deliqc import dna
-from deliqc.sample.alignment import _simple_analyzer, _advanced_analyzer
-from deliqc.sample.result import FailedReadResult, AlignedReadResult
+from time import perf_counter
+import os
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+from deliqc.sample.alignment import _simple_analyzer, _simple_analyzer_batch, _shifted_analyzer, _advanced_analyzer
+from deliqc.sample.reader import sequences_to_matrix
+from deliqc.sample.reference import CompiledReference
+from deliqc.sample.result import BaseResult, FailedReadResult, AlignedReadResult
+from deliqc.sample.counts import SampleCounts
 from deliqc.sample.errors import TooManyMismatchesBetweenPair, TooManyMismatchesToReference, WeirdReads
+from deliqc.sample.eventlog import event_records
 
 
 class WorkerData:
-    def __init__(self, **kwargs):
+    """
+    Everything a worker needs: the compiled reference, the analyzer options (kwargs), the kernel backend and how to
+    split the counts.
+    """
+    def __init__(
+            self,
+            backend: str = None,
+            split_positions: Sequence[int] = (),
+            combine_codons: bool = False,
+            count_members: bool = True,
+            filter_off_target: bool = True,
+            adapters: Sequence[str] = None,
+            log_events: bool = False,
+            **kwargs,
+    ):
         self.kwargs = kwargs
-        self.kwargs["coordinates"] = dna.get_codon_coordinates(kwargs["reference"])
-        self.kwargs["read_length"] = len(kwargs["reference"])
+        # Name of the kernel backend used by the analyzers
+        self.backend = backend
+        # Codon positions to split the counts on (see SplitCounts)
+        self.split_positions = list(split_positions)
+        self.combine_codons = combine_codons
+        # Count the reads of each library member
+        self.count_members = count_members
+        # Recognise pairs that do not come from the reference before analysing them further
+        self.filter_off_target = filter_off_target
+        # Return the records of every read for the event log (see eventlog)
+        self.log_events = log_events
 
+        # Adapters (None for the defaults in prefilter.ADAPTERS) are used to merge the mates of short inserts and to
+        # recognise off-target pairs
+        self.reference = CompiledReference(kwargs["reference"], kwargs.get("codons", []), adapters)
+        self.kwargs["coordinates"] = self.reference.coordinates
+        self.kwargs["read_length"] = len(self.reference)
 
-def worker(data: Tuple[int, Tuple[str, str], WorkerData]):
-    read_number, (r1, r2), metadata = data
-    kwargs = metadata.kwargs
+    def new_counts(self, **kwargs) -> SampleCounts:
+        """
+        Returns empty counters for results of this worker data.
+        :param kwargs: Further arguments for SampleCounts
+        :return:
+        """
+        return SampleCounts(self.reference, self.split_positions, self.combine_codons, self.count_members, **kwargs)
+
+
+# Worker data of the current process, set by install_worker_data
+_installed = None
 
-    simple_failed = False
-    advanced_failed = False
-    too_many_mismatches_between_pair = False
-    too_many_mismatches_to_reference = False
 
-    ref_mismatches = 0
-    pair_mismatches = 0
-    read_indel_target = None
+def install_worker_data(data: WorkerData):
+    """
+    Pool initializer that installs the worker data in a worker process once, instead of sending it with every task.
+    :param data:
+    :return:
+    """
+    global _installed
+    _installed = data
+
+
+def simple_worker(data: Tuple[int, Tuple[bytes, bytes], int], metadata: WorkerData = None) -> Tuple[Optional[BaseResult], int]:
+    """
+    Analyses a read pair with the analyzers that do not need an alignment: base by base, and shifted for a single
+    short indel. Pairs that do not come from the template (primer dimers, PhiX, adapters...) are not analysed any
+    further.
+    :param data: (read number, pair, count)
+    :param metadata:
+    :return: The result, or None if the pair needs an alignment (see advanced_worker), and the reason the simple
+        analyzer failed
+    """
+    read_number, (r1, r2), count = data
+    metadata = metadata or _installed
+    reference = metadata.reference
 
     try:
-        result = _simple_analyzer(r1, r2, **kwargs)
+        result = _simple_analyzer(r1, r2, **metadata.kwargs, packed_reference=reference.packedReference)
+        reason = None
     except TooManyMismatchesBetweenPair:
-        simple_failed = True
-        too_many_mismatches_between_pair = True
+        result = None
+        reason = FailedReadResult.tooManyMismatchesBetweenPair
     except TooManyMismatchesToReference:
-        simple_failed = True
-        too_many_mismatches_to_reference = True
+        result = None
+        reason = FailedReadResult.tooManyMismatchesToReference
+
+    return _after_simple(data, result, reason, metadata)
 
-    if simple_failed is True:
+
+def _after_simple(data: Tuple[int, Tuple[bytes, bytes], int], result: Optional[AlignedReadResult], reason: Optional[int], metadata: WorkerData) -> Tuple[Optional[BaseResult], int]:
+    """
+    Continues simple_worker after the simple analyzer, which either resolved the pair (result) or failed (reason).
+    """
+    read_number, (r1, r2), count = data
+    kwargs = metadata.kwargs
+    reference = metadata.reference
+
+    if result is not None:
+        result.tier = "simple"
+    elif metadata.filter_off_target and reference.offTargetFilter.is_off_target(r1, r2):
+        result = FailedReadResult(FailedReadResult.offTarget)
+    else:
+        # Reads with a single short indel are resolved without an alignment
         try:
-            result = _advanced_analyzer(r1, r2, **kwargs)
-        except TooManyMismatchesBetweenPair:
-            advanced_failed = True
-            too_many_mismatches_between_pair = True
-        except TooManyMismatchesToReference:
-            advanced_failed = True
-            too_many_mismatches_to_reference = True
-        except WeirdReads:
-            advanced_failed = True
-        else:
-            too_many_mismatches_between_pair = False
-            too_many_mismatches_to_reference = False
+            result = _shifted_analyzer(r1, r2, **kwargs, reference_codes=reference.codes)
+            result.tier = "shifted"
+        except (TooManyMismatchesBetweenPair, TooManyMismatchesToReference):
+            return None, reason
 
-    if advanced_failed is True:
-        if too_many_mismatches_between_pair:
-            result = FailedReadResult(FailedReadResult.tooManyMismatchesBetweenPair)
+    result.count = count
+
+    return result, reason
 
-        if too_many_mismatches_to_reference:
+
+def advanced_worker(data: Tuple[int, Tuple[bytes, bytes], int], reason: int, metadata: WorkerData = None) -> BaseResult:
+    """
+    Aligns a read pair that simple_worker could not resolve.
+    :param data: (read number, pair, count)
+    :param reason: Reason the simple analyzer failed, which is kept if the pair cannot be aligned at all
+    :param metadata:
+    :return:
+    """
+    read_number, (r1, r2), count = data
+    metadata = metadata or _installed
+    reference = metadata.reference
+
+    try:
+        result = _advanced_analyzer(
+            r1, r2, **metadata.kwargs,
+            profile=reference.profile,
+            backend=metadata.backend,
+            adapter_seeds=reference.adapterSeeds,
+        )
+        result.tier = "advanced"
+    except TooManyMismatchesBetweenPair:
+        if reason == FailedReadResult.tooManyMismatchesToReference:
             result = FailedReadResult(FailedReadResult.tooManyMismatchesToReference)
+        else:
+            result = FailedReadResult(FailedReadResult.tooManyMismatchesBetweenPair)
+    except TooManyMismatchesToReference:
+        result = FailedReadResult(FailedReadResult.tooManyMismatchesToReference)
+    except WeirdReads:
+        result = FailedReadResult(reason, unmerged=True)
+
+    result.count = count
 
     return result
+
+
+def worker(data: Tuple[int, Tuple[bytes, bytes], int], metadata: WorkerData = None) -> BaseResult:
+    """
+    Analyses a read pair with all analyzers.
+    :param data: (read number, pair, count)
+    :param metadata:
+    :return:
+    """
+    result, reason = simple_worker(data, metadata)
+
+    if result is None:
+        result = advanced_worker(data, reason, metadata)
+
+    return result
+
+
+def _event_records(logged: list, metadata: WorkerData) -> Optional[np.ndarray]:
+    return event_records(logged, len(metadata.reference.coordinates)) if metadata.log_events else None
+
+
+def simple_chunk_worker(chunk: List[Tuple[int, Tuple[bytes, bytes], int]]) -> Tuple[SampleCounts, list, Optional[np.ndarray], float, int]:
+    """
+    First stage of load_sample: analyses a chunk of read pairs like simple_worker, using the installed worker data.
+    The simple analyzer runs on the whole chunk at once (see _simple_analyzer_batch) with the kernel backend of the
+    worker data; only the pairs it cannot resolve are looked at one by one.
+    :param chunk: List of (read number, pair, count)
+    :return: Counts of the resolved pairs, the remaining pairs together with the reason the simple analyzer failed,
+        the event log records of the resolved pairs (None if not logged), the time spent and the process id of the
+        worker
+    """
+    start = perf_counter()
+    metadata = _installed
+    kwargs = metadata.kwargs
+    reference = metadata.reference
+    counts = metadata.new_counts()
+    remaining = []
+    logged = []
+
+    L = len(reference)
+    r1, length1 = sequences_to_matrix([pair[0] for _, pair, _ in chunk], L)
+    r2, length2 = sequences_to_matrix([pair[1] for _, pair, _ in chunk], L)
+    batch = _simple_analyzer_batch(
+        r1, r2, length1, length2, **kwargs,
+        reference_codes=reference.codes,
+        reference_mask=reference.mask,
+        backend=metadata.backend,
+    )
+
+    for i, data in enumerate(chunk):
+        simple = batch.read_result(i, kwargs["codons"], reference.coordinates)
+
+        if isinstance(simple, FailedReadResult):
+            result, reason = _after_simple(data, None, simple.reason, metadata)
+        else:
+            result, reason = _after_simple(data, simple, None, metadata)
+
+        if result is None:
+            remaining.append((data, reason))
+        else:
+            counts.add(result)
+
+            if metadata.log_events:
+                logged.append((data[0], result))
+
+    counts.events.flush()
+
+    return counts, remaining, _event_records(logged, metadata), perf_counter() - start, os.getpid()
+
+
+def advanced_chunk_worker(chunk: List[Tuple[Tuple[int, Tuple[bytes, bytes], int], int]]) -> Tuple[SampleCounts, Optional[np.ndarray], float, int]:
+    """
+    Second stage of load_sample: aligns the pairs simple_chunk_worker could not resolve.
+    :param chunk: List of (data, reason) as returned by simple_chunk_worker
+    :return: Counts of the pairs, their event log records (None if not logged), the time spent and the process id of
+        the worker
+    """
+    start = perf_counter()
+    metadata = _installed
+    counts = metadata.new_counts()
+    logged = []
+
+    for data, reason in chunk:
+        result = advanced_worker(data, reason, metadata)
+        counts.add(result)
+
+        if metadata.log_events:
+            logged.append((data[0], result))
+
+    counts.events.flush()
+
+    return counts, _event_records(logged, metadata), perf_counter() - start, os.getpid()
@@ -28,10 +28,13 @@ setup(
         "colorama",
         "numpy",
         "scipy",
-        "BioPython",
         "matplotlib"
     ],
 
+    extras_require={
+        "numba": ["numba"],
+    },
+
     entry_points={
         "console_scripts": [
             'deliqc=deliqc.cli.main:main',
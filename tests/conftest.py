@@ -0,0 +1,56 @@
+import gzip
+import os
+import numpy as np
+import pytest
+
+from deliqc.benchmark import CUAAC_TEMPLATE, generate_reads
+
+# CuAAC template with two codons, so that results can be split on them
+TEMPLATE = CUAAC_TEMPLATE[:40] + "NNN" + CUAAC_TEMPLATE[43:60] + "NNN" + CUAAC_TEMPLATE[63:]
+
+
+def _lower_qualities(fn: str, rate: float, rng: np.random.Generator):
+    with gzip.open(fn, "rt") as fh:
+        lines = fh.read().splitlines()
+
+    for i in range(3, len(lines), 4):
+        low = rng.random(len(lines[i])) < rate
+        lines[i] = "".join("#" if is_low else quality for quality, is_low in zip(lines[i], low))
+
+    with gzip.open(fn, "wt") as fh:
+        fh.write("\n".join(lines) + "\n")
+
+
+@pytest.fixture(scope="session")
+def template() -> str:
+    return TEMPLATE
+
+
+@pytest.fixture(scope="session")
+def synthetic_sample(tmp_path_factory):
+    """
+    Returns a function writing a gzip compressed synthetic sample (see generate_reads) of the template with two codons,
+    which returns the names of its read files. With low_quality_rate, bases get a Phred quality of 2 instead of 37 at
+    this rate. Samples with the same arguments are only written once.
+    """
+    directory = tmp_path_factory.mktemp("synthetic")
+    written = {}
+
+    def write(reads: int, seed: int = 0, low_quality_rate: float = 0, **kwargs):
+        key = (reads, seed, low_quality_rate, tuple(sorted(kwargs.items())))
+
+        if key not in written:
+            fn1 = os.path.join(directory, f"sample_{len(written)}_1.fq.gz")
+            fn2 = os.path.join(directory, f"sample_{len(written)}_2.fq.gz")
+            generate_reads(fn1, fn2, reads, TEMPLATE, seed=seed, **kwargs)
+
+            if low_quality_rate > 0:
+                rng = np.random.default_rng(seed)
+                for fn in (fn1, fn2):
+                    _lower_qualities(fn, low_quality_rate, rng)
+
+            written[key] = (fn1, fn2)
+
+        return written[key]
+
+    return write
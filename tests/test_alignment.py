@@ -0,0 +1,94 @@
+import pytest
+
+from deliqc import dna
+from deliqc.sample.alignment import check_backend, _simple_analyzer, _shifted_analyzer, _advanced_analyzer
+from deliqc.sample.banded import BAND
+from deliqc.sample.errors import TooManyMismatchesBetweenPair, TooManyMismatchesToReference
+from deliqc.sample.kernels import available
+from deliqc.sample.prefilter import ADAPTERS
+from deliqc.sample.reader import read_batches
+from deliqc.sample.worker import WorkerData
+
+BACKENDS = [pytest.param(name, marks=pytest.mark.skipif(not available(name), reason=f"{name} is not installed")) for name in ("numpy", "numba")]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_check_backend_on_whole_reads(template, synthetic_sample, backend):
+    # Reads of 120 bases run through the template into the adapters
+    fn1, fn2 = synthetic_sample(200, pair_mismatch_rate=0.05)
+    batch = next(read_batches(fn1, fn2, 200))
+
+    assert batch.r1.shape[1] > len(template)
+
+    differences = check_backend(
+        backend, batch, template,
+        max_pair_mismatches=0,
+        max_point_mutations=5,
+        prefer_mate=False,
+        split_on_codon=1,
+        codons=["AAA", "CCC"],
+    )
+
+    assert differences == 0
+
+
+def _worker_data(template: str) -> WorkerData:
+    return WorkerData(
+        reference=template,
+        max_pair_mismatches=0,
+        prefer_mate=False,
+        max_point_mutations=5,
+        split_on_codon=1,
+        codons=["ACG", "TTC"],
+    )
+
+
+def _pair(amplicon: str, read_length: int = 120):
+    """
+    Returns the read pair of an amplicon, both mates reading through into the adapters.
+    """
+    r1 = dna.reverse_complement(amplicon) + ADAPTERS["TruSeq read 1"]
+    r2 = amplicon + ADAPTERS["TruSeq read 2"]
+
+    return r1[:read_length].encode("ascii"), r2[:read_length].encode("ascii")
+
+
+def _amplicon(template: str) -> str:
+    return template.replace("NNN", "ACG", 1).replace("NNN", "TTC", 1)
+
+
+@pytest.mark.parametrize("size", [1, 2])
+@pytest.mark.parametrize("kind", ["insertion", "deletion"])
+def test_shifted_analyzer_like_alignment(template, kind, size):
+    data = _worker_data(template)
+    reference = data.reference
+    amplicon = _amplicon(template)
+
+    # Within the last BAND bases, the alignment may also end the read early instead of placing the indel
+    for position in range(3, len(template) - BAND):
+        if kind == "insertion":
+            mutated = amplicon[:position] + "GT"[:size] + amplicon[position:]
+        else:
+            mutated = amplicon[:position] + amplicon[position + size:]
+        r1, r2 = _pair(mutated)
+
+        with pytest.raises((TooManyMismatchesBetweenPair, TooManyMismatchesToReference)):
+            _simple_analyzer(r1, r2, **data.kwargs, packed_reference=reference.packedReference)
+
+        shifted = _shifted_analyzer(r1, r2, **data.kwargs, reference_codes=reference.codes)
+        aligned = _advanced_analyzer(r1, r2, **data.kwargs, profile=reference.profile, adapter_seeds=reference.adapterSeeds)
+
+        # Deletions of codon bases show in the codons instead of the events
+        assert len(shifted.events) > 0 or shifted.codons != ["ACG", "TTC"]
+        assert sorted(shifted.events) == sorted(aligned.events), position
+        assert shifted.codons == aligned.codons
+        assert shifted.codon == aligned.codon
+
+
+def test_shifted_analyzer_leaves_two_indels_to_the_alignment(template):
+    data = _worker_data(template)
+    amplicon = _amplicon(template)
+    r1, r2 = _pair(amplicon[:20] + amplicon[21:70] + "G" + amplicon[70:])
+
+    with pytest.raises((TooManyMismatchesBetweenPair, TooManyMismatchesToReference)):
+        _shifted_analyzer(r1, r2, **data.kwargs, reference_codes=data.reference.codes)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from deliqc import dna
+from deliqc.benchmark import CUAAC_TEMPLATE
+from deliqc.sample.banded import ReferenceProfile, AlignmentEvents, BAND, OP_NONE
+from deliqc.sample.errors import WeirdReads
+from deliqc.sample.kernels import available, get_backend
+from deliqc.sample.result import FailedReadResult
+from deliqc.sample.worker import WorkerData, advanced_worker
+
+BACKENDS = [pytest.param(name, marks=pytest.mark.skipif(not available(name), reason=f"{name} is not installed")) for name in ("numpy", "numba")]
+
+profile = ReferenceProfile(CUAAC_TEMPLATE)
+L = len(profile)
+
+
+def _query(length: int) -> np.ndarray:
+    return dna.baseIndexCodes[dna.encode(CUAAC_TEMPLATE[:length])]
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("length", [L, L - 1, L - 2, L - BAND])
+def test_short_query_has_no_end_deletions(backend, length):
+    query = _query(length)
+    ops = get_backend(backend).banded_align_single(profile.scores, query)
+    events = AlignmentEvents(ops[np.newaxis, :], profile.codes, query[np.newaxis, :])
+
+    assert events.deletions.sum() == 0
+    assert events.insertions.sum() == 0
+    assert events.mismatches.sum() == 0
+    assert events.aligned[0].tobytes().decode("ascii") == CUAAC_TEMPLATE[:length] + "N" * (L - length)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("length", [L - BAND - 1, 80, 40])
+def test_query_below_band_cannot_be_aligned(backend, length):
+    with pytest.raises(WeirdReads):
+        get_backend(backend).banded_align_single(profile.scores, _query(length))
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_batch_leaves_unaligned_queries_empty(backend):
+    lengths = np.array([L, L - 1, L - 2, L - BAND - 1, 40])
+    queries = np.full((len(lengths), L), 4, dtype=np.int8)
+    for row, length in enumerate(lengths):
+        queries[row, :length] = _query(length)
+
+    ops = get_backend(backend).banded_align(profile.scores, queries, lengths)
+
+    assert ((ops != OP_NONE).sum(axis=1) == [L, L - 1, L - 2, 0, 0]).all()
+
+
+@pytest.mark.parametrize("length", [L - 1, L - 2, L - BAND - 1, 40])
+def test_short_pairs(length):
+    data = WorkerData(
+        reference=CUAAC_TEMPLATE,
+        max_pair_mismatches=0,
+        prefer_mate=False,
+        max_point_mutations=5,
+        split_on_codon=0,
+        codons=[],
+    )
+    amplicon = CUAAC_TEMPLATE[:length]
+    pair = (dna.reverse_complement(amplicon), amplicon)
+
+    result = advanced_worker((0, pair, 1), FailedReadResult.tooManyMismatchesToReference, data)
+
+    if length >= L - BAND:
+        assert result.events == []
+    else:
+        assert isinstance(result, FailedReadResult)
+        assert result.unmerged
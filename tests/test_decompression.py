@@ -0,0 +1,158 @@
+import gzip
+import os
+import struct
+import zlib
+import numpy as np
+import pytest
+
+from deliqc.sample.decompression import (
+    BackgroundGzipReader, MappedReader, ParallelBGZFReader, is_bgzf, is_gzip, open_fastq,
+)
+from deliqc.sample.reader import read_lines, read_sequence_blocks
+
+READS = 3000
+# Uncompressed size of the BGZF blocks and gzip members, which do not end at record boundaries
+BLOCK_SIZE = 6_007
+
+
+def _bgzf_block(data: bytes) -> bytes:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+
+    # Gzip header with the BC extra field holding the size of the whole block - 1
+    header = struct.pack("<BBBBIBBHBBHH", 0x1f, 0x8b, 8, 4, 0, 0, 255, 6, 66, 67, 2, 18 + len(deflated) + 8 - 1)
+
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+@pytest.fixture(scope="module")
+def fastq(tmp_path_factory):
+    """
+    Writes the same fastq records as plain file, single member gzip, multi-member gzip and BGZF file. Returns the
+    uncompressed data and the file name of each format.
+    """
+    directory = tmp_path_factory.mktemp("decompression")
+    rng = np.random.default_rng(0)
+
+    records = []
+    for i in range(READS):
+        sequence = "".join(rng.choice(list("ACGT"), size=120))
+        records.append(f"@SYN:1:FC:1:1101:{i}:0 1:N:0:1\n{sequence}\n+\n{'F' * 120}\n")
+    data = "".join(records).encode("ascii")
+
+    blocks = [data[start:start + BLOCK_SIZE] for start in range(0, len(data), BLOCK_SIZE)]
+    contents = {
+        "plain": data,
+        "gzip": gzip.compress(data),
+        "members": b"".join(gzip.compress(block) for block in blocks),
+        # BGZF files end with an empty block
+        "bgzf": b"".join(_bgzf_block(block) for block in blocks) + _bgzf_block(b""),
+    }
+
+    files = {}
+    for name, content in contents.items():
+        files[name] = os.path.join(directory, f"reads_{name}.fq" + ("" if name == "plain" else ".gz"))
+        with open(files[name], "wb") as fh:
+            fh.write(content)
+
+    return data, files
+
+
+def _read_all(fh, size: int) -> bytes:
+    parts = []
+    while True:
+        part = fh.read(size)
+        if len(part) == 0:
+            return b"".join(parts)
+
+        assert size < 0 or len(part) <= size
+        parts.append(part)
+
+
+def test_formats(fastq):
+    data, files = fastq
+
+    assert not is_gzip(files["plain"])
+    assert all(is_gzip(files[name]) for name in ("gzip", "members", "bgzf"))
+    assert is_bgzf(files["bgzf"])
+    assert not any(is_bgzf(files[name]) for name in ("plain", "gzip", "members"))
+
+    with gzip.open(files["bgzf"], "rb") as fh:
+        assert fh.read() == data
+
+
+@pytest.mark.parametrize("size", [-1, 1, 4093, 1 << 20])
+def test_readers(fastq, size):
+    data, files = fastq
+    readers = [
+        ParallelBGZFReader(files["bgzf"], threads=3, chunk_size=10_000),
+        BackgroundGzipReader(files["gzip"], chunk_size=5_000, max_pending=2),
+        BackgroundGzipReader(files["members"], chunk_size=5_000, max_pending=2),
+        MappedReader(files["plain"]),
+    ]
+
+    if size == 1:
+        # Byte by byte only through the first records
+        for reader in readers:
+            with reader as fh:
+                assert b"".join(fh.read(1) for _ in range(1000)) == data[:1000]
+        return
+
+    for reader in readers:
+        with reader as fh:
+            assert _read_all(fh, size) == data
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_open_fastq(fastq, threads):
+    data, files = fastq
+    expected = {
+        "plain": MappedReader,
+        "gzip": BackgroundGzipReader if threads > 1 else gzip.GzipFile,
+        "members": BackgroundGzipReader if threads > 1 else gzip.GzipFile,
+        "bgzf": ParallelBGZFReader if threads > 1 else gzip.GzipFile,
+    }
+
+    for name, fn in files.items():
+        with open_fastq(fn, threads) as fh:
+            assert isinstance(fh, expected[name])
+            assert _read_all(fh, 1 << 16) == data
+
+
+def test_close_before_the_end(fastq):
+    data, files = fastq
+
+    # The background threads must not hang on their full queues
+    for reader in (ParallelBGZFReader(files["bgzf"], threads=2, chunk_size=1_000), BackgroundGzipReader(files["members"], chunk_size=1_000, max_pending=1)):
+        with reader as fh:
+            assert fh.read(100) == data[:100]
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_sequence_blocks_like_read_lines(fastq, threads):
+    data, files = fastq
+    expected = [line.encode("ascii") for line in read_lines(files["gzip"], READS)]
+
+    for name, fn in files.items():
+        blocks = read_sequence_blocks(fn, READS - 5, batch_size=128, block_size=10_000, threads=threads, with_qualities=True, skip=7)
+        sequences, qualities = [], []
+        for block_sequences, block_qualities in blocks:
+            assert len(block_sequences) <= 128
+            sequences += block_sequences
+            qualities += block_qualities
+
+        assert sequences == expected[7:READS - 5], name
+        assert qualities == [b"F" * 120] * (READS - 12), name
+
+
+@pytest.mark.parametrize("name", ["gzip", "members", "bgzf"])
+def test_truncated_files(fastq, tmp_path, name):
+    data, files = fastq
+    fn = str(tmp_path / "truncated.fq.gz")
+    with open(files[name], "rb") as source, open(fn, "wb") as fh:
+        fh.write(source.read()[:-1000])
+
+    # Like gzip, instead of silently losing the end of the file
+    with pytest.raises(EOFError):
+        with open_fastq(fn, threads=2) as fh:
+            _read_all(fh, 1 << 16)
@@ -0,0 +1,70 @@
+from collections import Counter
+import numpy as np
+import pytest
+
+from deliqc.sample.dedup import PairCollapser
+
+
+def _pairs(n: int, distinct: int, seed: int = 0):
+    # Skewed frequencies like in a library, where few members make up most reads
+    rng = np.random.default_rng(seed)
+    members = rng.zipf(1.5, size=n) % distinct
+
+    return [(f"ACGT{m}".encode("ascii"), f"TGCA{m}".encode("ascii")) for m in members]
+
+
+def _collapse(collapser: PairCollapser, pairs):
+    released = []
+    for i, pair in enumerate(pairs):
+        released.extend(collapser.add(i, pair))
+    released.extend(collapser.flush())
+
+    return released
+
+
+@pytest.mark.parametrize("max_unique", [1, 7, 50, 100_000])
+def test_multiplicities(max_unique):
+    pairs = _pairs(2000, 200)
+    collapser = PairCollapser(max_unique)
+
+    released = _collapse(collapser, pairs)
+
+    # Every read is counted exactly once, with its pair
+    counts = Counter()
+    for read_number, pair, count in released:
+        assert count > 0
+        assert pairs[read_number] == pair
+        counts[pair] += count
+
+    assert counts == Counter(pairs)
+    assert sum(count for _, _, count in released) == len(pairs)
+    assert collapser.unique == len(released)
+
+    if max_unique == 1:
+        # Every pair is released right away
+        assert len(released) == len(pairs)
+    elif max_unique >= len(set(pairs)):
+        # Everything fits into a single window
+        assert len(released) == len(set(pairs))
+
+
+def test_releases_first_read_of_each_window():
+    pairs = [(b"A", b"T"), (b"C", b"G"), (b"A", b"T"), (b"G", b"C"), (b"A", b"T"), (b"A", b"T")]
+    collapser = PairCollapser(2)
+
+    released = []
+    for i, pair in enumerate(pairs):
+        released.append(list(collapser.add(i, pair)))
+    released.append(list(collapser.flush()))
+
+    # The table is full with the second distinct pair, and again with the second distinct pair after that
+    assert released == [
+        [],
+        [(0, (b"A", b"T"), 1), (1, (b"C", b"G"), 1)],
+        [],
+        [(2, (b"A", b"T"), 1), (3, (b"G", b"C"), 1)],
+        [],
+        [],
+        [(4, (b"A", b"T"), 2)],
+    ]
+    assert collapser.unique == 5
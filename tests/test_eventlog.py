@@ -0,0 +1,138 @@
+import numpy as np
+import pytest
+
+from deliqc.sample import eventlog
+from deliqc.sample.eventlog import EventLog, EventLogWriter, event_records, KINDS, NO_EVENT
+from deliqc.sample.reader import read_lines
+from deliqc.sample.result import AlignedReadResult
+from deliqc.sample.worker import WorkerData, worker
+
+READS = 300
+# Records per batch while testing, so that the logs have several batches
+BATCH_RECORDS = 64
+
+
+@pytest.fixture(scope="module")
+def analysed(template, synthetic_sample):
+    """
+    Results of two samples analysed pair by pair, as (read number, result) of each sample.
+    """
+    data = WorkerData(
+        reference=template,
+        max_pair_mismatches=0,
+        prefer_mate=False,
+        max_point_mutations=5,
+        split_on_codon=0,
+        codons=[],
+    )
+
+    samples = []
+    for seed in range(2):
+        fn1, fn2 = synthetic_sample(READS, seed=seed, pair_mismatch_rate=0.05)
+        pairs = zip(read_lines(fn1, READS), read_lines(fn2, READS))
+        samples.append([(i, worker((i, (r1.encode("ascii"), r2.encode("ascii")), 1), data)) for i, (r1, r2) in enumerate(pairs)])
+
+    return data.reference.coordinates, samples
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(eventlog, "BATCH_RECORDS", BATCH_RECORDS)
+
+
+def _write(filename, template, coordinates, samples, resume_at=None) -> int:
+    writer = EventLogWriter(filename, template, coordinates, [("1.fq", "2.fq"), ("3.fq", "4.fq")], resume_at)
+    for sample, results in samples:
+        writer.write(sample, event_records(results, len(coordinates)))
+
+    size = writer.flush()
+    writer.close()
+
+    return size
+
+
+def _records(results, condition) -> int:
+    """
+    Returns the amount of records of the results (one per event, or a single one without events) for which
+    condition(result, event) is True. event is None for records without an event.
+    """
+    count = 0
+    for _, result in results:
+        events = result.events if isinstance(result, AlignedReadResult) and len(result.events) > 0 else [None]
+        count += sum(1 for event in events if condition(result, event))
+
+    return count
+
+
+def test_write_and_select(template, analysed, tmp_path, small_batches):
+    coordinates, samples = analysed
+    filename = str(tmp_path / "events.dqe")
+    _write(filename, template, coordinates, enumerate(samples))
+
+    log = EventLog(filename)
+    assert log.reference == template
+    assert log.coordinates == coordinates
+    assert log.files == [("1.fq", "2.fq"), ("3.fq", "4.fq")]
+    assert max(len(records) for records in log.batches()) == BATCH_RECORDS
+
+    everything = log.select()
+    expected = [event_records(results, len(coordinates)) for results in samples]
+    assert len(everything) == sum(len(records) for records in expected)
+
+    for sample, records in enumerate(expected):
+        selected = log.select(sample=sample)
+        assert (selected["sample"] == sample).all()
+        for field in ("read", "count", "reason", "tier", "kind", "position", "base", "codons"):
+            assert np.array_equal(selected[field], records[field]), field
+
+    # Codons found at the second codon position
+    codon = next(result.codons[1] for _, result in samples[0] if isinstance(result, AlignedReadResult))
+    selected = log.select(codons={1: codon}, sample=0)
+    assert len(selected) > 0
+    assert len(selected) == _records(samples[0], lambda result, event: isinstance(result, AlignedReadResult) and result.codons[1] == codon)
+    assert all(codons[1] == codon for codons in log.decode_codons(selected))
+
+    selected = log.select(position=(30, 60), kind="mismatch")
+    assert len(selected) > 0
+    assert len(selected) == sum(
+        _records(results, lambda result, event: event is not None and 30 <= event[0] < 60 and event[1] == KINDS["mismatch"])
+        for results in samples
+    )
+
+    selected = log.select(kind=["insertion", "deletion"], sample=1)
+    assert len(selected) == _records(samples[1], lambda result, event: event is not None and event[1] in (KINDS["insertion"], KINDS["deletion"]))
+
+    failed = log.select(aligned=False)
+    assert len(failed) > 0
+    assert len(failed) == sum(_records(results, lambda result, event: not isinstance(result, AlignedReadResult)) for results in samples)
+    assert (failed["kind"] == NO_EVENT).all()
+
+
+def test_codon_numbers_are_checked(template, analysed, tmp_path):
+    coordinates, samples = analysed
+    filename = str(tmp_path / "events.dqe")
+    _write(filename, template, coordinates, enumerate(samples))
+
+    with pytest.raises(ValueError):
+        EventLog(filename).select(codons={len(coordinates): "AAA"})
+
+
+def test_resume(template, analysed, tmp_path, small_batches):
+    coordinates, samples = analysed
+    filename = str(tmp_path / "events.dqe")
+    first, rest = samples[0][:100], samples[0][100:]
+
+    size = _write(filename, template, coordinates, [(0, first)])
+    # Records written after the checkpoint by the interrupted run are dropped when resuming
+    with open(filename, "ab") as fh:
+        fh.write(b"\x00" * 1000)
+
+    _write(filename, template, coordinates, [(0, rest), (1, samples[1])], resume_at=size)
+
+    log = EventLog(filename)
+    for sample, results in enumerate(samples):
+        expected = event_records(results, len(coordinates))
+        selected = log.select(sample=sample)
+
+        assert np.array_equal(selected["read"], expected["read"])
+        assert np.array_equal(selected["position"], expected["position"])
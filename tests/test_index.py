@@ -0,0 +1,158 @@
+import gzip
+import os
+import numpy as np
+import pytest
+
+from deliqc.sample.index import FastqIndex, sample_records, shard_records
+from deliqc.sample.reader import read_batches, read_lines
+
+READS = 2000
+TILES = [1101, 1102, 1103, 1104]
+# Uncompressed size of each gzip member, which does not end at record boundaries
+MEMBER_SIZE = 10_007
+# Spacing of the access points of the test indices, so that reading has to jump between them
+SPACING = 8192
+
+
+def _records(n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    records = []
+    for i in range(n):
+        sequence = "".join(rng.choice(list("ACGT"), size=int(rng.integers(90, 130))))
+        records.append(f"@SYN:1:FC:1:{TILES[i % 3 if i < n // 2 else i % 4]}:{i}:0 1:N:0:1\n{sequence}\n+\n{'F' * len(sequence)}\n")
+
+    return records
+
+
+@pytest.fixture(scope="module")
+def fastq(tmp_path_factory):
+    """
+    Writes the same records as plain file and as gzip file of several members, for both mates. Returns the records
+    of each mate and the file names of each format.
+    """
+    directory = tmp_path_factory.mktemp("index")
+    mates = [_records(READS, seed) for seed in range(2)]
+    files = {"plain": [], "gz": []}
+
+    for mate, records in enumerate(mates, start=1):
+        data = "".join(records).encode("ascii")
+
+        fn = os.path.join(directory, f"reads_{mate}.fq")
+        with open(fn, "wb") as fh:
+            fh.write(data)
+        files["plain"].append(fn)
+
+        fn = os.path.join(directory, f"reads_{mate}.fq.gz")
+        with open(fn, "wb") as fh:
+            for start in range(0, len(data), MEMBER_SIZE):
+                fh.write(gzip.compress(data[start:start + MEMBER_SIZE]))
+        files["gz"].append(fn)
+
+    return mates, files
+
+
+@pytest.mark.parametrize("file_format", ["plain", "gz"])
+def test_build_and_read_records(fastq, file_format):
+    mates, files = fastq
+    records = mates[0]
+    index = FastqIndex.build(files[file_format][0], spacing=SPACING)
+
+    assert len(index) == READS
+    assert index.compressed == (file_format == "gz")
+    assert index.tiles.tolist() == [int(record.split(":")[4]) for record in records]
+    assert index.end == sum(len(record) for record in records)
+
+    if file_format == "gz":
+        # Access points are only found at member starts
+        assert len(index.access_points) > 1
+        assert all(uncompressed % MEMBER_SIZE == 0 for _, uncompressed in index.access_points)
+
+    # Forwards through the file, with gaps that jump over access points
+    selected = np.sort(np.random.default_rng(1).choice(READS, 300, replace=False))
+    assert [record.decode("ascii") for record in index.read_records(selected)] == [records[i] for i in selected]
+
+    lines = [records[i].splitlines() for i in selected[:10]]
+    assert list(index.read_sequences(selected[:10])) == [(line[1].encode("ascii"), line[3].encode("ascii")) for line in lines]
+
+
+def test_sidecar(fastq, tmp_path):
+    mates, files = fastq
+    fn = str(tmp_path / "reads.fq.gz")
+    with open(files["gz"][0], "rb") as source, open(fn, "wb") as fh:
+        fh.write(source.read())
+
+    assert FastqIndex.load(fn) is None
+
+    index = FastqIndex.get(fn)
+    assert os.path.exists(FastqIndex.sidecar(fn))
+
+    loaded = FastqIndex.load(fn)
+    assert np.array_equal(loaded.offsets, index.offsets)
+    assert np.array_equal(loaded.tiles, index.tiles)
+    assert np.array_equal(loaded.access_points, index.access_points)
+
+    # A changed file makes the index outdated
+    with open(fn, "ab") as fh:
+        fh.write(gzip.compress(mates[0][0].encode("ascii")))
+
+    assert FastqIndex.load(fn) is None
+    assert len(FastqIndex.get(fn)) == READS + 1
+
+
+def test_sample_records():
+    tiles = np.array([TILES[i % 3 if i < READS // 2 else i % 4] for i in range(READS)])
+
+    assert np.array_equal(sample_records(tiles, 100, "head"), np.arange(100))
+    assert np.array_equal(sample_records(tiles, READS + 10, "random", seed=0), np.arange(READS))
+
+    for mode in ("random", "tile"):
+        records = sample_records(tiles, 500, mode, seed=3)
+
+        assert len(records) == len(np.unique(records)) == 500
+        assert np.array_equal(records, np.sort(records))
+        assert np.array_equal(records, sample_records(tiles, 500, mode, seed=3))
+        assert not np.array_equal(records, sample_records(tiles, 500, mode, seed=4))
+
+    # Every tile contributes in proportion to its size
+    records = sample_records(tiles, 500, "tile", seed=3)
+    for tile in TILES:
+        share = (tiles == tile).sum() * 500 / READS
+        assert abs((tiles[records] == tile).sum() - share) < 1
+
+    with pytest.raises(ValueError):
+        sample_records(tiles, 500, "best")
+
+
+def test_shard_records():
+    records = np.sort(np.random.default_rng(0).choice(READS, 777, replace=False))
+    shards = [shard_records(records, i, 4) for i in range(4)]
+
+    assert np.array_equal(np.concatenate(shards), records)
+    assert max(len(shard) for shard in shards) - min(len(shard) for shard in shards) <= 1
+
+    with pytest.raises(ValueError):
+        shard_records(records, 4, 4)
+
+
+@pytest.mark.parametrize("file_format", ["plain", "gz"])
+@pytest.mark.parametrize("sampling", ["random", "tile"])
+def test_sampled_and_sharded_reads(fastq, tmp_path, file_format, sampling):
+    mates, files = fastq
+    # Indices with close access points, which the readers load as sidecar files
+    for fn in files[file_format]:
+        FastqIndex.build(fn, spacing=SPACING).save()
+
+    expected_records = sample_records(FastqIndex.get(files[file_format][0]).tiles, 500, sampling, seed=5)
+    sequences = [list(read_lines(fn, READS)) for fn in files["plain"]]
+
+    for shard in range(3):
+        records = shard_records(expected_records, shard, 3)
+        expected = [(sequences[0][i].encode("ascii"), sequences[1][i].encode("ascii")) for i in records]
+
+        batches = read_batches(*files[file_format], 500, batch_size=64, sampling=sampling, seed=5, shard=(shard, 3))
+        pairs = [pair for batch in batches for pair in batch.pairs()]
+        assert pairs == expected
+
+        # Continuing after the first 100 pairs of the shard, like after a checkpoint
+        batches = read_batches(*files[file_format], 500, batch_size=64, sampling=sampling, seed=5, shard=(shard, 3), skip=100)
+        assert [pair for batch in batches for pair in batch.pairs()] == expected[100:]
@@ -0,0 +1,76 @@
+import pickle
+import numpy as np
+import pytest
+
+from deliqc.sample import load
+from deliqc.sample.load import load_samples
+
+READS = 6000
+# More than one block of the readers, which end at a boundary where a checkpoint can be taken
+MAX_READS = 5000
+
+
+class Interrupted(Exception):
+    pass
+
+
+@pytest.fixture
+def interrupt_after_checkpoint(monkeypatch):
+    """
+    Makes load_samples stop right after saving its first checkpoint, like an interrupted run.
+    """
+    save = load._save_checkpoint
+
+    def save_and_stop(*args, **kwargs):
+        save(*args, **kwargs)
+        raise Interrupted
+
+    monkeypatch.setattr(load, "_save_checkpoint", save_and_stop)
+
+    return monkeypatch
+
+
+def _assert_same_results(result, expected):
+    for key, value in expected.items():
+        # Stage statistics only cover the part of a resumed run after the checkpoint
+        if key == "stages":
+            continue
+
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(result[key], value), key
+        else:
+            assert result[key] == value, key
+
+
+@pytest.mark.parametrize("sampling", ["head", "random"])
+def test_resume_gives_the_same_results(template, synthetic_sample, tmp_path, interrupt_after_checkpoint, sampling):
+    files = [synthetic_sample(READS, seed=seed, low_quality_rate=0.02) for seed in range(2)]
+    checkpoint = str(tmp_path / "run.checkpoint")
+    options = dict(
+        max_reads=MAX_READS,
+        split_on_codon=[1, 0],
+        codons=["AAA", "CCC", "GGG", "TTT"],
+        threads=2,
+        sampling=sampling,
+        seed=1,
+        max_low_quality_bases=3,
+        raw=True,
+    )
+
+    expected = load_samples(template, files, **options)
+
+    with pytest.raises(Interrupted):
+        load_samples(template, files, checkpoint=checkpoint, checkpoint_interval=0, **options)
+
+    with open(checkpoint, "rb") as fh:
+        state = pickle.load(fh)
+
+    # Interrupted after the first block of each sample
+    assert all(0 < sample["records"] < MAX_READS for sample in state["samples"])
+
+    interrupt_after_checkpoint.undo()
+    results = load_samples(template, files, checkpoint=checkpoint, checkpoint_interval=3600, resume=True, **options)
+
+    assert expected[0]["lowQualityPairs"] > 0
+    for result, expected_result in zip(results, expected):
+        _assert_same_results(result, expected_result)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from deliqc import dna
+from deliqc.sample.prefilter import ADAPTERS, OffTargetFilter
+
+READ_LENGTH = 120
+PRIMER_LENGTH = 20
+
+
+def _pair(insert: str, rng: np.random.Generator):
+    """
+    Returns the read pair of an insert, both mates reading through into their adapters and random bases after them.
+    """
+    r1 = dna.reverse_complement(insert) + ADAPTERS["TruSeq read 1"] + _random_sequence(rng, READ_LENGTH)
+    r2 = insert + ADAPTERS["TruSeq read 2"] + _random_sequence(rng, READ_LENGTH)
+
+    return r1[:READ_LENGTH], r2[:READ_LENGTH]
+
+
+def _random_sequence(rng: np.random.Generator, length: int) -> str:
+    return "".join(rng.choice(list("ACGT"), size=length))
+
+
+def _amplicon(template: str, rng: np.random.Generator) -> str:
+    return "".join(_random_sequence(rng, 1) if base == "N" else base for base in template)
+
+
+def _mutate(sequence: str, rng: np.random.Generator, rate: float) -> str:
+    bases = [rng.choice([b for b in "ACGT" if b != base]) if rng.random() < rate else base for base in sequence]
+
+    # And a deletion and an insertion, which shift the k-mers after them
+    deletion, insertion = sorted(rng.choice(np.arange(10, len(bases) - 10), size=2, replace=False))
+    return "".join(bases[:deletion] + bases[deletion + 1:insertion] + ["G", "T"] + bases[insertion:])
+
+
+@pytest.fixture(scope="module")
+def off_target_filter(template):
+    return OffTargetFilter(template)
+
+
+def test_template_pairs(off_target_filter, template):
+    rng = np.random.default_rng(0)
+
+    for _ in range(100):
+        r1, r2 = _pair(_amplicon(template, rng), rng)
+        assert not off_target_filter.is_off_target(r1, r2)
+        assert not off_target_filter.is_off_target(r1.encode("ascii"), r2.encode("ascii"))
+
+
+def test_heavily_mutated_template_pairs(off_target_filter, template):
+    rng = np.random.default_rng(1)
+
+    # Every 16th base mutated on average, which leaves few k-mers intact
+    for _ in range(100):
+        r1, r2 = _pair(_mutate(_amplicon(template, rng), rng, 0.06), rng)
+        assert not off_target_filter.is_off_target(r1, r2)
+
+
+def test_primer_dimers(off_target_filter, template):
+    rng = np.random.default_rng(2)
+    amplicon = _amplicon(template, rng)
+
+    # Both primers directly joined, followed by the adapters
+    r1, r2 = _pair(amplicon[:PRIMER_LENGTH] + amplicon[-PRIMER_LENGTH:], rng)
+    assert off_target_filter.is_off_target(r1, r2)
+
+    # Or only a primer
+    r1, r2 = _pair(amplicon[:PRIMER_LENGTH], rng)
+    assert off_target_filter.is_off_target(r1, r2)
+
+
+def test_adapter_only_pairs(off_target_filter):
+    rng = np.random.default_rng(3)
+
+    r1, r2 = _pair("", rng)
+    assert r1.startswith(ADAPTERS["TruSeq read 1"]) and r2.startswith(ADAPTERS["TruSeq read 2"])
+    assert off_target_filter.is_off_target(r1, r2)
+
+
+def test_random_pairs(off_target_filter):
+    rng = np.random.default_rng(4)
+
+    for _ in range(100):
+        assert off_target_filter.is_off_target(_random_sequence(rng, READ_LENGTH), _random_sequence(rng, READ_LENGTH))
@@ -0,0 +1,109 @@
+import gzip
+import numpy as np
+import pytest
+
+from deliqc.sample.quality import QualityFilter
+from deliqc.sample.reader import ReadBatch, read_batches, PHRED_OFFSET
+
+REGION = 80
+OPTIONS = [
+    dict(min_mean_quality=34.5),
+    dict(max_low_quality_bases=2),
+    dict(max_low_quality_bases=8, low_quality_threshold=30),
+    dict(trim_quality=10),
+    dict(min_mean_quality=34, max_low_quality_bases=4, trim_quality=5),
+]
+
+
+def _passes(qualities, options) -> bool:
+    """
+    Whether a mate given as list of Phred qualities passes the filter, written out base by base.
+    """
+    if options.get("trim_quality") is not None:
+        low = [i for i, q in enumerate(qualities) if q < options["trim_quality"]]
+        qualities = qualities[:low[0]] if len(low) > 0 else qualities
+
+        if len(qualities) < REGION:
+            return False
+
+    qualities = qualities[:REGION]
+
+    if options.get("min_mean_quality") is not None and sum(qualities) / max(len(qualities), 1) < options["min_mean_quality"]:
+        return False
+
+    threshold = options.get("low_quality_threshold", 20)
+    if options.get("max_low_quality_bases") is not None and sum(1 for q in qualities if q < threshold) > options["max_low_quality_bases"]:
+        return False
+
+    return True
+
+
+def _batch(qualities1, qualities2) -> ReadBatch:
+    def matrix(qualities):
+        width = max(len(q) for q in qualities)
+        lengths = np.array([len(q) for q in qualities], dtype=np.int32)
+        q = np.zeros((len(qualities), width), dtype=np.uint8)
+        for i, row in enumerate(qualities):
+            q[i, :len(row)] = row
+
+        return np.full(q.shape, ord("A"), dtype=np.uint8), lengths, q
+
+    r1, length1, q1 = matrix(qualities1)
+    r2, length2, q2 = matrix(qualities2)
+
+    return ReadBatch(r1, r2, length1, length2, 0, q1, q2)
+
+
+@pytest.mark.parametrize("options", OPTIONS)
+def test_filter_like_base_by_base(options):
+    rng = np.random.default_rng(0)
+
+    def mate():
+        length = int(rng.integers(REGION - 10, REGION + 40))
+        qualities = rng.choice([2, 12, 25, 37], size=length, p=[0.02, 0.02, 0.06, 0.9])
+        return qualities.tolist()
+
+    qualities1 = [mate() for _ in range(500)]
+    qualities2 = [mate() for _ in range(500)]
+    expected = [_passes(q1, options) and _passes(q2, options) for q1, q2 in zip(qualities1, qualities2)]
+
+    quality_filter = QualityFilter(region=REGION, **options)
+    batch = quality_filter.apply(_batch(qualities1, qualities2))
+
+    assert 0 < sum(expected) < len(expected)
+    assert len(batch) == sum(expected)
+    assert quality_filter.rejected == len(expected) - sum(expected)
+    assert np.array_equal(batch.r1, _batch(qualities1, qualities2).r1[expected])
+
+    if "trim_quality" in options:
+        kept = [q1 for q1, passes in zip(qualities1, expected) if passes]
+        trimmed = [min([i for i, q in enumerate(q1) if q < options["trim_quality"]] + [len(q1)]) for q1 in kept]
+        assert batch.length1.tolist() == trimmed
+
+
+def test_inactive_filter_keeps_the_batch():
+    quality_filter = QualityFilter(region=REGION)
+    batch = _batch([[2] * 100], [[2] * 100])
+
+    assert not quality_filter.active
+    assert quality_filter.apply(batch) is batch
+    assert quality_filter.rejected == 0
+
+
+def test_phred_scores_of_the_reader(template, synthetic_sample):
+    fn1, fn2 = synthetic_sample(300, low_quality_rate=0.02)
+
+    options = dict(max_low_quality_bases=2)
+
+    expected = []
+    with gzip.open(fn1, "rt") as fh1, gzip.open(fn2, "rt") as fh2:
+        lines1, lines2 = fh1.read().splitlines(), fh2.read().splitlines()
+        for q1, q2 in zip(lines1[3::4], lines2[3::4]):
+            expected.append(_passes([ord(q) - PHRED_OFFSET for q in q1], options) and _passes([ord(q) - PHRED_OFFSET for q in q2], options))
+
+    quality_filter = QualityFilter(region=REGION, **options)
+    kept = sum(len(quality_filter.apply(batch)) for batch in read_batches(fn1, fn2, 300, batch_size=64, with_qualities=True))
+
+    assert 0 < kept < 300
+    assert kept == sum(expected)
+    assert quality_filter.rejected == 300 - kept
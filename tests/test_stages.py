@@ -0,0 +1,130 @@
+from multiprocessing import Pool
+import numpy as np
+import pytest
+
+from deliqc.sample.counts import SampleCounts
+from deliqc.sample.load import load_samples, file_reader, chunk_reader
+from deliqc.sample.reader import read_lines
+from deliqc.sample.stages import run_stages
+from deliqc.sample.worker import WorkerData, install_worker_data, simple_worker, advanced_worker
+
+READS = 400
+CODONS = ["AAA", "CCC", "GGG", "TTT"]
+# Profiles split on the given codons at the second codon, and sparse splits on both codons
+SPLIT_ON_CODON = [1, 0]
+
+
+def _worker_data(template: str) -> WorkerData:
+    return WorkerData(
+        reference=template,
+        max_pair_mismatches=0,
+        prefer_mate=False,
+        max_point_mutations=5,
+        split_on_codon=SPLIT_ON_CODON[0],
+        codons=CODONS,
+        split_positions=SPLIT_ON_CODON,
+    )
+
+
+def _serial_counts(data: WorkerData, fn1: str, fn2: str) -> SampleCounts:
+    """
+    Counts a sample pair by pair with simple_worker and advanced_worker, without any pool.
+    """
+    counts = data.new_counts()
+    pairs = zip(read_lines(fn1, READS), read_lines(fn2, READS))
+
+    for i, (r1, r2) in enumerate(pairs):
+        pair = (i, (r1.encode("ascii"), r2.encode("ascii")), 1)
+        result, reason = simple_worker(pair, data)
+
+        if result is None:
+            result = advanced_worker(pair, reason, data)
+
+        counts.add(result)
+
+    counts.events.flush()
+
+    return counts
+
+
+def _files(synthetic_sample, samples: int):
+    return [synthetic_sample(READS, seed=seed, pair_mismatch_rate=0.05) for seed in range(samples)]
+
+
+def _assert_same_counts(counts: SampleCounts, expected: SampleCounts):
+    for key in ("reads", "alignedReads", "mismatchedPairs", "tooManyPointMutations", "offTargetPairs", "unmergedPairs"):
+        assert getattr(counts, key) == getattr(expected, key), key
+
+    assert dict(counts.alignedReadsPerCodon) == dict(expected.alignedReadsPerCodon)
+    assert dict(counts.resolvedBy) == dict(expected.resolvedBy)
+    assert counts.splits.to_dict() == expected.splits.to_dict()
+    assert counts.splits.unassigned == expected.splits.unassigned
+    assert counts.members.to_dict() == expected.members.to_dict()
+
+    for key in ("mismatches", "mutationTarget", "indels", "insertionTarget"):
+        assert np.array_equal(getattr(counts.events, key), getattr(expected.events, key)), key
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+@pytest.mark.parametrize("samples", [1, 3])
+def test_run_stages_counts_like_serial_workers(template, synthetic_sample, threads, samples):
+    data = _worker_data(template)
+    files = _files(synthetic_sample, samples)
+
+    counts = [data.new_counts() for _ in files]
+    # Small chunks and alignment batches, so that both stages get many tasks
+    chunks = [chunk_reader(file_reader(fn1, fn2, READS), 50) for fn1, fn2 in files]
+
+    with Pool(threads, initializer=install_worker_data, initargs=(data,)) as pool:
+        stats = run_stages(pool, chunks, counts, threads, align_batches=5)
+
+    for sample_counts, sample_stats, (fn1, fn2) in zip(counts, stats, files):
+        expected = _serial_counts(data, fn1, fn2)
+        sample_counts.events.flush()
+
+        _assert_same_counts(sample_counts, expected)
+        assert sample_stats["simple"].pairs == READS
+        assert sample_stats["advanced"].pairs == READS - sum(expected.resolvedBy[tier] for tier in ("simple", "shifted")) - expected.offTargetPairs
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+@pytest.mark.parametrize("samples", [1, 3])
+def test_load_samples_counts_like_serial_workers(template, synthetic_sample, threads, samples):
+    data = _worker_data(template)
+    files = _files(synthetic_sample, samples)
+
+    results = load_samples(
+        template, files,
+        max_reads=READS,
+        split_on_codon=SPLIT_ON_CODON,
+        codons=CODONS,
+        threads=threads,
+        batches=50,
+        align_batches=5,
+        raw=True,
+    )
+
+    assert len(results) == samples
+
+    for result, (fn1, fn2) in zip(results, files):
+        expected = _serial_counts(data, fn1, fn2)
+
+        for key in ("reads", "alignedReads", "mismatchedPairs", "tooManyPointMutations", "offTargetPairs", "unmergedPairs"):
+            assert result[key] == getattr(expected, key), key
+
+        assert result["alignedReadsPerCodon"] == dict(expected.alignedReadsPerCodon)
+        assert result["resolvedBy"] == dict(expected.resolvedBy)
+        assert result["splits"] == expected.splits.to_dict()
+        assert result["libraryMembers"] == expected.members.to_dict()
+
+        for key in ("mismatches", "mutationTarget", "indels", "insertionTarget"):
+            assert np.array_equal(result[key], getattr(expected.events, key)), key
+
+
+def test_replicates_on_one_worker_count_every_pair(template, synthetic_sample):
+    # Many mismatched pairs wait for an alignment, spread over the replicates without any of them filling a batch
+    files = [synthetic_sample(600, seed=seed, pair_mismatch_rate=0.12) for seed in range(4)]
+
+    results = load_samples(template, files, max_reads=600, threads=1, max_unique_pairs=0)
+
+    assert [result["reads"] for result in results] == [600] * 4
@@ -0,0 +1,87 @@
+import pickle
+import numpy as np
+import pytest
+
+from deliqc.sample.load import EVENT_KEYS, load_samples, normalise_result, average_results
+from deliqc.sample.store import ResultFile, save_result, convert_pickle, load_result, is_result_file
+
+CODONS = ["AAA", "CCC", "GGG", "TTT"]
+
+
+@pytest.fixture(scope="module")
+def raw_results(template, synthetic_sample):
+    files = [synthetic_sample(300, seed=seed, pair_mismatch_rate=0.05) for seed in range(2)]
+
+    return load_samples(template, files, max_reads=300, split_on_codon=[1, 0], codons=CODONS, threads=1, raw=True)
+
+
+def _sample(template: str) -> dict:
+    return {"title": "test", "reference": template, "splitOnCodon": [1, 0], "splitOnCodonSequences": CODONS}
+
+
+def _assert_same(a, b):
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            _assert_same(a[key], b[key])
+    elif isinstance(a, (list, tuple)):
+        assert type(a) is type(b) and len(a) == len(b)
+        for x, y in zip(a, b):
+            _assert_same(x, y)
+    elif isinstance(a, np.ndarray):
+        assert np.allclose(a, b, equal_nan=True)
+    else:
+        assert a == b
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_save_and_load(template, raw_results, tmp_path, compress):
+    filename = str(tmp_path / "sample.dqr")
+    save_result(filename, _sample(template), raw_results, compress)
+
+    assert is_result_file(filename)
+
+    result_file = ResultFile(filename)
+    assert len(result_file) == len(raw_results)
+    assert result_file.title == "test"
+    assert result_file.reference == template
+    assert result_file.codons == CODONS
+
+    for i, raw in enumerate(raw_results):
+        _assert_same(result_file.raw_result(i), raw)
+
+        for key in EVENT_KEYS:
+            counts = result_file.counts(key, i)
+            assert isinstance(counts, np.memmap) != compress
+            assert np.array_equal(counts, raw[key])
+
+        assert np.array_equal(result_file.denominators(i), [raw["alignedReads"]] + [raw["alignedReadsPerCodon"].get(codon, 0) for codon in CODONS])
+
+    normalised = [normalise_result(raw, CODONS) for raw in raw_results]
+    _assert_same(load_result(filename), average_results("test", template, [1, 0], CODONS, normalised))
+
+    for key in EVENT_KEYS:
+        mean, std = result_file.summary(key)
+        assert np.allclose(mean, np.mean([result[key] for result in normalised], axis=0), equal_nan=True)
+
+
+def test_convert_pickle(template, raw_results, tmp_path):
+    normalised = [normalise_result(raw, CODONS) for raw in raw_results]
+    sample = average_results("test", template, [1, 0], CODONS, normalised)
+
+    pickle_filename = str(tmp_path / "sample.pickle")
+    with open(pickle_filename, "wb") as fh:
+        pickle.dump(sample, fh)
+
+    assert not is_result_file(pickle_filename)
+    _assert_same(load_result(pickle_filename), sample)
+
+    filename = str(tmp_path / "sample.dqr")
+    assert convert_pickle(pickle_filename, filename) == len(raw_results)
+
+    result_file = ResultFile(filename)
+    for i, raw in enumerate(raw_results):
+        for key in EVENT_KEYS:
+            assert np.array_equal(result_file.counts(key, i), raw[key])
+
+    _assert_same(result_file.to_sample(), sample)